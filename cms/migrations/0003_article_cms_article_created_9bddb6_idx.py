@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0002_sitemapentry_metatag'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['created_at', 'id'], name='cms_article_created_9bddb6_idx'),
+        ),
+    ]
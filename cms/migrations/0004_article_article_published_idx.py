@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cms', '0003_article_cms_article_created_9bddb6_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['published_at'], name='article_published_idx'),
+        ),
+    ]
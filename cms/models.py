@@ -1,10 +1,11 @@
 from django.db import models
-from django.utils.text import slugify
 from django.contrib.auth.models import User
 from decimal import Decimal # For SitemapEntry priority choices
 
+from core.slugs import UniqueSlugMixin
+
 # CMS Specific Category
-class CmsCategory(models.Model):
+class CmsCategory(UniqueSlugMixin, models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
     description = models.TextField(blank=True)
@@ -14,32 +15,24 @@ class CmsCategory(models.Model):
         verbose_name_plural = "CMS Categories"
         ordering = ['name']
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
 # Tag Model
-class Tag(models.Model):
+class Tag(UniqueSlugMixin, models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
 
     class Meta:
         ordering = ['name']
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
 # Article Model
-class Article(models.Model):
+class Article(UniqueSlugMixin, models.Model):
+    slug_source = 'title'
+
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     content = models.TextField()
@@ -55,18 +48,14 @@ class Article(models.Model):
 
     class Meta:
         ordering = ['-published_at', '-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']), # keyset pagination (core.pagination)
+            # The public article list. Partial rather than (is_published, published_at): Django
+            # renders is_published=True as a bare `WHERE "is_published"`, which SQLite can't seek.
+            models.Index(fields=['published_at'], condition=models.Q(is_published=True), name='article_published_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            # Create a unique slug if multiple articles have the same title
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            # Check for uniqueness
-            while Article.objects.filter(slug=slug).exists() and (self.pk is None or Article.objects.get(pk=self.pk).slug != slug) :
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
         if self.is_published and not self.published_at:
             from django.utils import timezone
             self.published_at = timezone.now()
@@ -76,7 +65,9 @@ class Article(models.Model):
         return self.title
 
 # Page Model (Simplified version, could be extended)
-class Page(models.Model):
+class Page(UniqueSlugMixin, models.Model):
+    slug_source = 'title'
+
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     content = models.TextField()
@@ -91,14 +82,6 @@ class Page(models.Model):
         ordering = ['title']
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Page.objects.filter(slug=slug).exists() and (self.pk is None or Page.objects.get(pk=self.pk).slug != slug):
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
         if self.is_published and not self.published_at:
             from django.utils import timezone
             self.published_at = timezone.now()
@@ -0,0 +1,44 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import conditional
+
+from .models import Article, CmsCategory, Comment, Page, Tag
+
+
+# Article representations embed comments, categories and tags; touching updated_at when those
+# change keeps the API's ETag/Last-Modified validators (core/conditional.py) honest.
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_commented_article(sender, instance, **kwargs):
+    Article.objects.filter(pk=instance.article_id).update(updated_at=timezone.now())
+
+@receiver(m2m_changed, sender=Article.categories.through)
+@receiver(m2m_changed, sender=Article.tags.through)
+def touch_retagged_article(sender, instance, action, reverse, pk_set, **kwargs):
+    # Clears are handled before they happen, while the affected articles can still be found.
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        articles = Article.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear': # instance is the category/tag
+        articles = instance.articles.all()
+    else:
+        articles = Article.objects.filter(pk__in=pk_set)
+    articles.update(updated_at=timezone.now())
+
+@receiver(post_save, sender=CmsCategory)
+@receiver(post_save, sender=Tag)
+def touch_articles_of_renamed_label(sender, instance, created, raw=False, **kwargs):
+    if not raw and not created:
+        instance.articles.update(updated_at=timezone.now())
+
+
+# Change markers of the conditional GET lists (see core/conditional.py)
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+@receiver(post_save, sender=Page)
+@receiver(post_delete, sender=Page)
+def touch_conditional_lists(sender, **kwargs):
+    conditional.touch(sender)
@@ -1,3 +1,117 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.db import IntegrityError
 from django.test import TestCase
+from django.utils import timezone
+
+from core.query_count import QueryBudgetMixin
+from core.query_plans import HotPath, QueryPlanMixin
+from core.sample_data import create_sample_rows
+from core.slugs import SUFFIX_RESERVE, allocate_slugs
+
+from .models import Article, Page, Tag
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    router_module = 'cms.api_urls'
+    budgets = {
+        'cms-category-list': 3,
+        'tag-list': 3,
+        'article-list': 6,        # + categories, tags, comments
+        'article-detail': 6,
+        'meta-tag-list': 5,       # + the tagged objects, one query per content type
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    def test_published_articles(self):
+        self.assertIndexSeeks(HotPath('Published articles', ['cms_article'], view='cms.views.ArticleViewSet', user='anonymous'))
+
+
+class ListOrderTests(TestCase):
+    """The paginated lists keep each model's Meta.ordering across pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+        now = timezone.now()
+        # Created in the opposite order to their publication dates.
+        for days_ago in (1, 5, 3, 2, 4):
+            Article.objects.create(title=f'Dated {days_ago}', content='.', is_published=True, published_at=now - timedelta(days=days_ago))
+        for title in ('Zebra', 'Aardvark', 'Mongoose'):
+            Page.objects.create(title=title, content='.', is_published=True)
+
+    def walk(self, url):
+        rows = []
+        response = self.client.get(url, {'page_size': 2})
+        while True:
+            rows.extend(response.json()['results'])
+            if not response.json()['next']:
+                return rows
+            response = self.client.get(response.json()['next'])
+
+    def test_articles_newest_published_first(self):
+        rows = self.walk('/api/cms/articles/')
+        expected = list(Article.objects.filter(is_published=True, published_at__lte=timezone.now()).values_list('slug', flat=True))
+        self.assertEqual([row['slug'] for row in rows], expected)
+        dated = [row['title'] for row in rows if row['title'].startswith('Dated')]
+        self.assertEqual(dated, [f'Dated {days_ago}' for days_ago in (1, 2, 3, 4, 5)])
+
+    def test_pages_by_title(self):
+        titles = [row['title'] for row in self.walk('/api/cms/pages/')]
+        self.assertEqual(titles, sorted(titles))
+        self.assertEqual(titles, list(Page.objects.filter(is_published=True).values_list('title', flat=True)))
+
+
+class SlugTests(TestCase):
+    """core/slugs.py: allocate_slugs() and UniqueSlugMixin, on cms models."""
+
+    def test_lowest_free_suffixes(self):
+        for slug in ('news', 'news-2', 'news-extra', 'news-extra-1', 'newsletter'):
+            Tag.objects.create(name=slug, slug=slug)
+        self.assertEqual(allocate_slugs(Tag, ['news', 'news', 'news', 'other']), ['news-1', 'news-3', 'news-4', 'other'])
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            allocate_slugs(Tag, ['a', 'b', 'a'])
+
+    def test_reserved_and_excluded(self):
+        tag = Tag.objects.create(name='Sports')
+        self.assertEqual(allocate_slugs(Tag, ['sports'], reserved={'sports-1'}), ['sports-2'])
+        self.assertEqual(allocate_slugs(Tag, ['sports'], exclude_pk=tag.pk), ['sports'])
+
+    def test_long_and_empty_bases(self):
+        max_length = Tag._meta.get_field('slug').max_length
+        long_slug, = allocate_slugs(Tag, ['x' * 500])
+        self.assertEqual(long_slug, 'x' * (max_length - SUFFIX_RESERVE))
+        self.assertEqual(allocate_slugs(Tag, ['', '---']), ['tag', 'tag-1'])
+
+    def test_mixin_fills_blank_slugs_only(self):
+        first = Article.objects.create(title='Hello World', content='.')
+        second = Article.objects.create(title='Hello World!', content='.')
+        chosen = Article.objects.create(title='Hello World', slug='my-own', content='.')
+        self.assertEqual([first.slug, second.slug, chosen.slug], ['hello-world', 'hello-world-1', 'my-own'])
+        first.title = 'Renamed'
+        first.save()
+        self.assertEqual(first.slug, 'hello-world')
+
+    def test_save_retries_after_losing_the_race(self):
+        Article.objects.create(title='Race', content='.')
+        # A concurrent save took 'race' after it was allocated for this one.
+        allocations = iter([['race']])
+        with mock.patch('core.slugs.allocate_slugs', side_effect=lambda *args, **kwargs: next(allocations, None) or allocate_slugs(*args, **kwargs)):
+            article = Article.objects.create(title='Race', content='.')
+        self.assertEqual(article.slug, 'race-1')
 
-# Create your tests here.
+    def test_save_gives_up_after_max_attempts(self):
+        Article.objects.create(title='Race', content='.')
+        with mock.patch('core.slugs.allocate_slugs', return_value=['race']) as allocate:
+            with self.assertRaises(IntegrityError):
+                Article.objects.create(title='Race', content='.')
+        self.assertEqual(allocate.call_count, Article.slug_max_attempts)
+        self.assertEqual(Article.objects.filter(title='Race').count(), 1)
@@ -10,11 +10,15 @@ from .forms import ArticleForm, PageForm, CmsCategoryForm, TagForm, CommentAdmin
 from rest_framework import viewsets, generics, permissions, status # Ensure status is imported
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Prefetch
 from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.contrib.contenttypes.models import ContentType # For MetaTag view
 
+from core.conditional import ConditionalGetMixin
+from core.pagination import KeysetPagination, paginate_for_template
+
 from .models import CmsCategory, Tag, Article, Page, Comment, MetaTag, SitemapEntry # Added MetaTag, SitemapEntry
 from .serializers import (
     CmsCategorySerializer, TagSerializer, ArticleSerializer, 
@@ -44,10 +48,12 @@ class TagViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name']
     lookup_field = 'slug'
 
-class ArticleViewSet(viewsets.ModelViewSet):
+class ArticleViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Article.objects.filter(is_published=True).select_related('author').prefetch_related('categories', 'tags', 'comments')
     serializer_class = ArticleSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly] 
+    pagination_class = KeysetPagination
+    keyset_ordering = ('-published_at', '-created_at') # Article.Meta.ordering
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = {
         'categories__slug': ['exact'],
@@ -64,7 +70,9 @@ class ArticleViewSet(viewsets.ModelViewSet):
         queryset = Article.objects.all() # Start with all for staff/admin
         if not self.request.user.is_staff: # Filter for non-staff
             queryset = queryset.filter(is_published=True, published_at__lte=timezone.now())
-        return queryset.select_related('author').prefetch_related('categories', 'tags', 'comments')
+        # CommentSerializer shows each comment's user.
+        comments = Prefetch('comments', queryset=Comment.objects.select_related('user'))
+        return queryset.select_related('author').prefetch_related('categories', 'tags', comments)
 
 
     def perform_create(self, serializer):
@@ -118,15 +126,17 @@ class ArticleViewSet(viewsets.ModelViewSet):
         article = self.get_object()
         # For API, maybe show unapproved to article author or admin
         # For now, only approved
-        comments = Comment.objects.filter(article=article, is_approved=True) 
+        comments = Comment.objects.filter(article=article, is_approved=True).select_related('user')
         serializer = CommentSerializer(comments, many=True, context={'request': request})
         return Response(serializer.data)
 
 
-class PageViewSet(viewsets.ModelViewSet):
+class PageViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Page.objects.all() # Show all for staff/admin
     serializer_class = PageSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly] 
+    pagination_class = KeysetPagination
+    keyset_ordering = ('title',) # Page.Meta.ordering
     filter_backends = [SearchFilter, OrderingFilter, DjangoFilterBackend]
     filterset_fields = ['is_published']
     search_fields = ['title', 'content']
@@ -150,9 +160,10 @@ class PageViewSet(viewsets.ModelViewSet):
             serializer.save()
 
 class MetaTagViewSet(viewsets.ModelViewSet):
-    queryset = MetaTag.objects.all().select_related('content_type')
+    queryset = MetaTag.objects.all().select_related('content_type').prefetch_related('content_object') # one query per content type
     serializer_class = MetaTagSerializer
     permission_classes = [permissions.IsAdminUser] 
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = {
         'name': ['exact', 'icontains'],
@@ -201,9 +212,11 @@ class SitemapEntryViewSet(viewsets.ModelViewSet):
 # Django Template Views for CMS Management (AdminLTE)
 @staff_member_required
 def article_list_view(request):
-    articles = Article.objects.all().select_related('author').prefetch_related('categories', 'tags').order_by('-created_at')
+    articles = Article.objects.all().select_related('author').prefetch_related('categories', 'tags')
+    articles, pagination = paginate_for_template(request, articles, ordering=ArticleViewSet.keyset_ordering)
     context = {
         'articles': articles,
+        'pagination': pagination,
         'page_title': 'Article List',
         'breadcrumb_active': 'Articles'
     }
@@ -375,9 +388,11 @@ def tag_edit_view(request, tag_slug):
 # Page Management (Simplified for now, similar to Articles)
 @staff_member_required
 def page_list_view(request):
-    pages = Page.objects.all().select_related('author').order_by('-created_at')
+    pages = Page.objects.all().select_related('author')
+    pages, pagination = paginate_for_template(request, pages, ordering=PageViewSet.keyset_ordering)
     context = {
         'pages_list': pages, 
+        'pagination': pagination,
         'page_title': 'Page List',
         'breadcrumb_active': 'Pages'
     }
@@ -3,6 +3,10 @@ ASGI config for core project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The payment and refund views (finance/views.py) are async and wait on the payment gateway
+without holding a worker thread when served from here, e.g. ``uvicorn core.asgi:application``.
+Under WSGI they still work, one thread per request in flight.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -0,0 +1,239 @@
+"""
+Shared pieces of the benchmark commands (manage.py benchmark_*).
+
+A benchmark never touches the configured database: BenchmarkCommand creates a throwaway
+test database the way the test runner does (migrations included), generates its rows there
+with bulk_create, runs and destroys it. The test environment is set up as well, so requests
+made through django.test.Client pass ALLOWED_HOSTS.
+
+The row counts are options. Their defaults are the scales quoted in the commit messages, and
+a smaller run finishes in seconds. Timings are wall clock on whatever machine runs them.
+"""
+import datetime
+import multiprocessing
+import random
+import resource
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+
+BATCH_SIZE = 5000
+
+
+class BenchmarkCommand(BaseCommand):
+    """Subclasses implement run(**options) and write their figures with report()."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the generated rows.")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(**options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def run(self, **options):
+        raise NotImplementedError
+
+    def report(self, label, value):
+        self.stdout.write(f"{label:<44} {value}")
+
+    def step(self, message):
+        """Progress on stderr, so stdout holds only the figures."""
+        self.stderr.write(message)
+
+
+# Measuring
+
+def timed(function, repeat=1):
+    """Runs function `repeat` times; returns (last result, durations in milliseconds)."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        durations.append((time.perf_counter() - started) * 1000)
+    return result, durations
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting statements: `with connection.execute_wrapper(counter)`. Unlike
+    CaptureQueriesContext, it is not capped at the 9000 queries Django keeps in queries_log. The
+    BEGIN and COMMIT the connection issues itself are not counted; savepoints are.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in 0..100."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def describe(durations):
+    return f"p50 {statistics.median(durations):.1f} ms / p99 {percentile(durations, 99):.1f} ms"
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def in_child(function):
+    """
+    Runs function in a forked process; returns (result, seconds, peak RSS of the child in MB),
+    so a peak is not hidden by one an earlier step of the benchmark reached. The child starts
+    with the parent's resident memory, which peak_rss_mb() in the parent shows beforehand.
+    """
+    connections.close_all() # the child opens its own
+    context = multiprocessing.get_context('fork')
+    receive, send = context.Pipe(duplex=False)
+
+    def target():
+        started = time.perf_counter()
+        result = function()
+        send.send((result, time.perf_counter() - started, peak_rss_mb()))
+        connections.close_all()
+
+    process = context.Process(target=target)
+    process.start()
+    outcome = receive.recv()
+    process.join()
+    return outcome
+
+
+# Generating rows
+
+def words(rng, count, length=(4, 9)):
+    """`count` distinct pronounceable made-up words."""
+    consonants, vowels = 'bcdfghklmnprstvz', 'aeiou'
+    vocabulary = set()
+    while len(vocabulary) < count:
+        size = rng.randint(*length)
+        vocabulary.add(''.join(rng.choice(vowels if i % 2 else consonants) for i in range(size)))
+    return sorted(vocabulary)
+
+
+def bulk_create(model, rows, batch_size=BATCH_SIZE):
+    """Inserts an iterable of unsaved instances batch_size at a time; returns how many."""
+    created = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            model.objects.bulk_create(batch)
+            created += len(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+        created += len(batch)
+    return created
+
+
+def create_catalog(rng, products, categories=50, vocabulary=None, description_words=12):
+    """Categories and products (stock 1000, prices 1-200) named from vocabulary; returns product ids."""
+    from shop.models import Category, Product
+
+    vocabulary = vocabulary or words(rng, 2000)
+    category_ids = []
+    for i in range(categories):
+        category = Category.objects.create(name=f"{rng.choice(vocabulary).title()} {i}")
+        category_ids.append(category.pk)
+    bulk_create(Product, (
+        Product(
+            category_id=category_ids[i % categories], slug=f'bench-product-{i}',
+            name=' '.join(rng.choice(vocabulary) for _ in range(3)).title(),
+            description=' '.join(rng.choice(vocabulary) for _ in range(description_words)),
+            price=Decimal(rng.randint(100, 20000)) / 100, stock=1000, available=True,
+        )
+        for i in range(products)
+    ))
+    return list(Product.objects.order_by('pk').values_list('pk', flat=True))
+
+
+def create_orders(rng, count, product_ids, lines=3, days=1, status='pending', user=None, prefix='BENCH'):
+    """
+    `count` orders of `lines` items each, spread evenly over the last `days` days (created_at
+    is moved after the INSERT, which stamps it now). Returns the order ids.
+    """
+    from shop.models import Order, OrderItem, Product
+
+    prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+    order_ids = []
+    for start in range(0, count, BATCH_SIZE):
+        baskets = [
+            [(product_id, rng.randint(1, 3)) for product_id in rng.sample(product_ids, lines)]
+            for _ in range(min(BATCH_SIZE, count - start))
+        ]
+        totals = [sum(prices[product_id] * quantity for product_id, quantity in basket) for basket in baskets]
+        orders = Order.objects.bulk_create([
+            Order(
+                user=user, order_number=f'{prefix}-{start + i:08d}', status=status,
+                subtotal_amount=total, total_amount=total, discount_amount=Decimal('0.00'),
+            )
+            for i, total in enumerate(totals)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order_id=order.pk, product_id=product_id, quantity=quantity, price_at_purchase=prices[product_id])
+            for order, basket in zip(orders, baskets) for product_id, quantity in basket
+        ])
+        order_ids.extend(order.pk for order in orders)
+
+    now = timezone.now()
+    per_day = -(-count // days)
+    for day in range(days):
+        ids = order_ids[day * per_day:(day + 1) * per_day]
+        if ids:
+            when = now - datetime.timedelta(days=days - 1 - day)
+            Order.objects.filter(pk__gte=ids[0], pk__lte=ids[-1]).update(created_at=when, updated_at=when)
+    return order_ids
+
+
+def create_transactions(rng, count, payload_bytes=100, failed=0.05):
+    """
+    `count` payment transactions in USD and EUR, each with a GatewayResponse of about
+    payload_bytes. A `failed` share fails, the rest succeed. External ids are random
+    (txn_<hex>_<n>), so pk order and id order differ. Returns how many were created.
+    """
+    from finance.models import Currency, GatewayResponse, Transaction
+
+    currencies = [
+        Currency.objects.get_or_create(code=code, defaults={'name': name, 'symbol': symbol})[0].pk
+        for code, name, symbol in (('USD', 'US Dollar', '$'), ('EUR', 'Euro', '€'))
+    ]
+    now = timezone.now()
+    for start in range(0, count, BATCH_SIZE):
+        transactions = Transaction.objects.bulk_create([
+            Transaction(
+                transaction_id_external=f'txn_{rng.getrandbits(48):012x}_{i}',
+                amount=Decimal(rng.randint(100, 100000)) / 100, currency_id=rng.choice(currencies),
+                transaction_type='payment', status='failed' if rng.random() < failed else 'successful',
+                payment_method_details=f'Visa ending in {rng.randint(1000, 9999)}', processed_at=now,
+            )
+            for i in range(start, min(start + BATCH_SIZE, count))
+        ])
+        GatewayResponse.objects.bulk_create([
+            GatewayResponse(
+                transaction_id=transaction.pk, received_at=now,
+                payload={'id': transaction.transaction_id_external, 'status': transaction.status, 'trace': 'x' * payload_bytes},
+            )
+            for transaction in transactions
+        ])
+    return count
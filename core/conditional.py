@@ -0,0 +1,135 @@
+"""
+HTTP conditional GET (ETag / Last-Modified) for DRF viewsets.
+
+Validators are computed before anything is serialized, and only from the rows the response
+contains: a list fetches its page (the keyset query, without its prefetches) and then one
+query, grouped by primary key, for the timestamps of those rows. The ETag covers which rows
+are on the page and their timestamps, so writes to rows on other pages don't change it. A
+matching If-None-Match / If-Modified-Since gets a 304 without running the serializer or the
+prefetches.
+
+Last-Modified has to move forward when a row leaves a list (deleted, unpublished), which no
+remaining row's timestamp records. Lists therefore also report their model's change marker:
+a timestamp in the CONDITIONAL_CACHE cache that touch() moves forward on every save and
+delete, and again on commit. The apps call it from their signal receivers (or Setting.save);
+writes through queryset.update() that move rows in or out of a list have to call it too.
+
+Models whose representation embeds related rows keep `updated_at` current from signal
+handlers (see shop/signals.py and cms/signals.py), or name the related timestamps in
+`conditional_fields`.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Max, prefetch_related_objects
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def get_cache():
+    return caches[getattr(settings, 'CONDITIONAL_CACHE', 'default')]
+
+
+def _marker_key(model):
+    return f'conditional:changed:{model._meta.label_lower}'
+
+
+def touch(model):
+    """Moves the model's change marker forward, now and once the transaction commits."""
+    def bump():
+        get_cache().set(_marker_key(model), time.time(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump)
+
+
+def changed_at(model):
+    """The model's change marker as a Unix timestamp; starts at now if the cache lost it."""
+    cache = get_cache()
+    key = _marker_key(model)
+    marker = cache.get(key)
+    if marker is None:
+        cache.add(key, time.time(), timeout=None)
+        marker = cache.get(key, time.time())
+    return marker
+
+
+class ConditionalGetMixin:
+    conditional_fields = ('updated_at',)
+
+    def get_conditional_aggregates(self):
+        """Per-row aggregates the representation depends on (grouped by primary key)."""
+        return {f'modified_{index}': Max(field) for index, field in enumerate(self.conditional_fields)}
+
+    def get_validators(self, queryset, listing=False):
+        """Returns (etag, last modified Unix timestamp or None) for the rows of queryset."""
+        rows = list(queryset.order_by().values('pk').annotate(**self.get_conditional_aggregates()).order_by('pk'))
+        timestamps = [
+            value.timestamp() for row in rows for name, value in row.items()
+            if name.startswith('modified_') and value is not None
+        ]
+        if listing:
+            timestamps.append(changed_at(queryset.model))
+        request = self.request
+        source = '|'.join([
+            queryset.model._meta.label,
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+            'staff' if request.user.is_staff else '',
+            *(
+                ','.join(f'{name}={value.isoformat() if hasattr(value, "isoformat") else value}' for name, value in sorted(row.items()))
+                for row in rows
+            ),
+        ])
+        return hashlib.md5(source.encode()).hexdigest(), max(timestamps, default=None)
+
+    def conditional_response(self, queryset, render, listing=True):
+        """
+        Returns a 304 if the client's copy of the rows of queryset is current, else render()
+        with ETag/Last-Modified set. `listing` is False when the rows cannot leave the
+        response without it failing (a single object).
+        """
+        etag, last_modified = self.get_validators(queryset, listing=listing)
+        timestamp = int(last_modified) if last_modified is not None else None
+        not_modified = get_conditional_response(self.request, etag=quote_etag(etag), last_modified=timestamp)
+        if not_modified is not None:
+            return not_modified
+        response = render()
+        if response.status_code == 200:
+            response.headers['ETag'] = quote_etag(etag)
+            if timestamp is not None:
+                response.headers['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is None:
+            return self.conditional_response(queryset, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+        # The page's prefetches only run when it is rendered.
+        lookups = queryset._prefetch_related_lookups
+        page = self.paginate_queryset(queryset.prefetch_related(None))
+
+        def render():
+            prefetch_related_objects(page, *lookups)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        # The page's rows by primary key: the list's filters have done their work.
+        rows = queryset.model._default_manager.filter(pk__in=[row.pk for row in page])
+        return self.conditional_response(rows, render)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_object_queryset(),
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+            listing=False,
+        )
+
+    def get_object_queryset(self):
+        """The queryset get_object() would pick the instance from, narrowed to it."""
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        return queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
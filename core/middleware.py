@@ -0,0 +1,103 @@
+import json
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from . import telemetry
+from .query_count import QueryRecorder
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_COUNT_WARNING = 50
+
+
+class QueryCountMiddleware:
+    """
+    Development aid: counts each request's queries (X-Query-Count and X-Query-Time-Ms headers)
+    and logs a warning for requests that repeat a statement (see core.query_count) or run more
+    than QUERY_COUNT_WARNING queries. Only active with DEBUG on.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DEBUG:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.warning = getattr(settings, 'QUERY_COUNT_WARNING', DEFAULT_QUERY_COUNT_WARNING)
+
+    def __call__(self, request):
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        response['X-Query-Count'] = str(recorder.count)
+        response['X-Query-Time-Ms'] = f'{recorder.duration * 1000:.1f}'
+
+        repeated = recorder.repeated()
+        if repeated or recorder.count > self.warning:
+            logger.warning(
+                "%s %s ran %d queries in %.1f ms%s", request.method, request.path, recorder.count,
+                recorder.duration * 1000,
+                ''.join(f"\n  {times}x {sql}" for sql, times in repeated),
+            )
+        return response
+
+
+class TelemetryMiddleware:
+    """
+    Records each request's DB time and query count, serializer and template time and cache
+    hits (core.telemetry), returns them in a Server-Timing header, logs them as one JSON line
+    (logger core.middleware, level INFO) and adds the request's latency to the per-URL-name
+    histograms behind /api/reports/telemetry/. Goes first, so its total covers the other
+    middleware too. TELEMETRY_ENABLED = False turns it off.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'TELEMETRY_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        telemetry.install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        metrics, token = telemetry.begin()
+        try:
+            response = self.get_response(request)
+        finally:
+            telemetry.end(token)
+        self.finish(request, response, metrics)
+        return response
+
+    async def __acall__(self, request):
+        metrics, token = telemetry.begin()
+        try:
+            response = await self.get_response(request)
+        finally:
+            telemetry.end(token)
+        self.finish(request, response, metrics)
+        return response
+
+    def finish(self, request, response, metrics):
+        # Streamed responses (exports) are timed up to their first byte.
+        record = metrics.as_dict(time.perf_counter() - metrics.started)
+        response['Server-Timing'] = (
+            f'db;dur={record["db_ms"]};desc="{record["queries"]} queries", '
+            f'ser;dur={record["serializer_ms"]}, tpl;dur={record["template_ms"]}, '
+            f'cache;desc="hits={record["cache_hits"]} misses={record["cache_misses"]}", '
+            f'total;dur={record["duration_ms"]}'
+        )
+        match = request.resolver_match
+        view_name = match.view_name if match and match.view_name else '<unmatched>'
+        telemetry.registry.record(view_name, response.status_code, record)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'event': 'request', 'method': request.method, 'path': request.path, 'view': view_name,
+                'status': response.status_code, **record,
+            }))
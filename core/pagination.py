@@ -0,0 +1,230 @@
+"""
+Keyset (cursor) pagination for the list endpoints and the staff list pages.
+
+Pages are fetched with `WHERE (created_at, id) < (last created_at, last id) ORDER BY -created_at, -id
+LIMIT n` instead of OFFSET, so page 1000 costs the same as page 1 and rows inserted while a client
+walks the list never shift the remaining pages (no duplicates, no skipped rows).
+
+The cursor is an opaque base64 token holding the ordering values of the last (or first) row of
+the page. ?ordering= from OrderingFilter is honoured when it only names local model fields.
+"""
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import F, Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat() # keeps microseconds, unlike DjangoJSONEncoder
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Views can set `keyset_ordering` to paginate on other fields; the primary key is always
+    appended as the tiebreak.
+    """
+    ordering = ('-created_at',)
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        params = self.get_query_params(request)
+        page_size = self.get_page_size(params)
+        self.keys = self.get_keys(queryset, request, view)
+
+        cursor = self.decode_cursor(params.get(self.cursor_query_param))
+        reverse = bool(cursor and cursor['r'])
+        queryset = queryset.order_by(*self.order_by(reverse))
+        if cursor:
+            queryset = queryset.filter(self.position_filter(cursor['v'], reverse))
+
+        rows = list(queryset[:page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+
+        # Coming back from a later page, the rows after this one are known to exist (and vice versa).
+        self.has_next = (has_more and not reverse) or (reverse and bool(rows))
+        self.has_previous = (has_more and reverse) or (bool(cursor) and not reverse and bool(rows))
+        self.first_values = self.row_values(rows[0]) if rows else None
+        self.last_values = self.row_values(rows[-1]) if rows else None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.last_values, False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.first_values, True))
+
+    def get_first_link(self):
+        return remove_query_param(self.base_url, self.cursor_query_param)
+
+    @staticmethod
+    def get_query_params(request):
+        # Also used from plain Django template views.
+        return getattr(request, 'query_params', request.GET)
+
+    def get_page_size(self, params):
+        try:
+            requested = int(params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(requested, 1), self.max_page_size)
+
+    def get_keys(self, queryset, request, view):
+        """Returns [(model field, descending)], ending with the primary key."""
+        model = queryset.model
+        ordering = self.requested_ordering(queryset, request, view) or getattr(view, 'keyset_ordering', self.ordering)
+        keys = []
+        for name in ordering:
+            descending = name.startswith('-')
+            field = model._meta.get_field(name.lstrip('-'))
+            keys.append((field, descending))
+        if not any(field.primary_key for field, _ in keys):
+            keys.append((model._meta.pk, keys[-1][1] if keys else False))
+        return keys
+
+    def requested_ordering(self, queryset, request, view):
+        if view is None or OrderingFilter not in getattr(view, 'filter_backends', ()):
+            return None
+        param = self.get_query_params(request).get(OrderingFilter.ordering_param)
+        if not param:
+            return None
+        fields = [f.strip() for f in param.split(',') if f.strip()]
+        fields = OrderingFilter().remove_invalid_fields(queryset, fields, view, request)
+        for name in fields:
+            try:
+                field = queryset.model._meta.get_field(name.lstrip('-'))
+            except FieldDoesNotExist:
+                return None
+            if not field.concrete or field.is_relation:
+                return None # e.g. related lookups: keep the default keyset
+        return fields
+
+    def order_by(self, reverse):
+        ordering = []
+        for field, descending in self.keys:
+            if reverse:
+                descending = not descending
+            if field.null:
+                # Nulls always sort after every value when walking forwards.
+                nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+                expression = F(field.attname)
+                ordering.append(expression.desc(**nulls) if descending else expression.asc(**nulls))
+            else:
+                ordering.append(f'-{field.attname}' if descending else field.attname)
+        return ordering
+
+    def position_filter(self, values, reverse):
+        """Rows strictly after the given ordering values, in the walking direction."""
+        condition = Q(pk__in=[])
+        equal_so_far = Q()
+        for (field, descending), value in zip(self.keys, values):
+            name = field.attname
+            lookup = 'lt' if descending != reverse else 'gt'
+            if value is None:
+                after = Q(**{f'{name}__isnull': False}) if reverse else None
+                equal = Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f'{name}__{lookup}': value})
+                if field.null and not reverse:
+                    after |= Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            if after is not None:
+                condition |= equal_so_far & after
+            equal_so_far &= equal
+        # Redundant range on the leading column so the database seeks the (created_at, id)
+        # index instead of walking it from the top to evaluate the OR.
+        field, descending = self.keys[0]
+        if values[0] is not None and not field.null:
+            lookup = 'lte' if descending != reverse else 'gte'
+            condition &= Q(**{f'{field.attname}__{lookup}': values[0]})
+        return condition
+
+    def row_values(self, obj):
+        return [getattr(obj, field.attname) for field, _ in self.keys]
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps({'v': [_encode_value(v) for v in values], 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        if not token:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            values = payload['v']
+            if len(values) != len(self.keys):
+                raise ValueError
+            values = [None if v is None else field.to_python(v) for (field, _), v in zip(self.keys, values)]
+            return {'v': values, 'r': bool(payload.get('r'))}
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_html_context(self):
+        return {
+            'previous_url': self.get_previous_link(),
+            'next_url': self.get_next_link(),
+        }
+
+
+def paginate_for_template(request, queryset, view=None, page_size=None, ordering=None):
+    """
+    Keyset-paginates queryset for a template view, by `ordering` (default -created_at). Returns
+    (rows, pagination) where pagination carries 'next_url'/'previous_url'/'first_url' for
+    templates/partials/_keyset_pager.html.
+    """
+    paginator = KeysetPagination()
+    if page_size:
+        paginator.page_size = page_size
+    if ordering:
+        paginator.ordering = ordering
+    try:
+        rows = paginator.paginate_queryset(queryset, request, view)
+    except NotFound as e:
+        raise Http404(str(e.detail))
+    pagination = paginator.get_html_context()
+    pagination['first_url'] = paginator.get_first_link() if paginator.has_previous else None
+    return rows, pagination
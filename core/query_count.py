@@ -0,0 +1,102 @@
+"""
+Per-request query counting, for catching N+1 queries.
+
+QueryRecorder hooks every database connection (connection.execute_wrapper) while it is active
+and records each statement's shape: its SQL before parameters are bound, with IN lists
+collapsed, so `SELECT ... WHERE id = %s` run once per row of a page is one shape repeated,
+whatever the ids. A shape repeated REPEAT_THRESHOLD times or more in one request is almost
+always a lookup done per row that select_related/prefetch_related would batch.
+
+Used by QueryCountMiddleware (core/middleware.py, DEBUG only) and by the per-endpoint query
+budgets the apps' tests assert with QueryBudgetMixin.
+"""
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+
+
+DEFAULT_REPEAT_THRESHOLD = 5
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def get_repeat_threshold():
+    return getattr(settings, 'QUERY_COUNT_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)
+
+
+def shape(sql):
+    """The statement with its parameters and literals left out."""
+    return _LITERALS.sub('?', _IN_LIST.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.shapes = Counter()
+        self.count = 0
+        self.duration = 0.0
+        self._hooks = None
+
+    def __enter__(self):
+        self._hooks = ExitStack()
+        for connection in connections.all():
+            self._hooks.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._hooks.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[shape(sql)] += 1
+
+    def repeated(self, threshold=None):
+        """[(shape, times)] of the statements run `threshold` times or more, most repeated first."""
+        threshold = threshold or get_repeat_threshold()
+        return [(sql, times) for sql, times in self.shapes.most_common() if times >= threshold]
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin: requests the list endpoint of every viewset of `router_module`, then the
+    detail endpoint of its first row, as `self.user` and asserts that each runs no more
+    queries than its budget (`budgets`, else `default_budget`) and repeats no statement per
+    row. Set up rows first (core.sample_data.create_sample_rows).
+    """
+    router_module = None
+    budgets = {}
+    default_budget = 4
+    page_size = 50
+
+    def test_query_budgets(self):
+        from django.urls import reverse
+        from rest_framework.test import APIClient
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        for prefix, viewset, basename in import_module(self.router_module).router.registry:
+            list_url = reverse(f'{basename}-list')
+            rows = self.assertWithinBudget(client, f'{basename}-list', list_url, {'page_size': self.page_size})
+            rows = rows.get('results') if isinstance(rows, dict) else rows
+            self.assertTrue(rows, f"{basename}-list returned no rows; the detail endpoint went untested.")
+            lookup = rows[0].get(viewset.lookup_field, rows[0].get('id'))
+            self.assertWithinBudget(client, f'{basename}-detail', reverse(f'{basename}-detail', args=[lookup]), {})
+
+    def assertWithinBudget(self, client, name, url, params):
+        with QueryRecorder() as recorder:
+            response = client.get(url, params)
+        self.assertEqual(response.status_code, 200, f"{name}: {response.status_code}")
+        budget = self.budgets.get(name, self.default_budget)
+        self.assertLessEqual(recorder.count, budget, f"{name} ran {recorder.count} queries (budget {budget}).")
+        self.assertEqual(recorder.repeated(), [], f"{name} repeats statements per row.")
+        return response.data
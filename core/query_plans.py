@@ -0,0 +1,138 @@
+"""
+Query-plan checks for the hot filters, asserted by the apps' tests with QueryPlanMixin.
+
+Each HotPath runs the code a client request hits (a list view, with the request's filters,
+permissions and keyset pagination, or a helper such as finance.ledger.expected_totals),
+captures the SQL it sends and EXPLAINs every statement. The filters of a hot path are
+selective, so each of the path's tables must be reached by an index seek; the path fails when a
+plan reads one of them end to end instead:
+
+- SQLite: any `SCAN <table>` step. `SCAN <table> USING INDEX` counts too: it walks a whole
+  index (typically (created_at, id) for the ORDER BY) and tests the filter on every row.
+- PostgreSQL: a `Seq Scan`, or an `Index Scan`/`Index Only Scan` with no `Index Cond`, on the
+  table. Plans are taken with enable_seqscan off, so a small development table doesn't hide a
+  missing index.
+"""
+import re
+from unittest import SkipTest
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection, transaction as django_db_transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.module_loading import import_string
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+# Stand-ins for the requesting user; never saved, only their pk and flags are read.
+USERS = {
+    'anonymous': lambda: AnonymousUser(),
+    'customer': lambda: User(pk=1, username='query-plan-customer'),
+    'staff': lambda: User(pk=1, username='query-plan-staff', is_staff=True, is_superuser=True),
+}
+
+
+class HotPath:
+    def __init__(self, name, tables, view=None, params=None, user='staff', call=None):
+        # view: dotted path of a list view (ViewSets are routed as {'get': 'list'});
+        # call: a function to run instead (or its dotted path), with no arguments.
+        self.name = name
+        self.tables = tables
+        self.view = view
+        self.params = params or {}
+        self.user = user
+        self.call = call
+
+    def run(self):
+        if self.call:
+            (import_string(self.call) if isinstance(self.call, str) else self.call)()
+            return
+        view_class = import_string(self.view)
+        view = view_class.as_view({'get': 'list'}) if hasattr(view_class, 'get_extra_actions') else view_class.as_view()
+        request = APIRequestFactory().get('/', self.params)
+        force_authenticate(request, user=USERS[self.user]())
+        response = view(request)
+        if response.status_code != 200:
+            raise RuntimeError(f"{self.name}: the view answered {response.status_code}.")
+
+
+def explain(sql):
+    """The plan of `sql` as a list of lines."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+        with django_db_transaction.atomic():
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+
+
+def _aliases(sql):
+    # Django aliases tables in subqueries and self-joins ("shop_productattribute" U0).
+    return {alias.lower(): table for table, alias in re.findall(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?', sql)}
+
+
+_SQLITE_SCAN = re.compile(r'^SCAN (\w+)')
+_POSTGRES_NODE = re.compile(r'(Seq Scan|Index Only Scan|Index Scan)(?: Backward)?(?: using \w+)? on (\w+)(?: (\w+))?')
+
+
+def full_scans(sql, plan, tables):
+    """The tables among `tables` that `plan` reads end to end rather than through an index seek."""
+    aliases = _aliases(sql)
+
+    def table_of(*names):
+        names = {name.lower() for name in names if name}
+        names |= {aliases[name] for name in names if name in aliases}
+        return next((table for table in tables if table in names), None)
+
+    scanned = []
+    if connection.vendor == 'sqlite':
+        for line in plan:
+            match = _SQLITE_SCAN.match(line.strip())
+            table = match and table_of(match.group(1))
+            if table and table not in scanned:
+                scanned.append(table)
+        return scanned
+
+    # PostgreSQL: a node's properties (Index Cond, Filter, ...) follow it up to the next node.
+    nodes = []
+    for line in plan:
+        match = _POSTGRES_NODE.search(line)
+        if match and (line.lstrip().startswith('->') or not nodes):
+            nodes.append([match.group(1), table_of(match.group(2), match.group(3)), False])
+        elif nodes and line.strip().startswith('->'):
+            nodes.append([None, None, False])
+        elif nodes and 'Index Cond:' in line:
+            nodes[-1][2] = True
+    for kind, table, seeks in nodes:
+        if table and (kind == 'Seq Scan' or not seeks) and table not in scanned:
+            scanned.append(table)
+    return scanned
+
+
+def check(path):
+    """[(sql, plan, fully scanned tables)] for each SELECT the path runs."""
+    with CaptureQueriesContext(connection) as queries:
+        path.run()
+    results = []
+    for query in queries.captured_queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith('SELECT'):
+            continue
+        plan = explain(sql)
+        results.append((sql, plan, full_scans(sql, plan, path.tables)))
+    return results
+
+
+class QueryPlanMixin:
+    """TestCase mixin: assertIndexSeeks(path) fails when a plan of the path reads one of its tables end to end."""
+
+    def assertIndexSeeks(self, path):
+        if connection.vendor not in SUPPORTED_VENDORS:
+            raise SkipTest(f"Query plans can only be checked on {', '.join(SUPPORTED_VENDORS)}, not {connection.vendor}.")
+        results = check(path)
+        self.assertTrue(results, f"{path.name} ran no SELECT.")
+        for sql, plan, scanned in results:
+            self.assertFalse(scanned, f"{path.name}: full scan of {', '.join(scanned)}\n{sql}\n  " + '\n  '.join(plan))
@@ -0,0 +1,86 @@
+"""
+A few rows in every table behind the API routers, for tests that need realistic pages: query
+budgets (core.query_count.QueryBudgetMixin) and query plans (core.query_plans).
+
+Rows are spread over several customers, categories and content types, and orders have
+several items, so a lookup done per row shows up as a repeated statement.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.utils import timezone
+
+
+DEFAULT_ROWS = 6
+
+
+def create_sample_rows(rows=DEFAULT_ROWS):
+    """Creates `rows` rows per model; returns the staff user the rows belong to."""
+    from cms.models import Article, CmsCategory, Comment, MetaTag, Page, SitemapEntry, Tag
+    from finance.models import Currency, Transaction
+    from shop.models import (
+        Address, Carrier, Category, Order, OrderItem, OrderTimeline, Product, ProductAttribute,
+        ProductImage, Shipment, StockReservation,
+    )
+    from site_settings.models import Setting
+
+    staff = User.objects.create_superuser('sample-staff', 'staff@example.com', 'sample-password')
+    customers = [User.objects.create_user(f'sample-customer-{i}', f'customer{i}@example.com', 'sample-password') for i in range(rows)]
+
+    categories = [Category.objects.create(name=f'Category {i}') for i in range(rows)]
+    for i, category in enumerate(categories):
+        Category.objects.create(name=f'Subcategory {i}', parent=category)
+    products = []
+    for i in range(rows):
+        product = Product.objects.create(
+            category=categories[i], name=f'Product {i}', description='Sample product.',
+            price=Decimal(10 + i), stock=100, available=True, created_by=staff,
+        )
+        ProductAttribute.objects.create(product=product, name='Color', value=['Red', 'Blue'][i % 2])
+        ProductAttribute.objects.create(product=product, name='Size', value=['S', 'XL'][i % 2])
+        ProductImage.objects.create(product=product, image=f'products/sample-{i}.jpg')
+        products.append(product)
+    carriers = [Carrier.objects.create(name=f'Carrier {i}') for i in range(rows)]
+
+    currency, _ = Currency.objects.get_or_create(code='USD', defaults={'name': 'US Dollar', 'symbol': '$', 'is_default': True})
+    for i, customer in enumerate(customers):
+        address = Address.objects.create(
+            user=customer, address_line_1=f'{i} Sample Street', city='Sample City',
+            state_province_region='Region', postal_code='10000', country='US',
+        )
+        order = Order.objects.create(
+            user=customer, shipping_address=address, billing_address=address, total_amount=Decimal('30.00'),
+        )
+        for product in (products[i], products[(i + 1) % rows]):
+            OrderItem.objects.create(order=order, product=product, quantity=1, price_at_purchase=Decimal('15.00'))
+        OrderTimeline.objects.create(order=order, note='Order placed.', user_triggered=customer)
+        Shipment.objects.create(order=order, carrier=carriers[i])
+        payment = Transaction.objects.create(
+            order=order, user=customer, amount=Decimal('30.00'), currency=currency, transaction_type='payment',
+            status='successful', transaction_id_external=f'SAMPLE-PAY-{i}',
+        )
+        Transaction.objects.create(
+            order=order, user=customer, amount=Decimal('5.00'), currency=currency, transaction_type='refund',
+            status='successful', parent_transaction=payment, transaction_id_external=f'SAMPLE-REF-{i}',
+        )
+        for holder in (customer, staff):
+            StockReservation.objects.create(
+                product=products[i], user=holder, quantity=1, expires_at=timezone.now() + timedelta(hours=1),
+            )
+
+    cms_categories = [CmsCategory.objects.create(name=f'CMS category {i}') for i in range(rows)]
+    tags = [Tag.objects.create(name=f'Tag {i}') for i in range(rows)]
+    product_type, page_type = ContentType.objects.get_for_model(Product), ContentType.objects.get_for_model(Page)
+    for i in range(rows):
+        article = Article.objects.create(title=f'Article {i}', content='Sample article.', author=staff, is_published=True)
+        article.categories.add(cms_categories[i])
+        article.tags.add(tags[i], tags[(i + 1) % rows])
+        Comment.objects.create(article=article, user=customers[i], content='Sample comment.')
+        page = Page.objects.create(title=f'Page {i}', content='Sample page.', author=staff, is_published=True)
+        MetaTag.objects.create(name='description', content='Sample.', content_type=product_type, object_id=products[i].pk)
+        MetaTag.objects.create(name='description', content='Sample.', content_type=page_type, object_id=page.pk)
+        SitemapEntry.objects.create(location_url=f'/sample/{i}/')
+        Setting.objects.create(key=f'SAMPLE_{i}', value=str(i), is_public=bool(i % 2))
+    return staff
@@ -49,7 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.TelemetryMiddleware', # Server-Timing header, per-URL latency histograms (core.telemetry)
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.QueryCountMiddleware', # DEBUG only: X-Query-Count header, N+1 warnings (core.query_count)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,6 +87,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Transactions take the write lock when they begin, so concurrent writers wait for one
+        # another (up to `timeout` seconds) instead of failing with "database is locked".
+        # Set globally because SQLite ignores select_for_update(): in the default DEFERRED mode a
+        # transaction that reads and then writes (stock holds, order transitions, the ledger)
+        # upgrades its lock mid-way, and when two do that SQLite fails one at once instead of
+        # waiting. The cost is small: SQLite allows one writer at a time anyway, and reads
+        # outside atomic() blocks don't take the lock. 20 s covers the longest bulk transactions
+        # (catalog_import chunks, transition_orders batches). Both options are sqlite3-only.
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        # On disk rather than in shared-cache memory, so threaded tests (shop.tests.StockConcurrencyTests)
+        # lock the way the real database does.
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -138,6 +152,42 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+CACHES = {
+    # Also carries invalidation markers: the category tree version (shop/categories.py) and the
+    # dashboard's dropped days (dashboard/metrics.py). LocMemCache is per process, so with several
+    # workers a write only reaches its own worker; there, point 'default' at a shared backend
+    # (e.g. RedisCache) and raise DASHBOARD_HISTORY_TTL.
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Product detail representations (shop/product_cache.py). LocMemCache evicts the least
+    # recently used entries past MAX_ENTRIES. It is per process, and so are the invalidations:
+    # another worker serves its copy for up to 360 s after a write. With several workers, use
+    # RedisCache ('LOCATION': 'redis://127.0.0.1:6379') or another shared backend.
+    'products': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop-products',
+        'TIMEOUT': 360,
+        'OPTIONS': {'MAX_ENTRIES': 20000, 'CULL_FREQUENCY': 10},
+    },
+}
+SHOP_PRODUCT_CACHE = 'products'
+
+# How long the dashboard keeps past days' figures (dashboard/metrics.py). Short by default, as
+# the per-process default cache only sees its own worker's invalidations; e.g. a day once shared:
+# DASHBOARD_HISTORY_TTL = 60 * 60 * 24
+
+# Payment gateway client (finance/gateway.py); unset, payments go to the in-process mock.
+# `manage.py run_fake_gateway` serves a local stand-in for latency and throughput tests:
+# FINANCE_PAYMENT_GATEWAY = {
+#     'BACKEND': 'finance.gateway.HttpGatewayClient',
+#     'OPTIONS': {'base_url': 'http://127.0.0.1:8765', 'timeout': 5.0, 'max_connections': 20},
+# }
+
+# Request telemetry (core.middleware.TelemetryMiddleware): p50/p95/p99 cover the last
+# TELEMETRY_WINDOW seconds. Counters are per process.
+TELEMETRY_WINDOW = 300
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
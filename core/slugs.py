@@ -0,0 +1,91 @@
+"""
+Set-based unique slug allocation shared by the shop and cms models.
+
+Instead of probing `slug`, `slug-1`, `slug-2`... with one query each, all existing slugs
+sharing a base are fetched with a single prefix query and the lowest free suffix is picked
+in memory.
+"""
+import re
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+
+# Room kept at the end of max_length for the "-<n>" suffix.
+SUFFIX_RESERVE = 8
+
+
+SUFFIXED = re.compile(r'(.+)-(\d+)')
+
+
+def _used_suffixes(slugs, bases):
+    """Maps each base to the suffixes taken in slugs: n for 'base-n', 0 for 'base' itself."""
+    used = {base: set() for base in bases}
+    for slug in slugs:
+        if slug in used:
+            used[slug].add(0)
+        match = SUFFIXED.fullmatch(slug)
+        if match and match.group(1) in used:
+            used[match.group(1)].add(int(match.group(2)))
+    return used
+
+
+def allocate_slugs(model, bases, field='slug', reserved=(), exclude_pk=None):
+    """
+    Returns one free slug per entry of bases (duplicates allowed), in order, with a single query.
+    Slugs in reserved are treated as taken; exclude_pk ignores the row being re-saved.
+    """
+    if not bases:
+        return []
+    max_length = model._meta.get_field(field).max_length
+    bases = [base[:max_length - SUFFIX_RESERVE].strip('-') or model._meta.model_name for base in bases]
+
+    prefix_match = Q()
+    for base in set(bases):
+        prefix_match |= Q(**{field: base}) | Q(**{f'{field}__startswith': f'{base}-'})
+    existing = model._default_manager.filter(prefix_match)
+    if exclude_pk is not None:
+        existing = existing.exclude(pk=exclude_pk)
+    taken_slugs = set(existing.values_list(field, flat=True))
+    taken_slugs.update(reserved)
+
+    used = _used_suffixes(taken_slugs, set(bases))
+    # Suffixes are only ever added, so the lowest free one never moves backwards.
+    lowest_free = dict.fromkeys(used, 0)
+
+    slugs = []
+    for base in bases:
+        n = lowest_free[base]
+        while n in used[base]:
+            n += 1
+        used[base].add(n)
+        lowest_free[base] = n + 1
+        slugs.append(base if n == 0 else f'{base}-{n}')
+    return slugs
+
+
+class UniqueSlugMixin:
+    """
+    Model mixin that fills a blank `slug` from `slug_source` with a unique value on save.
+
+    Two concurrent saves can still pick the same slug; the loser's INSERT/UPDATE fails the unique
+    constraint, so the save is retried with a freshly allocated slug (inside a savepoint).
+    """
+    slug_source = 'name'
+    slug_max_attempts = 3
+
+    def save(self, *args, **kwargs):
+        if self.slug:
+            return super().save(*args, **kwargs)
+        model = type(self)
+        for attempt in range(self.slug_max_attempts):
+            self.slug = allocate_slugs(model, [slugify(getattr(self, self.slug_source))], exclude_pk=self.pk)[0]
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                lost_race = model._default_manager.filter(slug=self.slug).exclude(pk=self.pk).exists()
+                if not lost_race or attempt == self.slug_max_attempts - 1:
+                    raise
+                self.slug = ''
@@ -0,0 +1,343 @@
+"""
+Per-request performance telemetry (collected by core.middleware.TelemetryMiddleware).
+
+For each request, RequestMetrics adds up:
+- DB time and query count: an execute wrapper installed on every connection as it opens;
+- serializer time: the outermost DRF `serializer.data` evaluation;
+- template time: the outermost Template.render;
+- cache hits and misses: get/get_many of the configured cache backends.
+
+The hooks are installed once by install() and only record while a request's metrics are
+active (a context variable, so work handed to sync_to_async threads is counted too). Nested
+serializers, included templates and backends that implement get_many with get count once.
+
+Per URL name, Registry keeps cumulative counters and a latency histogram (exported in the
+Prometheus text format) and a rolling histogram of the last WINDOW seconds for p50/p95/p99.
+Quantiles are interpolated within the histogram buckets (and capped at the slowest request),
+so they are estimates within a bucket's width.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+# Latency bucket upper bounds, in milliseconds.
+BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUANTILES = (0.5, 0.95, 0.99)
+DEFAULT_WINDOW = 300 # seconds
+WINDOW_SLICES = 10
+
+_current = ContextVar('telemetry_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'db_time', 'queries', 'serializer_time', 'template_time', 'cache_hits', 'cache_misses', '_depth')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+        self.serializer_time = 0.0
+        self.template_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._depth = {}
+
+    def as_dict(self, duration):
+        return {
+            'duration_ms': round(duration * 1000, 2),
+            'db_ms': round(self.db_time * 1000, 2),
+            'queries': self.queries,
+            'serializer_ms': round(self.serializer_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+
+def begin():
+    """Starts recording for the current request; returns (metrics, token for end())."""
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end(token):
+    _current.reset(token)
+
+
+# Hooks
+
+def _timed(kind):
+    """Decorator adding the outermost call's duration to the request's `<kind>_time`."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = _current.get()
+            if metrics is None or metrics._depth.get(kind):
+                return function(*args, **kwargs)
+            metrics._depth[kind] = True
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics._depth[kind] = False
+                setattr(metrics, f'{kind}_time', getattr(metrics, f'{kind}_time') + time.perf_counter() - started)
+        wrapper.telemetry_hook = True
+        return wrapper
+    return decorator
+
+
+def _record_query(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.db_time += time.perf_counter() - started
+        metrics.queries += 1
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    # First, not last: connection.execute_wrapper() blocks (QueryRecorder, CaptureQueriesContext)
+    # pop the last wrapper when they exit, whatever was added since they entered.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+_MISSING = object()
+
+
+def _hook_cache_backend(backend_class):
+    get, get_many = backend_class.get, backend_class.get_many
+    if getattr(get, 'telemetry_hook', False):
+        return
+
+    @functools.wraps(get)
+    def hooked_get(self, key, default=None, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics._depth.get('cache'):
+            return get(self, key, default, version)
+        metrics._depth['cache'] = True
+        try:
+            value = get(self, key, _MISSING, version)
+        finally:
+            metrics._depth['cache'] = False
+        if value is _MISSING:
+            metrics.cache_misses += 1
+            return default
+        metrics.cache_hits += 1
+        return value
+
+    @functools.wraps(get_many)
+    def hooked_get_many(self, keys, version=None):
+        metrics = _current.get()
+        if metrics is None or metrics._depth.get('cache'):
+            return get_many(self, keys, version)
+        keys = list(keys)
+        metrics._depth['cache'] = True
+        try:
+            values = get_many(self, keys, version)
+        finally:
+            metrics._depth['cache'] = False
+        metrics.cache_hits += len(values)
+        metrics.cache_misses += len(keys) - len(values)
+        return values
+
+    hooked_get.telemetry_hook = hooked_get_many.telemetry_hook = True
+    backend_class.get, backend_class.get_many = hooked_get, hooked_get_many
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """Installs the hooks (once per process)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        from django.core.cache import caches
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+        from django.template.base import Template
+        from rest_framework.serializers import BaseSerializer
+
+        connection_created.connect(_on_connection_created, dispatch_uid='core.telemetry')
+        for connection in connections.all(initialized_only=True):
+            _on_connection_created(None, connection)
+
+        data = BaseSerializer.data
+        BaseSerializer.data = property(_timed('serializer')(data.fget))
+        Template.render = _timed('template')(Template.render)
+        for alias in settings.CACHES:
+            _hook_cache_backend(type(caches[alias]))
+        _installed = True
+
+
+# Aggregation
+
+def get_window():
+    return getattr(settings, 'TELEMETRY_WINDOW', DEFAULT_WINDOW)
+
+
+class Histogram:
+    """Counts of latencies (ms) per bucket of BUCKETS, the last one being +Inf."""
+    __slots__ = ('counts', 'total', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = min(BUCKETS[index] if index < len(BUCKETS) else self.max, self.max)
+                return round(lower + max(upper - lower, 0) * (rank - seen) / count, 2)
+            seen += count
+        return None
+
+
+class ViewStats:
+    """Everything recorded for one URL name."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.totals = dict.fromkeys(('db_ms', 'queries', 'serializer_ms', 'template_ms', 'cache_hits', 'cache_misses'), 0)
+        self.latency = Histogram() # since the process started
+        self.slices = [] # [(slice start, Histogram)], the rolling window
+
+    def add(self, status, record, now, window):
+        self.requests += 1
+        if status >= 500:
+            self.errors += 1
+        for name in self.totals:
+            self.totals[name] += record[name]
+        self.latency.add(record['duration_ms'])
+
+        slice_length = window / WINDOW_SLICES
+        start = now - now % slice_length
+        if not self.slices or self.slices[-1][0] != start:
+            self.slices.append((start, Histogram()))
+        self.slices[-1][1].add(record['duration_ms'])
+        while self.slices and self.slices[0][0] <= now - window:
+            del self.slices[0]
+
+    def recent(self, now, window):
+        histogram = Histogram()
+        for start, part in self.slices:
+            if start > now - window:
+                histogram.merge(part)
+        return histogram
+
+
+class Registry:
+    def __init__(self):
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def record(self, view_name, status, record):
+        now = time.time()
+        with self.lock:
+            stats = self.views.get(view_name)
+            if stats is None:
+                stats = self.views[view_name] = ViewStats()
+            stats.add(status, record, now, get_window())
+
+    def snapshot(self):
+        """{url name: {...}} with the rolling-window quantiles, in milliseconds."""
+        now, window = time.time(), get_window()
+        with self.lock:
+            result = {}
+            for view_name, stats in sorted(self.views.items()):
+                recent = stats.recent(now, window)
+                result[view_name] = {
+                    'requests': stats.requests,
+                    'errors': stats.errors,
+                    'window_requests': recent.total,
+                    **{f'p{round(q * 100)}_ms': recent.quantile(q) for q in QUANTILES},
+                    **{f'avg_{name}': round(total / stats.requests, 2) for name, total in stats.totals.items()},
+                }
+            return {'window_seconds': window, 'views': result}
+
+    def prometheus(self):
+        """The counters and histograms in the Prometheus text exposition format."""
+        now, window = time.time(), get_window()
+        lines = [
+            '# HELP http_request_duration_seconds Request latency by URL name.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        with self.lock:
+            views = sorted(self.views.items())
+            for view_name, stats in views:
+                label = _label(view_name)
+                cumulative = 0
+                for index, count in enumerate(stats.latency.counts):
+                    cumulative += count
+                    le = f'{BUCKETS[index] / 1000:g}' if index < len(BUCKETS) else '+Inf'
+                    lines.append(f'http_request_duration_seconds_bucket{{view="{label}",le="{le}"}} {cumulative}')
+                lines.append(f'http_request_duration_seconds_sum{{view="{label}"}} {stats.latency.sum / 1000:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{view="{label}"}} {stats.latency.total}')
+
+            lines += [
+                f'# HELP http_request_duration_recent_seconds Request latency quantiles over the last {window} seconds.',
+                '# TYPE http_request_duration_recent_seconds summary',
+            ]
+            for view_name, stats in views:
+                label = _label(view_name)
+                recent = stats.recent(now, window)
+                for q in QUANTILES:
+                    value = recent.quantile(q)
+                    if value is not None:
+                        lines.append(f'http_request_duration_recent_seconds{{view="{label}",quantile="{q}"}} {value / 1000:.6f}')
+                lines.append(f'http_request_duration_recent_seconds_sum{{view="{label}"}} {recent.sum / 1000:.6f}')
+                lines.append(f'http_request_duration_recent_seconds_count{{view="{label}"}} {recent.total}')
+
+            counters = [
+                ('http_requests_total', 'Requests.', lambda stats: stats.requests),
+                ('http_request_errors_total', 'Requests answered with a 5xx.', lambda stats: stats.errors),
+                ('http_request_db_seconds_total', 'Time spent in database queries.', lambda stats: stats.totals['db_ms'] / 1000),
+                ('http_request_db_queries_total', 'Database queries.', lambda stats: stats.totals['queries']),
+                ('http_request_serializer_seconds_total', 'Time spent serializing.', lambda stats: stats.totals['serializer_ms'] / 1000),
+                ('http_request_template_seconds_total', 'Time spent rendering templates.', lambda stats: stats.totals['template_ms'] / 1000),
+                ('http_request_cache_hits_total', 'Cache hits.', lambda stats: stats.totals['cache_hits']),
+                ('http_request_cache_misses_total', 'Cache misses.', lambda stats: stats.totals['cache_misses']),
+            ]
+            for metric, description, value in counters:
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter']
+                lines += [f'{metric}{{view="{_label(view_name)}"}} {value(stats):g}' for view_name, stats in views]
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
@@ -44,6 +44,7 @@ urlpatterns = [
     path('api/cms/', include('cms.api_urls')), 
     path('api/finance/', include('finance.urls')),
     path('api/site-settings/', include('site_settings.urls')),
+    path('api/reports/', include('dashboard.api_urls')),
 
     # Management UI paths
     path('manage/users/', include('accounts.urls', namespace='accounts_ui')),
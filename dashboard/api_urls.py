@@ -0,0 +1,15 @@
+from django.urls import path
+from .views import (
+    DailySalesReportView, ProductSalesReportView,
+    CategorySalesReportView, CurrencySalesReportView,
+    TelemetryView, TelemetryMetricsView,
+)
+
+urlpatterns = [
+    path('sales/daily/', DailySalesReportView.as_view(), name='sales_report_daily'),
+    path('sales/products/', ProductSalesReportView.as_view(), name='sales_report_products'),
+    path('sales/categories/', CategorySalesReportView.as_view(), name='sales_report_categories'),
+    path('sales/currencies/', CurrencySalesReportView.as_view(), name='sales_report_currencies'),
+    path('telemetry/', TelemetryView.as_view(), name='telemetry'),
+    path('telemetry/metrics/', TelemetryMetricsView.as_view(), name='telemetry_metrics'),
+]
@@ -0,0 +1,48 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from dashboard import rollups
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the daily sales rollups from orders and transactions, one day per transaction "
+        "and --chunk-size rows at a time. Defaults to every day since the first order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=datetime.date.fromisoformat, help="First day to rebuild (YYYY-MM-DD).")
+        parser.add_argument('--until', type=datetime.date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD), default today.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Orders/transactions read per query.")
+
+    def handle(self, *args, **options):
+        until = options['until'] or timezone.localdate()
+        since = options['since']
+        if since is None:
+            first = Order.objects.aggregate(first=Min('created_at'))['first']
+            if first is None:
+                self.stdout.write("No orders yet.")
+                return
+            since = timezone.localdate(first)
+        if since > until:
+            raise CommandError("--since must not be after --until.")
+
+        started = time.monotonic()
+        day = since
+        total_orders = total_transactions = 0
+        while day <= until:
+            orders, transactions = rollups.rebuild_day(day, chunk_size=options['chunk_size'])
+            total_orders += orders
+            total_transactions += transactions
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{day}: {orders} orders, {transactions} transactions")
+            day += datetime.timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {(until - since).days + 1} days from {total_orders} orders and "
+            f"{total_transactions} transactions in {time.monotonic() - started:.1f}s."
+        ))
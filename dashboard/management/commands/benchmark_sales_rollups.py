@@ -0,0 +1,117 @@
+import datetime
+import statistics
+
+from django.contrib.auth.models import User
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, pre_save
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.benchmarks import BenchmarkCommand, create_catalog, create_orders, timed
+from dashboard import rollups
+from dashboard.signals import remember_order_rollup, roll_up_order
+from shop.models import Order, OrderItem
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Backfills a year of sales rollups for --orders orders of --lines items, then times the "
+        "sales reports against the same sums computed from the order items, and the cost the "
+        "rollup feed adds to booking one order."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--orders', type=int, default=1250000)
+        parser.add_argument('--lines', type=int, default=4)
+        parser.add_argument('--products', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=366)
+        parser.add_argument('--repeat', type=int, default=3, help="Runs per report; the median is shown.")
+
+    def run(self, **options):
+        self.step(f"Creating {options['orders']} orders over {options['days']} days...")
+        product_ids = create_catalog(self.rng, options['products'], description_words=4)
+        create_orders(self.rng, options['orders'], product_ids, lines=options['lines'], days=options['days'], status='delivered')
+
+        today = timezone.localdate()
+        first_day = today - datetime.timedelta(days=options['days'] - 1)
+        self.step("Backfilling...")
+
+        def backfill():
+            day = first_day
+            while day <= today:
+                rollups.rebuild_day(day)
+                day += datetime.timedelta(days=1)
+
+        _, (backfill_ms,) = timed(backfill)
+        self.report(f"backfill of {options['days']} days", f"{backfill_ms / 1000:.0f} s")
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('bench-reports', 'bench@example.com', 'bench'))
+        for label, report, raw in (
+            ("sales per day", 'daily', self.raw_per_day),
+            ("by category", 'categories', self.raw_by_category),
+            ("top 50 products", 'products', self.raw_top_products),
+        ):
+            for days in (30, 365):
+                since = today - datetime.timedelta(days=days - 1)
+                _, raw_ms = timed(lambda: raw(since, today), options['repeat'])
+                params = {'since': since.isoformat(), 'until': today.isoformat()}
+                response, rollup_ms = timed(lambda: client.get(f'/api/reports/sales/{report}/', params), options['repeat'])
+                if response.status_code != 200:
+                    raise CommandError(f"{report} report failed: {response.status_code} {response.content[:200]!r}")
+                self.report(
+                    f"{label}, {days}d",
+                    f"raw {statistics.median(raw_ms):.1f} ms, rollup {statistics.median(rollup_ms):.1f} ms",
+                )
+        self.report_booking(product_ids, options['lines'])
+
+    def booked_items(self, since, until):
+        start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+        end = timezone.make_aware(datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time.min))
+        return OrderItem.objects.filter(
+            order__status__in=rollups.BOOKED_STATUSES, order__created_at__gte=start, order__created_at__lt=end,
+        ).order_by()
+
+    @staticmethod
+    def sums():
+        return {'units': Sum('quantity'), 'gross': Sum(F('quantity') * F('price_at_purchase'))}
+
+    def raw_per_day(self, since, until):
+        return list(self.booked_items(since, until).values(day=TruncDate('order__created_at')).annotate(**self.sums()).order_by('day'))
+
+    def raw_by_category(self, since, until):
+        return list(self.booked_items(since, until).values('product__category_id', 'product__category__name').annotate(**self.sums()))
+
+    def raw_top_products(self, since, until):
+        return list(self.booked_items(since, until).values('product_id').annotate(**self.sums()).order_by('-gross')[:50])
+
+    def report_booking(self, product_ids, lines, count=50):
+        """Books pending orders one save() at a time, with the rollup receivers and without."""
+        order_ids = create_orders(self.rng, count * 2, product_ids, lines=lines, prefix='BOOK')
+        orders = list(Order.objects.filter(pk__in=order_ids).order_by('pk'))
+
+        def book(batch):
+            queries, durations = [], []
+            for order in batch:
+                order.status = 'processing'
+                with CaptureQueriesContext(connection) as captured:
+                    _, (duration,) = timed(order.save)
+                queries.append(len(captured))
+                durations.append(duration)
+            return statistics.median(queries), statistics.median(durations)
+
+        with_feed = book(orders[:count])
+        pre_save.disconnect(remember_order_rollup, sender=Order)
+        post_save.disconnect(roll_up_order, sender=Order)
+        try:
+            without_feed = book(orders[count:])
+        finally:
+            pre_save.connect(remember_order_rollup, sender=Order)
+            post_save.connect(roll_up_order, sender=Order)
+        self.report("booking one order, with the rollup feed", f"{with_feed[0]:.0f} queries, {with_feed[1]:.1f} ms")
+        self.report("booking one order, without", f"{without_feed[0]:.0f} queries, {without_feed[1]:.1f} ms")
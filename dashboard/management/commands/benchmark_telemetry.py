@@ -0,0 +1,141 @@
+import cProfile
+import pstats
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, override_settings
+
+from core import telemetry
+from core.benchmarks import BenchmarkCommand, create_catalog, words
+from core.middleware import TelemetryMiddleware
+from shop import search
+
+
+TELEMETRY_MIDDLEWARE = 'core.middleware.TelemetryMiddleware'
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Measures what TelemetryMiddleware costs: its fixed cost per request, the DB wrapper's "
+        "cost per query, and ProductSearchView end to end with and without it, in interleaved "
+        "blocks with an A/A control. --profile adds a cProfile run."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--iterations', type=int, default=20000, help="Calls timed for the fixed costs.")
+        parser.add_argument('--block', type=int, default=400, help="Requests per interleaved block.")
+        parser.add_argument('--rounds', type=int, default=4, help="Interleaved blocks per side.")
+        parser.add_argument('--profile', action='store_true', help="Profile 60 searches and sum the telemetry frames.")
+
+    def run(self, **options):
+        # A small vocabulary, so one word matches most of the catalog (about 400 of 500 products).
+        vocabulary = words(self.rng, 10)
+        create_catalog(self.rng, options['products'], categories=5, vocabulary=vocabulary)
+        search.get_backend().rebuild()
+        self.query = {'search': vocabulary[0]}
+
+        iterations = options['iterations']
+        self.report("middleware fixed cost", f"{self.middleware_cost(iterations) * 1e6:.1f} us per request")
+        self.report("DB wrapper", f"{self.wrapper_cost(iterations) * 1e6:.2f} us per query")
+
+        configured = list(settings.MIDDLEWARE)
+        without = [path for path in configured if path != TELEMETRY_MIDDLEWARE]
+        response = self.client_for(configured).get('/api/shop/search/products/', self.query)
+        self.report("products per response", len(response.json()))
+        for label, first, second in (("A/B (telemetry on vs off)", configured, without), ("A/A (off vs off)", without, without)):
+            a, b = self.interleaved(first, second, options['block'], options['rounds'])
+            self.report(
+                label,
+                f"median {self.change(statistics.median(a), statistics.median(b))}, "
+                f"mean {self.change(statistics.mean(a), statistics.mean(b))}",
+            )
+
+        if options['profile']:
+            self.profile(configured)
+
+    @staticmethod
+    def change(a, b):
+        return f"{(a - b) / b * 100:+.1f}% ({a:.2f} vs {b:.2f} ms)"
+
+    @staticmethod
+    def middleware_cost(iterations):
+        """Seconds the middleware adds around a view that does nothing."""
+        request = RequestFactory().get('/')
+
+        def view(request):
+            return HttpResponse()
+
+        middleware = TelemetryMiddleware(view)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            view(request)
+        bare = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(iterations):
+            middleware(request)
+        return (time.perf_counter() - started - bare) / iterations
+
+    @staticmethod
+    def wrapper_cost(iterations):
+        """Seconds the DB wrapper adds to a query while a request is being recorded."""
+        telemetry.install()
+        connection.ensure_connection()
+
+        def run_queries():
+            started = time.perf_counter()
+            with connection.cursor() as cursor:
+                for _ in range(iterations):
+                    cursor.execute("SELECT 1")
+            return time.perf_counter() - started
+
+        metrics, token = telemetry.begin()
+        try:
+            wrapped = run_queries()
+            connection.execute_wrappers.remove(telemetry._record_query)
+            try:
+                bare = run_queries()
+            finally:
+                connection.execute_wrappers.insert(0, telemetry._record_query)
+        finally:
+            telemetry.end(token)
+        return (wrapped - bare) / iterations
+
+    @staticmethod
+    def client_for(middleware):
+        # The handler loads MIDDLEWARE on its first request, so each client keeps the stack it started with.
+        with override_settings(MIDDLEWARE=middleware):
+            client = Client()
+            client.get('/api/shop/search/products/', {'search': 'warm'})
+        return client
+
+    def interleaved(self, first, second, block, rounds):
+        """Request durations (ms) of each side, in alternating blocks, the order swapped every round."""
+        clients = [self.client_for(first), self.client_for(second)]
+        durations = [[], []]
+        for round_ in range(rounds):
+            for side in ((0, 1) if round_ % 2 == 0 else (1, 0)):
+                for _ in range(block):
+                    started = time.perf_counter()
+                    clients[side].get('/api/shop/search/products/', self.query)
+                    durations[side].append((time.perf_counter() - started) * 1000)
+        return durations
+
+    def profile(self, middleware):
+        client = self.client_for(middleware)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        for _ in range(60):
+            client.get('/api/shop/search/products/', self.query)
+        profiler.disable()
+        stats = pstats.Stats(profiler)
+        total = stats.total_tt
+        own = sum(
+            tottime for (filename, _, function), (_, _, tottime, _, _) in stats.stats.items()
+            if filename.endswith('core/telemetry.py') or (filename.endswith('core/middleware.py') and function in ('__call__', 'finish'))
+        )
+        self.report("cProfile, 60 searches", f"telemetry frames {own * 1000:.1f} ms of {total:.2f} s ({own / total:.2%})")
@@ -0,0 +1,291 @@
+"""
+Dashboard KPIs.
+
+Everything that grows with order history is kept in per-day buckets: order counts and totals
+by status, units and revenue by product, and failed transactions. A bucket is built by a few
+grouped queries over one day's rows (found through the created_at indexes). Past days are
+cached for get_history_ttl(), and so is their sum for the window; writes to one of their orders
+or transactions drop the day and bump the history version (dashboard/signals.py). A refresh thus
+only re-aggregates today and adds it to the cached history, never scanning the whole table.
+The assembled figures are cached for METRICS_TTL.
+
+Those drops only reach the cache of the process that made the write unless the default cache is
+shared (Redis, Memcached, a database or file cache). With the per-process LocMemCache, another
+worker serves a past day it already cached for up to the history TTL, so it defaults to a few
+minutes; set DASHBOARD_HISTORY_TTL higher (e.g. a day) once the default cache is shared.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from cms.models import Article
+from finance.models import Transaction
+from shop.models import Order, OrderItem, Product, Shipment
+
+
+METRICS_TTL = 60
+DEFAULT_HISTORY_TTL = 300
+DEFAULT_DAYS = 30
+LOW_STOCK_THRESHOLD = 5
+LIST_LIMIT = 10
+NON_REVENUE_STATUSES = ('cancelled', 'refunded')
+PENDING_SHIPMENT_STATUSES = ('pending', 'ready_to_ship')
+HISTORY_VERSION_KEY = 'dashboard:history-version'
+
+
+def get_history_ttl():
+    return getattr(settings, 'DASHBOARD_HISTORY_TTL', DEFAULT_HISTORY_TTL)
+
+
+def _day_key(day, closed=True):
+    # Today's bucket is still filling up, so it never gets reused once the day is over.
+    return f'dashboard:day:{day.isoformat()}' if closed else f'dashboard:day:{day.isoformat()}:open'
+
+
+def _history_key(start, end, version):
+    return f'dashboard:history:{start.isoformat()}:{end.isoformat()}:{version}'
+
+
+def _metrics_key(days):
+    return f'dashboard:metrics:{days}'
+
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def _day_ranges(days, field='created_at'):
+    """Q matching rows whose `field` falls on any of these (sorted) days, one range per run of consecutive days."""
+    condition = Q(pk__in=[])
+    start = previous = None
+    for day in days + [None]:
+        if start is not None and (day is None or day != previous + datetime.timedelta(days=1)):
+            condition |= Q(**{
+                f'{field}__gte': _day_start(start),
+                f'{field}__lt': _day_start(previous + datetime.timedelta(days=1)),
+            })
+            start = None
+        if start is None:
+            start = day
+        previous = day
+    return condition
+
+
+def _build_buckets(days):
+    """Aggregates the given days from scratch: {date: {'orders': ..., 'products': ..., 'failed_transactions': n}}."""
+    buckets = {day: {'orders': {}, 'products': {}, 'failed_transactions': 0} for day in days}
+    orders = Order.objects.order_by().filter(_day_ranges(days))
+
+    rows = (
+        orders.annotate(day=TruncDate('created_at'))
+        .values('day', 'status')
+        .annotate(count=Count('pk'), revenue=Sum('total_amount'))
+    )
+    for row in rows:
+        if row['day'] in buckets:
+            buckets[row['day']]['orders'][row['status']] = (row['count'], row['revenue'])
+
+    # order__in keeps the planner on the order date index instead of walking every item by product.
+    rows = (
+        OrderItem.objects.order_by()
+        .filter(order__in=orders.exclude(status__in=NON_REVENUE_STATUSES).values('pk'))
+        .annotate(day=TruncDate('order__created_at'))
+        .values('day', 'product_id')
+        .annotate(units=Sum('quantity'), revenue=OrderItem.line_total_sum())
+    )
+    for row in rows:
+        if row['day'] in buckets:
+            buckets[row['day']]['products'][row['product_id']] = (row['units'], row['revenue'])
+
+    rows = (
+        Transaction.objects.order_by()
+        .filter(_day_ranges(days), status='failed')
+        .annotate(day=TruncDate('created_at'))
+        .values('day')
+        .annotate(count=Count('pk'))
+    )
+    for row in rows:
+        if row['day'] in buckets:
+            buckets[row['day']]['failed_transactions'] = row['count']
+    return buckets
+
+
+def daily_buckets(dates):
+    """Returns [(date, bucket)] for these (sorted) dates, building only the ones missing from the cache."""
+    today = timezone.localdate()
+    keys = {day: _day_key(day, closed=day < today) for day in dates}
+    cached = cache.get_many(list(keys.values()))
+    buckets = {day: cached[key] for day, key in keys.items() if key in cached}
+    missing = [day for day in dates if day not in buckets]
+    if missing:
+        fresh = _build_buckets(missing)
+        closed = {keys[day]: bucket for day, bucket in fresh.items() if day < today}
+        if closed:
+            cache.set_many(closed, timeout=get_history_ttl())
+        if today in fresh:
+            cache.set(keys[today], fresh[today], timeout=METRICS_TTL)
+        buckets.update(fresh)
+    return [(day, buckets[day]) for day in dates]
+
+
+def _day_summary(day, bucket):
+    counted = [figures for status, figures in bucket['orders'].items() if status not in NON_REVENUE_STATUSES]
+    return {
+        'day': day,
+        'orders': sum(count for count, _ in counted),
+        'revenue': sum((revenue for _, revenue in counted), start=0),
+    }
+
+
+def _merge(buckets):
+    """Adds buckets up into one (orders by status, products, failed transactions)."""
+    orders, products, failed = {}, {}, 0
+    for bucket in buckets:
+        for status, (count, revenue) in bucket['orders'].items():
+            total_count, total_revenue = orders.get(status, (0, 0))
+            orders[status] = (total_count + count, total_revenue + revenue)
+        for product_id, (units, revenue) in bucket['products'].items():
+            total_units, total_revenue = products.get(product_id, (0, 0))
+            products[product_id] = (total_units + units, total_revenue + revenue)
+        failed += bucket['failed_transactions']
+    return {'orders': orders, 'products': products, 'failed_transactions': failed}
+
+
+def window_totals(days=DEFAULT_DAYS):
+    """
+    Returns the merged bucket for the last `days` days plus 'series', the per-day revenue. The
+    days before today are merged once and cached under the history version, so usually only
+    today's bucket is added on top.
+    """
+    today = timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    key = _history_key(start, today, cache.get(HISTORY_VERSION_KEY, 0))
+    history = cache.get(key)
+    if history is None:
+        buckets = daily_buckets([start + datetime.timedelta(days=offset) for offset in range(days - 1)])
+        history = _merge(bucket for _, bucket in buckets)
+        history['series'] = [_day_summary(day, bucket) for day, bucket in buckets]
+        cache.set(key, history, timeout=get_history_ttl())
+    (_, today_bucket), = daily_buckets([today])
+    totals = _merge([history, today_bucket])
+    totals['series'] = history['series'] + [_day_summary(today, today_bucket)]
+    return totals
+
+
+def orders_by_status(totals):
+    """[{'status', 'label', 'count', 'revenue'}] in ORDER_STATUS_CHOICES order."""
+    return [
+        {'status': status, 'label': label, 'count': totals['orders'].get(status, (0, 0))[0], 'revenue': totals['orders'].get(status, (0, 0))[1]}
+        for status, label in Order.ORDER_STATUS_CHOICES
+    ]
+
+
+def top_sellers(totals, limit=LIST_LIMIT):
+    """[{'product_id', 'name', 'slug', 'units', 'revenue'}] for the best selling products by units."""
+    ranked = sorted(totals['products'].items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+    products = Product.objects.only('name', 'slug').in_bulk([product_id for product_id, _ in ranked])
+    return [
+        {
+            'product_id': product_id,
+            'name': products[product_id].name if product_id in products else '',
+            'slug': products[product_id].slug if product_id in products else '',
+            'units': units,
+            'revenue': revenue,
+        }
+        for product_id, (units, revenue) in ranked
+    ]
+
+
+def low_stock_products(threshold=LOW_STOCK_THRESHOLD, limit=LIST_LIMIT):
+    products = Product.objects.filter(available=True, stock__lte=threshold)
+    return {
+        'count': products.count(),
+        'products': list(products.order_by('stock', 'name').values('id', 'name', 'slug', 'stock')[:limit]),
+    }
+
+
+def pending_shipments():
+    return Shipment.objects.filter(status__in=PENDING_SHIPMENT_STATUSES).aggregate(
+        count=Count('pk'), oldest=Min('created_at'),
+    )
+
+
+def recent_failed_transactions(limit=LIST_LIMIT):
+    return list(
+        Transaction.objects.filter(status='failed')
+        .order_by('-created_at', '-id')
+        .values('id', 'transaction_id_external', 'amount', 'currency__code', 'order__order_number', 'created_at')[:limit]
+    )
+
+
+def compute_metrics(days=DEFAULT_DAYS):
+    totals = window_totals(days)
+    revenue = totals['series']
+    statuses = orders_by_status(totals)
+    return {
+        'days': days,
+        'total_users': User.objects.count(),
+        'total_orders': Order.objects.count(),
+        'total_products': Product.objects.count(),
+        'total_articles': Article.objects.count(),
+        'revenue_by_day': revenue,
+        'window_revenue': sum((day['revenue'] for day in revenue), start=0),
+        'window_orders': sum(day['orders'] for day in revenue),
+        'window_order_count': sum(row['count'] for row in statuses),
+        'orders_by_status': statuses,
+        'top_sellers': top_sellers(totals),
+        'low_stock': low_stock_products(),
+        'pending_shipments': pending_shipments(),
+        'failed_transactions': {
+            'count': totals['failed_transactions'],
+            'transactions': recent_failed_transactions(),
+        },
+    }
+
+
+def get_metrics(days=DEFAULT_DAYS, refresh=False):
+    """
+    Returns the dashboard KPIs for the last `days` days. refresh=True recomputes today's bucket
+    and the point-in-time figures now instead of when they expire; cached past days are kept.
+    """
+    if refresh:
+        cache.delete_many([_metrics_key(days), _day_key(timezone.localdate(), closed=False)])
+    metrics = cache.get(_metrics_key(days))
+    if metrics is None:
+        metrics = compute_metrics(days)
+        cache.set(_metrics_key(days), metrics, timeout=METRICS_TTL)
+    return metrics
+
+
+def invalidate_days(datetimes):
+    """Drops the cached buckets of the days these timestamps fall on, once the transaction commits."""
+    days = {timezone.localdate(value) for value in datetimes if value is not None}
+    if days:
+        transaction.on_commit(lambda: _drop_days(days))
+
+
+def invalidate_order_days(order_ids):
+    """invalidate_days() for these orders' days, looked up with one query once the transaction commits."""
+    order_ids = set(order_ids)
+
+    def drop():
+        created_at = Order.objects.filter(pk__in=order_ids).values_list('created_at', flat=True)
+        _drop_days({timezone.localdate(value) for value in created_at})
+
+    transaction.on_commit(drop)
+
+
+def _drop_days(days):
+    if not days:
+        return
+    cache.delete_many([_day_key(day, closed) for day in days for closed in (True, False)])
+    if min(days) < timezone.localdate():
+        # A timestamp rather than incr(): an evicted key can never come back as an old version.
+        cache.set(HISTORY_VERSION_KEY, time.time_ns(), timeout=None)
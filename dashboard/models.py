@@ -1,3 +1,60 @@
 from django.db import models
 
-# Create your models here.
+# Daily sales rollups, maintained by dashboard/rollups.py. Amounts are increments summed per day,
+# so they can go through zero (e.g. an order booked and cancelled on different days).
+
+class DailySales(models.Model):
+    day = models.DateField()
+    gross = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refunds = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+        ordering = ['-day']
+
+
+class DailyProductSales(DailySales):
+    # No index of its own: SQLite would walk it across every day to group by product instead of
+    # reading the requested days from the (day, product) index.
+    product = models.ForeignKey('shop.Product', related_name='daily_sales', on_delete=models.CASCADE, db_index=False)
+    units = models.IntegerField(default=0)
+    discounts = models.DecimalField(max_digits=14, decimal_places=2, default=0) # order discounts spread over the lines
+
+    class Meta(DailySales.Meta):
+        verbose_name_plural = 'Daily product sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} product {self.product_id}: {self.units} units, {self.gross}"
+
+
+class DailyCategorySales(DailySales):
+    category = models.ForeignKey('shop.Category', related_name='daily_sales', on_delete=models.CASCADE)
+    units = models.IntegerField(default=0)
+    discounts = models.DecimalField(max_digits=14, decimal_places=2, default=0) # order discounts spread over the lines
+
+    class Meta(DailySales.Meta):
+        verbose_name_plural = 'Daily category sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='unique_daily_category_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} category {self.category_id}: {self.units} units, {self.gross}"
+
+
+class DailyCurrencySales(DailySales):
+    currency = models.ForeignKey('finance.Currency', related_name='daily_sales', on_delete=models.CASCADE)
+    # Successful payment/capture transactions; their amounts are already net of discounts.
+    payments = models.IntegerField(default=0)
+
+    class Meta(DailySales.Meta):
+        verbose_name_plural = 'Daily currency sales'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'currency'], name='unique_daily_currency_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} currency {self.currency_id}: {self.payments} payments, {self.gross}"
@@ -0,0 +1,291 @@
+"""
+Daily sales rollups: DailyProductSales, DailyCategorySales and DailyCurrencySales.
+
+Product and category rows count sales. An order is added on the day it was placed when it
+enters one of BOOKED_STATUSES and taken back out when it leaves them (e.g. cancelled) or is
+deleted; its discount is spread over its lines in proportion to their value. Currency rows
+count money: successful payment/capture transactions (already net of discounts) on the day
+they were processed. A
+successful refund is booked on its own day against its currency and, spread like discounts,
+against the products and categories of its order while that order is booked: the order's
+refunds leave and re-enter the product and category rows with it, as rebuild_day() counts them.
+
+Rows are changed with relative increments (UPDATE ... SET units = units + n) inside the
+writer's transaction, so concurrent writers never lose updates and a rolled back write leaves
+no trace. dashboard/signals.py feeds single saves; bulk writers call record_orders(); the
+backfill_sales_rollups command rebuilds days from the raw tables with rebuild_day().
+"""
+import datetime
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from finance.models import Transaction
+from shop.models import Order, OrderItem
+
+from .models import DailyCategorySales, DailyCurrencySales, DailyProductSales
+
+
+BOOKED_STATUSES = ('processing', 'shipped', 'delivered', 'refunded')
+PAYMENT_TYPES = ('payment', 'capture')
+UPDATE_BATCH = 500
+
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+# (key column, value columns) per table; SalesDelta rows hold the values in this order.
+ROLLUP_FIELDS = {
+    DailyProductSales: ('product_id', ('units', 'gross', 'discounts', 'refunds')),
+    DailyCategorySales: ('category_id', ('units', 'gross', 'discounts', 'refunds')),
+    DailyCurrencySales: ('currency_id', ('payments', 'gross', 'refunds')),
+}
+
+
+def _spread(amount, weights):
+    """Splits amount over weights pro rata, to the cent; the rounding remainder goes to the largest weight."""
+    total = sum(weights)
+    if not amount or not total:
+        return [ZERO] * len(weights)
+    shares = [(amount * weight / total).quantize(CENT, rounding=ROUND_HALF_UP) for weight in weights]
+    largest = max(range(len(weights)), key=weights.__getitem__)
+    shares[largest] += amount - sum(shares)
+    return shares
+
+
+class SalesDelta:
+    """Increments for rollup rows, accumulated in memory and written by save()."""
+
+    def __init__(self):
+        self.rows = {
+            model: defaultdict(lambda size=len(fields): [0] + [ZERO] * (size - 1))
+            for model, (_, fields) in ROLLUP_FIELDS.items()
+        }
+
+    def _add(self, model, day, key, values):
+        row = self.rows[model][(day, key)]
+        for index, value in enumerate(values):
+            row[index] += value
+
+    def add_order(self, created_at, discount, lines, sign=1):
+        """lines: [(product_id, category_id, quantity, line gross)] of an order placed at created_at."""
+        day = timezone.localdate(created_at)
+        for (product_id, category_id, quantity, gross), share in zip(lines, _spread(discount, [line[3] for line in lines])):
+            values = (sign * quantity, sign * gross, sign * share, ZERO)
+            self._add(DailyProductSales, day, product_id, values)
+            self._add(DailyCategorySales, day, category_id, values)
+
+    def add_payment(self, processed_at, currency_id, amount, sign=1):
+        self._add(DailyCurrencySales, timezone.localdate(processed_at), currency_id, (sign, sign * amount, ZERO))
+
+    def add_refund(self, processed_at, currency_id, amount, lines, sign=1):
+        """lines: the refunded order's lines, or [] to book the refund against the currency only."""
+        self._add(DailyCurrencySales, timezone.localdate(processed_at), currency_id, (0, ZERO, sign * amount))
+        self.add_refund_lines(processed_at, amount, lines, sign=sign)
+
+    def add_refund_lines(self, processed_at, amount, lines, sign=1):
+        """The part of a refund booked against its order's products and categories."""
+        day = timezone.localdate(processed_at)
+        for (product_id, category_id, _, _), share in zip(lines, _spread(amount, [line[3] for line in lines])):
+            values = (0, ZERO, ZERO, sign * share)
+            self._add(DailyProductSales, day, product_id, values)
+            self._add(DailyCategorySales, day, category_id, values)
+
+    def save(self):
+        """Adds the increments onto the stored rows."""
+        for model, rows in self.rows.items():
+            changed = [(key, values) for key, values in rows.items() if any(values)]
+            for start in range(0, len(changed), UPDATE_BATCH):
+                _apply(model, changed[start:start + UPDATE_BATCH])
+            rows.clear()
+
+    def create(self):
+        """Inserts the rows as they are, for days whose rows were just deleted."""
+        for model, rows in self.rows.items():
+            key_field, fields = ROLLUP_FIELDS[model]
+            model.objects.bulk_create(
+                [
+                    model(day=day, **{key_field: key}, **dict(zip(fields, values)))
+                    for (day, key), values in rows.items() if any(values)
+                ],
+                batch_size=UPDATE_BATCH,
+            )
+            rows.clear()
+
+
+def _apply(model, rows):
+    """
+    Adds [(day, key), values] onto the rows of model, creating missing rows at zero first. The
+    increments go through one parameterised UPDATE per row, located by the (day, key) unique
+    index; building the same change as a CASE expression costs more in Python than the UPDATEs.
+    """
+    key_field, fields = ROLLUP_FIELDS[model]
+    model.objects.bulk_create([model(day=day, **{key_field: key}) for (day, key), _ in rows], ignore_conflicts=True)
+    quote = connection.ops.quote_name
+    assignments = ', '.join(f'{quote(field)} = {quote(field)} + %s' for field in fields)
+    sql = f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE {quote("day")} = %s AND {quote(key_field)} = %s'
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [(*values, day, key) for (day, key), values in rows])
+
+
+def order_lines(order_ids):
+    """{order_id: [(product_id, category_id, quantity, line gross)]} in one query."""
+    lines = defaultdict(list)
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids).order_by('order_id', 'product_id')
+        .values_list('order_id', 'product_id', 'product__category_id', 'quantity', 'price_at_purchase')
+    )
+    for order_id, product_id, category_id, quantity, price in rows:
+        lines[order_id].append((product_id, category_id, quantity, price * quantity))
+    return lines
+
+
+def order_refunds(order_ids):
+    """{order_id: [(processed at, amount)]} of the orders' successful refunds, in one query."""
+    refunds = defaultdict(list)
+    rows = (
+        Transaction.objects.filter(order_id__in=order_ids, transaction_type='refund', status='successful')
+        .order_by('order_id', 'pk').values_list('order_id', 'processed_at', 'created_at', 'amount')
+    )
+    for order_id, processed_at, created_at, amount in rows:
+        refunds[order_id].append((processed_at or created_at, amount))
+    return refunds
+
+
+# Incremental feed
+
+def order_snapshot(order):
+    """The order fields the rollups depend on."""
+    return (order.status, order.discount_amount)
+
+
+@transaction.atomic
+def record_order_change(order, previous):
+    """Applies a saved order's change, given its order_snapshot() from before the save (None if new)."""
+    was_booked = previous is not None and previous[0] in BOOKED_STATUSES
+    is_booked = order.status in BOOKED_STATUSES
+    if not (was_booked or is_booked) or (was_booked and is_booked and previous[1] == order.discount_amount):
+        return
+    lines = order_lines([order.pk])[order.pk]
+    delta = SalesDelta()
+    if was_booked:
+        delta.add_order(order.created_at, previous[1], lines, sign=-1)
+    if is_booked:
+        delta.add_order(order.created_at, order.discount_amount, lines)
+    if was_booked != is_booked:
+        for processed_at, amount in order_refunds([order.pk])[order.pk]:
+            delta.add_refund_lines(processed_at, amount, lines, sign=1 if is_booked else -1)
+    delta.save()
+
+
+def record_order_removal(order):
+    """Takes a booked order out before it is deleted (its items are still needed)."""
+    if order.status in BOOKED_STATUSES:
+        record_orders([(order.pk, order.created_at, order.discount_amount)], sign=-1)
+
+
+@transaction.atomic
+def record_orders(orders, sign=1):
+    """
+    Adds (sign=1) or takes out (sign=-1) whole orders with their successful refunds, for bulk
+    writers that bypass signals: call it with the orders entering BOOKED_STATUSES after the
+    UPDATE, or leaving them. orders: iterable of (pk, created_at, discount_amount).
+    """
+    orders = list(orders)
+    lines = order_lines([pk for pk, _, _ in orders])
+    refunds = order_refunds([pk for pk, _, _ in orders])
+    delta = SalesDelta()
+    for pk, created_at, discount in orders:
+        delta.add_order(created_at, discount, lines.get(pk, []), sign=sign)
+        for processed_at, amount in refunds.get(pk, []):
+            delta.add_refund_lines(processed_at, amount, lines.get(pk, []), sign=sign)
+    delta.save()
+
+
+def transaction_snapshot(txn):
+    """The transaction fields the rollups depend on."""
+    return (txn.status, txn.transaction_type, txn.amount, txn.currency_id, txn.processed_at or txn.created_at, txn.order_id)
+
+
+def _add_transaction(delta, snapshot, sign):
+    status, transaction_type, amount, currency_id, processed_at, order_id = snapshot
+    if status != 'successful' or transaction_type not in PAYMENT_TYPES + ('refund',):
+        return
+    if transaction_type == 'refund':
+        booked = bool(order_id) and Order.objects.filter(pk=order_id, status__in=BOOKED_STATUSES).exists()
+        delta.add_refund(processed_at, currency_id, amount, order_lines([order_id])[order_id] if booked else [], sign=sign)
+    else:
+        delta.add_payment(processed_at, currency_id, amount, sign=sign)
+
+
+@transaction.atomic
+def record_transaction_change(txn, previous):
+    """Applies a saved transaction's change, given its transaction_snapshot() from before the save (None if new)."""
+    current = transaction_snapshot(txn) if txn is not None else None
+    if current == previous:
+        return
+    delta = SalesDelta()
+    if previous is not None:
+        _add_transaction(delta, previous, -1)
+    if current is not None:
+        _add_transaction(delta, current, 1)
+    delta.save()
+
+
+# Backfill
+
+def _day_start(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def rebuild_day(day, chunk_size=2000):
+    """
+    Recomputes one day of rollups from the raw tables, in one transaction. Orders and
+    transactions are read chunk_size at a time and summed in memory, which holds one row per
+    product, category and currency sold that day however many orders there were.
+    Returns (orders, transactions) counted.
+    """
+    start, end = _day_start(day), _day_start(day + datetime.timedelta(days=1))
+    counted_orders = counted_transactions = 0
+    delta = SalesDelta()
+    with transaction.atomic():
+        for model in ROLLUP_FIELDS:
+            model.objects.filter(day=day).delete()
+
+        orders = Order.objects.filter(status__in=BOOKED_STATUSES, created_at__gte=start, created_at__lt=end).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(orders.filter(pk__gt=last_pk).values_list('pk', 'created_at', 'discount_amount')[:chunk_size])
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            counted_orders += len(chunk)
+            lines = order_lines([pk for pk, _, _ in chunk])
+            for pk, created_at, discount in chunk:
+                delta.add_order(created_at, discount, lines.get(pk, []))
+
+        in_day = Q(processed_at__gte=start, processed_at__lt=end) | Q(processed_at__isnull=True, created_at__gte=start, created_at__lt=end)
+        transactions = Transaction.objects.filter(in_day, status='successful', transaction_type__in=PAYMENT_TYPES + ('refund',)).order_by('pk')
+        last_pk = 0
+        while True:
+            chunk = list(
+                transactions.filter(pk__gt=last_pk)
+                .values_list('pk', 'transaction_type', 'amount', 'currency_id', 'processed_at', 'created_at', 'order_id')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            counted_transactions += len(chunk)
+            refunded = {row[6] for row in chunk if row[1] == 'refund' and row[6]}
+            booked = Order.objects.filter(pk__in=refunded, status__in=BOOKED_STATUSES).values_list('pk', flat=True) if refunded else []
+            lines = order_lines(list(booked)) if refunded else {}
+            for _, transaction_type, amount, currency_id, processed_at, created_at, order_id in chunk:
+                when = processed_at or created_at
+                if transaction_type == 'refund':
+                    delta.add_refund(when, currency_id, amount, lines.get(order_id, []))
+                else:
+                    delta.add_payment(when, currency_id, amount)
+        delta.create()
+    return counted_orders, counted_transactions
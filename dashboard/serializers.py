@@ -0,0 +1,33 @@
+import datetime
+
+from django.utils import timezone
+from rest_framework import serializers
+
+from finance import rates
+
+
+class SalesReportParamsSerializer(serializers.Serializer):
+    """Query parameters of the sales reports; the range defaults to the last 30 days."""
+    since = serializers.DateField(required=False)
+    until = serializers.DateField(required=False)
+    ordering = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=500)
+
+    def validate(self, attrs):
+        attrs.setdefault('until', timezone.localdate())
+        attrs.setdefault('since', attrs['until'] - datetime.timedelta(days=29))
+        if attrs['since'] > attrs['until']:
+            raise serializers.ValidationError("'since' must not be after 'until'.")
+        return attrs
+
+
+class CurrencySalesReportParamsSerializer(SalesReportParamsSerializer):
+    """Adds ?convert_to=<currency code> to express the totals in one currency as well."""
+    convert_to = serializers.CharField(required=False, max_length=3)
+
+    def validate_convert_to(self, value):
+        try:
+            rates.get_rates().currency_id(value)
+        except rates.UnknownCurrency:
+            raise serializers.ValidationError(f"Unknown currency '{value}'.")
+        return value.upper()
@@ -0,0 +1,89 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from finance.models import Transaction
+from shop.models import Order, OrderItem, orders_updated
+from shop.transitions import orders_transitioned
+
+from . import metrics, rollups
+
+
+# Cached per-day dashboard buckets (see dashboard/metrics.py). Writes through queryset.update()
+# skip these: shop sends orders_updated (or orders_transitioned, below) for its own, others
+# call invalidate_days().
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_metrics_day(sender, instance, raw=False, **kwargs):
+    if not raw:
+        metrics.invalidate_days([instance.created_at])
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_order_item_day(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if OrderItem.order.is_cached(instance):
+        metrics.invalidate_days([instance.order.created_at])
+    else:
+        # Not instance.order: that would load the whole order for each item saved.
+        metrics.invalidate_order_days([instance.order_id])
+
+@receiver(orders_updated)
+def invalidate_updated_orders_days(sender, created_at, **kwargs):
+    metrics.invalidate_days(created_at)
+
+
+# Daily sales rollups (see dashboard/rollups.py). pre_save remembers what the rollups counted
+# for the row, so post_save can apply the difference; saves that can't change it are skipped.
+ORDER_ROLLUP_FIELDS = {'status', 'discount_amount'}
+TRANSACTION_ROLLUP_FIELDS = {'status', 'transaction_type', 'amount', 'currency', 'currency_id', 'processed_at', 'order', 'order_id'}
+
+@receiver(pre_save, sender=Order)
+def remember_order_rollup(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._rollup_skip = raw or (update_fields is not None and not ORDER_ROLLUP_FIELDS & set(update_fields))
+    instance._rollup_previous = None
+    if not instance._rollup_skip and not instance._state.adding:
+        instance._rollup_previous = Order.objects.filter(pk=instance.pk).values_list('status', 'discount_amount').first()
+
+@receiver(post_save, sender=Order)
+def roll_up_order(sender, instance, **kwargs):
+    if not getattr(instance, '_rollup_skip', True):
+        rollups.record_order_change(instance, instance._rollup_previous)
+
+@receiver(pre_delete, sender=Order)
+def roll_up_deleted_order(sender, instance, **kwargs):
+    # Before the delete, while the order's items are still there to take out.
+    rollups.record_order_removal(instance)
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_rollup(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._rollup_skip = raw or (update_fields is not None and not TRANSACTION_ROLLUP_FIELDS & set(update_fields))
+    instance._rollup_previous = None
+    if not instance._rollup_skip and not instance._state.adding:
+        previous = instance.stored_row() # the same SELECT as the refund ledger's (finance/signals.py)
+        instance._rollup_previous = rollups.transaction_snapshot(previous) if previous else None
+
+@receiver(post_save, sender=Transaction)
+def roll_up_transaction(sender, instance, **kwargs):
+    if not getattr(instance, '_rollup_skip', True):
+        rollups.record_transaction_change(instance, instance._rollup_previous)
+
+@receiver(post_delete, sender=Transaction)
+def roll_up_deleted_transaction(sender, instance, **kwargs):
+    rollups.record_transaction_change(None, rollups.transaction_snapshot(instance))
+
+
+# Bulk status transitions (shop/transitions.py) update orders without saving them one by one.
+@receiver(orders_transitioned)
+def roll_up_transitioned_orders(sender, changes, **kwargs):
+    entering = [(pk, created_at, discount) for pk, created_at, discount, old, new in changes
+                if old not in rollups.BOOKED_STATUSES and new in rollups.BOOKED_STATUSES]
+    leaving = [(pk, created_at, discount) for pk, created_at, discount, old, new in changes
+               if old in rollups.BOOKED_STATUSES and new not in rollups.BOOKED_STATUSES]
+    if entering:
+        rollups.record_orders(entering)
+    if leaving:
+        rollups.record_orders(leaving, sign=-1)
+    metrics.invalidate_days([created_at for _, created_at, _, _, _ in changes])
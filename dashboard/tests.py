@@ -1,3 +1,273 @@
-from django.test import TestCase
+import re
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import telemetry
+from core.query_plans import HotPath, QueryPlanMixin
+from core.sample_data import create_sample_rows
+from finance.models import Transaction
+from shop import transitions
+from shop.models import Order, OrderItem, Product
+
+from . import metrics, rollups
+from .metrics import pending_shipments
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    def test_pending_shipments_metric(self):
+        self.assertIndexSeeks(HotPath('Pending shipments metric', ['shop_shipment'], call=pending_shipments))
+
+
+class RollupFeedTests(TestCase):
+    """The incremental feed (dashboard/signals.py) must leave the rows rebuild_day() would build."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+    def stored_rows(self):
+        rows = {}
+        for model, (key_field, fields) in rollups.ROLLUP_FIELDS.items():
+            rows[model.__name__] = sorted(
+                row for row in model.objects.values_list('day', key_field, *fields) if any(row[2:])
+            )
+        return rows
+
+    def assertMatchesBackfill(self):
+        incremental = self.stored_rows()
+        rollups.rebuild_day(timezone.localdate())
+        self.assertEqual(incremental, self.stored_rows())
+
+    def refund(self, order):
+        payment = Transaction.objects.get(order=order, transaction_type='payment')
+        Transaction.objects.create(
+            order=order, user=self.user, amount=Decimal('7.00'), currency=payment.currency, transaction_type='refund',
+            status='successful', parent_transaction=payment, processed_at=timezone.now(),
+        )
+
+    def test_refunds_leave_and_reenter_with_a_saved_order(self):
+        order = Order.objects.first()
+        order.status = 'processing'
+        order.save()
+        self.refund(order)
+        self.assertMatchesBackfill()
+
+        order.status = 'cancelled'
+        order.save()
+        self.assertMatchesBackfill()
+
+        order.status = 'processing'
+        order.save()
+        self.assertMatchesBackfill()
+
+    def test_refunds_leave_and_reenter_with_transitioned_orders(self):
+        orders = list(Order.objects.order_by('pk')[:3])
+        numbers = [order.order_number for order in orders]
+        transitions.transition_orders(numbers, 'processing', user=self.user)
+        for order in orders:
+            self.refund(order)
+        self.assertMatchesBackfill()
+
+        transitions.transition_orders(numbers, 'cancelled', user=self.user)
+        self.assertMatchesBackfill()
+
+    def test_refunds_leave_with_a_deleted_order(self):
+        order = Order.objects.first()
+        order.status = 'shipped'
+        order.save()
+        self.refund(order)
+        order.delete()
+        self.assertMatchesBackfill()
+
+
+class MetricsInvalidationTests(TestCase):
+    """Item edits move order totals with UPDATEs, which skip post_save: the day's bucket must still go."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.today = timezone.localdate()
+        metrics.daily_buckets([self.today])
+        self.assertIsNotNone(cache.get(metrics._day_key(self.today, closed=False)))
+
+    def assertDayDropped(self):
+        self.assertIsNone(cache.get(metrics._day_key(self.today, closed=False)))
+
+    def test_adding_to_an_existing_line(self):
+        item = OrderItem.objects.select_related('order', 'product').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                f'/api/shop/orders/{item.order.order_number}/add-item/', {'product': item.product_id, 'quantity': 2},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertDayDropped()
+
+    def test_removing_a_line(self):
+        item = OrderItem.objects.select_related('order').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/shop/orders/{item.order.order_number}/remove-item/{item.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertDayDropped()
+
+    def test_apply_item_delta(self):
+        order = Order.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            order.apply_item_delta(Decimal('3.00'))
+        self.assertDayDropped()
+
+    def test_saving_items_does_not_load_their_orders(self):
+        items = list(OrderItem.objects.order_by('pk')) # orders not loaded
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries, transaction.atomic():
+                for item in items:
+                    item.quantity += 1
+                    item.save()
+            order_reads = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'FROM "shop_order"' in q['sql']]
+            self.assertEqual(order_reads, [])
+        self.assertDayDropped()
+
+    def test_deleting_an_order_with_its_items(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.first().delete()
+        self.assertDayDropped()
+
+
+class TelemetryMiddlewareTests(TestCase):
+    """TelemetryMiddleware: the Server-Timing header and what it adds to the registry."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+    def setUp(self):
+        self.registry = telemetry.Registry()
+        patcher = mock.patch.object(telemetry, 'registry', self.registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def server_timing(self, response):
+        """{metric: {param: value}} from the Server-Timing header."""
+        timing = {}
+        for metric in re.split(r',\s*(?=\w+;)', response['Server-Timing']):
+            name, *params = metric.split(';')
+            timing[name] = dict(param.split('=', 1) for param in params)
+        return timing
+
+    def cache_counts(self, timing):
+        return tuple(map(int, re.fullmatch(r'"hits=(\d+) misses=(\d+)"', timing['cache']['desc']).groups()))
+
+    def test_server_timing_header(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/reports/sales/currencies/')
+        self.assertEqual(response.status_code, 200)
+        timing = self.server_timing(response)
+        self.assertEqual(set(timing), {'db', 'ser', 'tpl', 'cache', 'total'})
+        self.assertEqual(timing['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreater(float(timing['db']['dur']), 0)
+        self.assertEqual(float(timing['tpl']['dur']), 0) # no templates behind an API view
+        self.assertGreaterEqual(float(timing['total']['dur']), float(timing['db']['dur']))
+
+    def test_serializer_time_and_cache_hits(self):
+        cache.clear()
+        url = f'/api/shop/products/{Product.objects.first().slug}/'
+        first = self.server_timing(self.client.get(url))
+        second = self.server_timing(self.client.get(url))
+        self.assertGreater(float(first['ser']['dur']), 0)
+        self.assertEqual(float(second['ser']['dur']), 0) # served from the product cache
+        (first_hits, first_misses), (second_hits, second_misses) = self.cache_counts(first), self.cache_counts(second)
+        self.assertGreater(second_hits, first_hits)
+        self.assertLess(second_misses, first_misses)
+
+    def test_requests_are_recorded_per_url_name(self):
+        self.client.get('/api/reports/sales/daily/')
+        self.client.get('/api/reports/sales/daily/')
+        self.client.get('/api/no-such-endpoint/')
+        views = self.registry.snapshot()['views']
+        self.assertEqual(set(views), {'sales_report_daily', '<unmatched>'})
+        self.assertEqual((views['sales_report_daily']['requests'], views['sales_report_daily']['window_requests']), (2, 2))
+        self.assertGreater(views['sales_report_daily']['avg_queries'], 0)
+
+        response = self.client.get('/api/reports/telemetry/')
+        self.assertEqual(response.json()['views']['sales_report_daily']['requests'], 2)
+        metrics_text = self.client.get('/api/reports/telemetry/metrics/').content.decode()
+        self.assertIn('http_requests_total{view="sales_report_daily"} 2', metrics_text)
+        self.assertIn('http_request_duration_seconds_count{view="sales_report_daily"} 2', metrics_text)
+
+    @override_settings(TELEMETRY_ENABLED=False)
+    def test_disabled(self):
+        response = APIClient().get('/api/reports/sales/daily/') # a new client loads the middleware again
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.registry.snapshot()['views'], {})
+
+
+@override_settings(TELEMETRY_WINDOW=100)
+class TelemetryRegistryTests(SimpleTestCase):
+    """Registry.snapshot(): cumulative counters and the quantiles of the rolling window."""
+
+    def setUp(self):
+        self.registry = telemetry.Registry()
+        patcher = mock.patch.object(telemetry, 'time')
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.clock.time.return_value = 1000.0
+
+    def record(self, *durations, status=200, view_name='view'):
+        for duration in durations:
+            self.registry.record(view_name, status, {
+                'duration_ms': duration, 'db_ms': 1.0, 'queries': 2, 'serializer_ms': 0.5, 'template_ms': 0.0, 'cache_hits': 1, 'cache_misses': 0,
+            })
+
+    def quantiles(self, view_name='view'):
+        stats = self.registry.snapshot()['views'][view_name]
+        return stats['p50_ms'], stats['p95_ms'], stats['p99_ms']
+
+    def test_quantiles_are_interpolated_within_buckets(self):
+        # Spread evenly over each bucket, so the interpolation lands on the exact figures.
+        self.record(*range(1, 101))
+        self.assertEqual(self.quantiles(), (50, 95, 99))
+
+    def test_quantiles_are_capped_at_the_slowest_request(self):
+        self.record(*[30] * 10)
+        self.assertTrue(all(25 < value <= 30 for value in self.quantiles()))
+        self.record(*[20000] * 10, view_name='slow') # past the last bucket
+        self.assertTrue(all(10000 < value <= 20000 for value in self.quantiles('slow')))
+
+    def test_window_keeps_only_recent_requests(self):
+        self.record(*[400] * 50)
+        self.clock.time.return_value = 1050.0
+        self.record(*[4] * 50)
+        stats = self.registry.snapshot()['views']['view']
+        self.assertEqual((stats['requests'], stats['window_requests']), (100, 100))
+        self.assertGreater(stats['p95_ms'], 250)
+
+        self.clock.time.return_value = 1101.0 # the first 50 are out of the window
+        stats = self.registry.snapshot()
+        self.assertEqual(stats['window_seconds'], 100)
+        view = stats['views']['view']
+        self.assertEqual((view['requests'], view['window_requests']), (100, 50))
+        self.assertTrue(all(2.5 < value <= 4 for value in self.quantiles()))
+
+        self.clock.time.return_value = 1200.0
+        self.assertEqual(self.quantiles(), (None, None, None))
+        self.assertEqual(self.registry.snapshot()['views']['view']['window_requests'], 0)
+
+    def test_errors_and_averages(self):
+        self.record(10, 20)
+        self.record(30, status=503)
+        self.record(40, status=404)
+        stats = self.registry.snapshot()['views']['view']
+        self.assertEqual((stats['requests'], stats['errors']), (4, 1))
+        self.assertEqual((stats['avg_db_ms'], stats['avg_queries'], stats['avg_cache_hits']), (1.0, 2, 1))
@@ -1,14 +1,161 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.http import HttpResponse
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.db.models import F, Sum
+from rest_framework import generics, permissions
+from rest_framework.views import APIView
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from core import telemetry
+from finance import rates
+from shop.models import Product
+
+from . import metrics
+from .models import DailyCategorySales, DailyCurrencySales, DailyProductSales
+from .serializers import CurrencySalesReportParamsSerializer, SalesReportParamsSerializer
 
 @login_required
 def dashboard_view(request):
-    # Placeholder context data
-    context = {
-        'total_users': 150, # Example data
-        'total_orders': 75,
-        'total_products': 300,
-        'total_articles': 45,
-        # Add more data as needed for charts or info boxes
+    # ?refresh=1 lets staff recompute today's figures before the cached ones expire.
+    refresh = request.user.is_staff and request.GET.get('refresh') == '1'
+    context = metrics.get_metrics(refresh=refresh)
+    context['sales_chart'] = {
+        'labels': [day['day'].strftime('%d %b') for day in context['revenue_by_day']],
+        'revenue': [float(day['revenue']) for day in context['revenue_by_day']],
+        'orders': [day['orders'] for day in context['revenue_by_day']],
     }
     return render(request, 'dashboard/index.html', context)
+
+
+class SalesReportView(generics.GenericAPIView):
+    """
+    Sums the daily sales rollups (dashboard/rollups.py) of `model` between ?since and ?until,
+    grouped by `group_by`. Reads only the rollup tables, never orders or items.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    params_serializer_class = SalesReportParamsSerializer
+    model = None
+    group_by = ()
+    sum_fields = ('units', 'gross', 'discounts', 'refunds')
+    default_ordering = '-gross'
+    default_limit = None
+
+    def get(self, request, *args, **kwargs):
+        params = self.params_serializer_class(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        sums = {field: Sum(field) for field in self.sum_fields}
+        rows = (
+            self.model.objects.filter(day__gte=params['since'], day__lte=params['until'])
+            .values(*self.group_by)
+            .annotate(**sums)
+            .annotate(net=self.get_net())
+            .order_by(self.get_ordering(params.get('ordering'), sums), *self.group_by)
+        )
+        limit = params.get('limit', self.default_limit)
+        return Response(self.get_report(params, self.get_results(rows[:limit] if limit else rows)))
+
+    def get_report(self, params, results):
+        return {'since': params['since'], 'until': params['until'], 'results': results}
+
+    def get_results(self, rows):
+        return list(rows)
+
+    def get_net(self):
+        # Over the sums annotated above.
+        return F('gross') - F('discounts') - F('refunds')
+
+    def get_ordering(self, ordering, sums):
+        if not ordering:
+            return self.default_ordering
+        if ordering.lstrip('-') not in [*sums, 'net', *self.group_by]:
+            raise ValidationError({'ordering': f"Cannot order by '{ordering}'."})
+        return ordering
+
+class DailySalesReportView(SalesReportView):
+    """Sales per day. Every order line is in exactly one category row, so these are the shop totals."""
+    model = DailyCategorySales
+    group_by = ('day',)
+    default_ordering = 'day'
+
+class ProductSalesReportView(SalesReportView):
+    model = DailyProductSales
+    group_by = ('product_id',)
+    default_limit = 50
+
+    def get_results(self, rows):
+        # Names are looked up for the page only; joining products first would join every rollup row.
+        rows = list(rows)
+        products = Product.objects.only('name', 'slug').in_bulk([row['product_id'] for row in rows])
+        for row in rows:
+            product = products.get(row['product_id'])
+            row['product__name'] = product.name if product else ''
+            row['product__slug'] = product.slug if product else ''
+        return rows
+
+class CategorySalesReportView(SalesReportView):
+    model = DailyCategorySales
+    group_by = ('category_id', 'category__name', 'category__slug')
+
+class CurrencySalesReportView(SalesReportView):
+    """
+    Money taken per currency: successful payments/captures (net of discounts) and refunds.
+    With ?convert_to=<code>, each row and the overall total are also given in that currency,
+    every day converted at its own closing rates (finance/rates.py).
+    """
+    params_serializer_class = CurrencySalesReportParamsSerializer
+    model = DailyCurrencySales
+    group_by = ('currency__code',)
+    sum_fields = ('payments', 'gross', 'refunds')
+
+    def get_net(self):
+        return F('gross') - F('refunds')
+
+    def get_report(self, params, results):
+        report = super().get_report(params, results)
+        if params.get('convert_to'):
+            report['converted'] = self.convert(params, results)
+        return report
+
+    def convert(self, params, results):
+        # The rollup holds one row per day and currency: a few thousand rows for years of sales,
+        # converted in one pass with one rate table per day.
+        to = params['convert_to']
+        days = (
+            DailyCurrencySales.objects.filter(day__gte=params['since'], day__lte=params['until'])
+            .values_list('day', 'currency__code', 'gross', 'refunds')
+        )
+        history = rates.get_history()
+        sums = defaultdict(lambda: {'gross': Decimal('0.00'), 'refunds': Decimal('0.00')})
+        for day, code, gross, refunds in days:
+            gross, refunds = history.table_for_day(day).convert_many([gross, refunds], code, to)
+            sums[code]['gross'] += gross
+            sums[code]['refunds'] += refunds
+        for row in results:
+            converted = sums[row['currency__code']]
+            row['gross_converted'] = converted['gross']
+            row['refunds_converted'] = converted['refunds']
+            row['net_converted'] = converted['gross'] - converted['refunds']
+        gross = sum((converted['gross'] for converted in sums.values()), Decimal('0.00'))
+        refunds = sum((converted['refunds'] for converted in sums.values()), Decimal('0.00'))
+        return {'currency': to, 'gross': gross, 'refunds': refunds, 'net': gross - refunds}
+
+
+class TelemetryView(APIView):
+    """Per URL name: requests, p50/p95/p99 latency over the rolling window and average DB, serializer and template time and cache hits (core.telemetry). Counters are per process."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(telemetry.registry.snapshot())
+
+
+class TelemetryMetricsView(APIView):
+    """The same figures in the Prometheus text format, for a scraper authenticated as staff (JWT bearer token)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(telemetry.registry.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
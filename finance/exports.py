@@ -0,0 +1,103 @@
+"""
+Streaming transaction exports, as CSV or JSON lines, for reconciliation against the gateway.
+Each row carries the gateway's answer (GatewayResponse), joined in the same query.
+
+Rows are read with one query through .iterator(chunk_size), so the export sees one consistent
+snapshot and memory stays flat at any table size. Lines are produced in blocks of
+LINES_PER_BLOCK: export_lines() for files, stream_lines() for a StreamingHttpResponse under
+WSGI and astream_lines() under ASGI (Django would otherwise buffer a sync iterator whole).
+"""
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+
+from .models import Transaction
+
+
+FIELDS = [
+    'id', 'transaction_id_external', 'order_number', 'user', 'transaction_type', 'status', 'amount',
+    'currency', 'parent_transaction_id', 'refunded_amount', 'refund_pending_amount',
+    'payment_method_details', 'gateway_response', 'notes', 'created_at', 'processed_at',
+]
+COLUMNS = [
+    'id', 'transaction_id_external', 'order__order_number', 'user__username', 'transaction_type', 'status', 'amount',
+    'currency__code', 'parent_transaction_id', 'refunded_amount', 'refund_pending_amount',
+    'payment_method_details', 'gateway_response__payload', 'notes', 'created_at', 'processed_at',
+]
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson'}
+LINES_PER_BLOCK = 500
+
+
+# Columns that need turning into text for JSON; the others are already str, int or None.
+DECIMAL_COLUMNS = [FIELDS.index(field) for field in ('amount', 'refunded_amount', 'refund_pending_amount')]
+DATETIME_COLUMNS = [FIELDS.index(field) for field in ('created_at', 'processed_at')]
+# Decoded JSON; nested as is in JSONL, written as JSON text in CSV.
+JSON_COLUMN = FIELDS.index('gateway_response')
+
+
+def iter_rows(queryset=None, chunk_size=2000):
+    """The transactions of `queryset` (all by default) as FIELDS lists, in pk order."""
+    queryset = Transaction.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('pk').values_list(*COLUMNS).iterator(chunk_size=chunk_size)
+    for row in rows:
+        row = list(row)
+        for i in DECIMAL_COLUMNS:
+            row[i] = str(row[i])
+        for i in DATETIME_COLUMNS:
+            if row[i] is not None:
+                row[i] = row[i].isoformat()
+        yield row
+
+
+def export_lines(rows, file_format='csv'):
+    """Blocks of CSV (with a header) or JSONL lines for FIELDS rows."""
+    if file_format == 'jsonl':
+        block = []
+        for row in rows:
+            block.append(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n')
+            if len(block) >= LINES_PER_BLOCK:
+                yield ''.join(block)
+                block = []
+        if block:
+            yield ''.join(block)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    count = 0
+    for row in rows:
+        if row[JSON_COLUMN] is not None:
+            row[JSON_COLUMN] = json.dumps(row[JSON_COLUMN], ensure_ascii=False)
+        writer.writerow(row)
+        count += 1
+        if count % LINES_PER_BLOCK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_lines(queryset, file_format='csv', chunk_size=2000):
+    for block in export_lines(iter_rows(queryset, chunk_size), file_format):
+        yield block.encode('utf-8')
+
+
+async def astream_lines(queryset, file_format='csv', chunk_size=2000):
+    # The DB cursor stays on the request's sync thread (thread-sensitive sync_to_async);
+    # each step hands one block to the event loop.
+    blocks = stream_lines(queryset, file_format, chunk_size)
+    next_block = sync_to_async(next)
+    try:
+        while True:
+            block = await next_block(blocks, None)
+            if block is None:
+                return
+            yield block
+    finally:
+        # Closes the cursor on its own thread when the client goes away mid-export.
+        await sync_to_async(blocks.close)()
@@ -0,0 +1,109 @@
+"""
+A local stand-in for the payment gateway, speaking HttpGatewayClient's protocol
+(finance/gateway.py), for latency and throughput tests. Run it with `manage.py run_fake_gateway`
+or start FakeGatewayServer from a script.
+
+Every answer waits `latency` seconds (plus up to `jitter`); `error_rate` of the requests get a
+503 instead. Payment details containing 'fail' are declined with a 402. Answers are remembered
+by Idempotency-Key, so a retried request gets the original answer back.
+"""
+import asyncio
+import json
+import random
+import uuid
+
+
+class FakeGatewayServer:
+    def __init__(self, host='127.0.0.1', port=8765, latency=0.1, jitter=0.0, error_rate=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.answers = {}
+        self.stats = {'requests': 0, 'connections': 0, 'errors': 0, 'replayed': 0}
+        self.server = None
+        self.connections = {} # handler task -> writer
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1] # when started on port 0
+        return self
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        self.server.close()
+        # Keep-alive connections outlive close(); end them so no handler is left pending.
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        handler = asyncio.current_task()
+        self.connections[handler] = writer
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                status, answer = await self.answer(*request)
+                body = json.dumps(answer).encode()
+                writer.write(
+                    f'HTTP/1.1 {status} {"OK" if status == 200 else "Error"}\r\n'
+                    f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                    f'Connection: keep-alive\r\n\r\n'.encode() + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.pop(handler, None)
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader):
+        try:
+            request_line = await reader.readuntil(b'\r\n')
+        except asyncio.IncompleteReadError:
+            return None # client closed the connection between requests
+        _, path, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return path, headers, body
+
+    async def answer(self, path, headers, body):
+        self.stats['requests'] += 1
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        key = (path, headers.get('idempotency-key'))
+        if key[1] and key in self.answers:
+            self.stats['replayed'] += 1
+            return self.answers[key]
+        if random.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return 503, {'error': 'Gateway temporarily unavailable.'}
+        payload = json.loads(body or b'{}')
+        if path.endswith('/payments'):
+            if 'fail' in str(payload.get('payment_method_details', '')).lower():
+                result = 402, {'success': False, 'transaction_id': None, 'error': 'Payment declined by fake gateway.'}
+            else:
+                result = 200, {'success': True, 'transaction_id': f'FAKE_GW_{uuid.uuid4().hex[:10].upper()}', 'error': None}
+        elif path.endswith('/refunds'):
+            result = 200, {'success': True, 'refund_id': f'FAKE_REF_{uuid.uuid4().hex[:8].upper()}', 'error': None}
+        else:
+            return 404, {'error': f'Unknown endpoint {path}.'}
+        if key[1]:
+            self.answers[key] = result
+        return result
@@ -0,0 +1,309 @@
+"""
+Payment gateway clients.
+
+Views talk to the gateway through get_gateway(), configured by FINANCE_PAYMENT_GATEWAY:
+
+    FINANCE_PAYMENT_GATEWAY = {
+        'BACKEND': 'finance.gateway.HttpGatewayClient',
+        'OPTIONS': {'base_url': 'https://gateway.example.com', 'timeout': 5.0},
+    }
+
+Without it, MockGatewayClient answers in-process. Clients are async: the payment views await
+the gateway without holding a worker thread, which pays off when served through core/asgi.py.
+
+HttpGatewayClient speaks JSON over HTTP/1.1 keep-alive connections, pooled per event loop
+(asyncio streams cannot cross loops). Every attempt has its own timeout. Connection errors,
+timeouts and 5xx answers are retried with exponential backoff and jitter, resending the same
+Idempotency-Key so the gateway can never charge twice. Consecutive failures open a circuit
+breaker: calls then fail fast with GatewayUnavailable until a trial call succeeds after
+`reset_timeout`. `manage.py run_fake_gateway` serves the same protocol locally.
+"""
+import asyncio
+import json
+import random
+import ssl
+import threading
+import time
+import uuid
+import weakref
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or answered garbage; the outcome of the call is unknown."""
+
+
+class GatewayUnavailable(GatewayError):
+    """The circuit breaker is open: the call was not sent."""
+
+
+class BaseGatewayClient:
+    """
+    Gateway calls return the gateway's verdict as a dict:
+    payments {'success', 'transaction_id', 'error'}, refunds {'success', 'refund_id', 'error'}.
+    A declined call is a normal answer (success False); GatewayError means there was no answer.
+    """
+
+    async def process_payment(self, amount, currency_code, payment_method_details, idempotency_key=None):
+        raise NotImplementedError
+
+    async def process_refund(self, original_transaction_id, amount, currency_code, idempotency_key=None):
+        raise NotImplementedError
+
+
+class MockGatewayClient(BaseGatewayClient):
+    """Approves everything except payment details containing 'fail'. No network involved."""
+
+    async def process_payment(self, amount, currency_code, payment_method_details, idempotency_key=None):
+        print(f"MockGateway: Processing payment of {amount} {currency_code} with details: {payment_method_details}")
+        if "fail" in payment_method_details.lower(): # Simulate failure
+            return {"success": False, "transaction_id": None, "error": "Payment declined by mock gateway."}
+        return {"success": True, "transaction_id": f"MOCK_GW_{uuid.uuid4().hex[:10].upper()}", "error": None}
+
+    async def process_refund(self, original_transaction_id, amount, currency_code, idempotency_key=None):
+        print(f"MockGateway: Processing refund for {original_transaction_id} of {amount} {currency_code}")
+        return {"success": True, "refund_id": f"MOCK_REF_{uuid.uuid4().hex[:8].upper()}", "error": None}
+
+
+class CircuitBreaker:
+    """
+    Closed until `failure_threshold` consecutive failures, then open for `reset_timeout`
+    seconds; after that one trial call is let through (half-open) and decides. Shared by every
+    thread and event loop of the process, hence the lock (never held across an await).
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self.opened_at >= self.reset_timeout else 'open'
+
+    def before_call(self):
+        """Raises GatewayUnavailable unless a call may go out now."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            # A trial that never reported back (e.g. cancelled) stops blocking after reset_timeout.
+            trial_running = self.trial_started_at is not None and now - self.trial_started_at < self.reset_timeout
+            if now - self.opened_at < self.reset_timeout or trial_running:
+                raise GatewayUnavailable("Payment gateway circuit is open.")
+            self.trial_started_at = now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_started_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_started_at = None
+
+
+class _Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+
+    def usable(self, idle_timeout):
+        return (
+            not self.writer.is_closing() and not self.reader.at_eof()
+            and time.monotonic() - self.last_used < idle_timeout
+        )
+
+    def close(self):
+        self.writer.close()
+
+
+class _ConnectionPool:
+    """Keep-alive connections to one host for one event loop, at most `size` open at a time."""
+
+    def __init__(self, host, port, ssl_context, size, idle_timeout):
+        self.host, self.port, self.ssl_context = host, port, ssl_context
+        self.idle_timeout = idle_timeout
+        self.slots = asyncio.Semaphore(size)
+        self.idle = []
+
+    async def acquire(self, connect_timeout):
+        await self.slots.acquire()
+        try:
+            while self.idle:
+                connection = self.idle.pop()
+                if connection.usable(self.idle_timeout):
+                    return connection
+                connection.close()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl_context), connect_timeout,
+            )
+            return _Connection(reader, writer)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, reuse):
+        if reuse:
+            connection.last_used = time.monotonic()
+            self.idle.append(connection)
+        else:
+            connection.close()
+        self.slots.release()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
+class _RetryableStatus(GatewayError):
+    pass
+
+
+class HttpGatewayClient(BaseGatewayClient):
+    """
+    JSON over HTTP: POST {base_url}/payments and /refunds. 200 carries the verdict (402 for a
+    decline is accepted too); 5xx is retried; other statuses raise GatewayError.
+    """
+
+    def __init__(self, base_url, timeout=5.0, connect_timeout=2.0, max_connections=20, idle_timeout=30.0,
+                 retries=2, backoff=0.2, max_backoff=2.0, failure_threshold=5, reset_timeout=30.0):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == 'https' else 80)
+        self.ssl_context = ssl.create_default_context() if url.scheme == 'https' else None
+        self.prefix = url.path.rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._pools = weakref.WeakKeyDictionary()
+        self._pools_lock = threading.Lock()
+
+    async def process_payment(self, amount, currency_code, payment_method_details, idempotency_key=None):
+        return await self.call('/payments', {
+            'amount': str(amount), 'currency': currency_code, 'payment_method_details': payment_method_details,
+        }, idempotency_key)
+
+    async def process_refund(self, original_transaction_id, amount, currency_code, idempotency_key=None):
+        return await self.call('/refunds', {
+            'transaction_id': original_transaction_id, 'amount': str(amount), 'currency': currency_code,
+        }, idempotency_key)
+
+    async def call(self, path, payload, idempotency_key=None):
+        """POSTs payload with retries; returns the decoded answer or raises GatewayError."""
+        self.breaker.before_call()
+        body = json.dumps(payload).encode()
+        headers = {'Idempotency-Key': idempotency_key or uuid.uuid4().hex}
+        for attempt in range(self.retries + 1):
+            try:
+                status, answer = await asyncio.wait_for(self._post(self.prefix + path, body, headers), self.timeout)
+                if status >= 500:
+                    raise _RetryableStatus(f"Gateway answered {status}.")
+            except (OSError, EOFError, asyncio.IncompleteReadError, asyncio.TimeoutError, _RetryableStatus) as e:
+                if attempt == self.retries:
+                    self.breaker.record_failure()
+                    raise GatewayError(f"Payment gateway call failed after {attempt + 1} attempts: {e!r}") from e
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+            if status not in (200, 402) or not isinstance(answer, dict):
+                raise GatewayError(f"Unexpected gateway answer ({status}).")
+            return answer
+
+    def _pool(self):
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.get(loop)
+            if pool is None:
+                pool = self._pools[loop] = _ConnectionPool(
+                    self.host, self.port, self.ssl_context, self.max_connections, self.idle_timeout,
+                )
+            return pool
+
+    async def _post(self, path, body, headers):
+        pool = self._pool()
+        connection = await pool.acquire(self.connect_timeout)
+        reuse = False
+        try:
+            lines = [
+                f'POST {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Content-Type: application/json',
+                f'Content-Length: {len(body)}', 'Connection: keep-alive',
+                *(f'{name}: {value}' for name, value in headers.items()),
+            ]
+            connection.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await connection.writer.drain()
+            status, response_headers, content = await self._read_response(connection.reader)
+            reuse = response_headers.get('connection', '').lower() != 'close'
+            try:
+                answer = json.loads(content) if content else None
+            except ValueError:
+                answer = None
+            return status, answer
+        finally:
+            # A cancelled or failed exchange leaves the connection mid-message: never reuse it.
+            pool.release(connection, reuse)
+
+    @staticmethod
+    async def _read_response(reader):
+        status_line = await reader.readuntil(b'\r\n')
+        parts = status_line.decode('latin-1').split(' ', 2)
+        if len(parts) < 2 or not parts[1].isdigit():
+            raise GatewayError(f"Malformed status line: {status_line!r}")
+        headers = {}
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'content-length' not in headers:
+            raise GatewayError("Gateway responses must carry a Content-Length.")
+        content = await reader.readexactly(int(headers['content-length']))
+        return int(parts[1]), headers, content
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """Returns the configured client (FINANCE_PAYMENT_GATEWAY), built once per process."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            config = getattr(settings, 'FINANCE_PAYMENT_GATEWAY', None)
+            if config:
+                _gateway = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            else:
+                _gateway = MockGatewayClient()
+        return _gateway
+
+
+def reset_gateway():
+    """Drops the client built by get_gateway(), e.g. after changing the setting."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = None
@@ -0,0 +1,176 @@
+"""
+Idempotency keys for the payment endpoints.
+
+A client sends `Idempotency-Key: <unique string>` with a POST; retrying it with the same key
+(after a timeout, say) gets the first answer back instead of paying twice. The first request
+stores the key, locked for LOCK_TIMEOUT, and its answer when done. After that, a request with
+the same key and user:
+
+- and the same method, path and body gets the stored answer replayed (Idempotent-Replayed: true),
+  without running the view or calling the gateway;
+- arriving while the first one still runs gets 409 with Retry-After;
+- for a different request gets 422.
+
+5xx answers and exceptions release the key: nothing was settled, so a retry runs the view again.
+Answers are kept for FINANCE_IDEMPOTENCY_KEY_TTL, then purge_expired() deletes them in batches.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction as django_db_transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+DEFAULT_TTL = timedelta(hours=24)
+# Longer than a gateway call with all its retries, so a running request is never taken over.
+LOCK_TIMEOUT = timedelta(seconds=60)
+RETRY_AFTER = 1
+
+
+def get_ttl():
+    return getattr(settings, 'FINANCE_IDEMPOTENCY_KEY_TTL', DEFAULT_TTL)
+
+
+def fingerprint(request):
+    """SHA-256 of the method, path and parsed body, so retries may reorder JSON keys."""
+    data = request.data
+    if hasattr(data, 'lists'): # QueryDict from a form or multipart body
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def begin(request):
+    """
+    Claims the request's Idempotency-Key. Returns (record, None) when the view should run,
+    (None, response) when `response` answers the request instead, and (None, None) when the
+    request has no key (or no user to scope it to).
+    """
+    key = request.headers.get(HEADER)
+    if not key or not request.user.is_authenticated:
+        return None, None
+    if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return None, Response({'detail': f'{HEADER} is too long.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    request_fingerprint = fingerprint(request)
+    for _ in range(2):
+        now = timezone.now()
+        try:
+            with django_db_transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=request.user, key=key, fingerprint=request_fingerprint,
+                    locked_until=now + LOCK_TIMEOUT, expires_at=now + get_ttl(),
+                )
+            return record, None
+        except IntegrityError:
+            pass
+        record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+        if record is None: # released or purged in between: try again
+            continue
+
+        expired = record.expires_at <= now
+        if not expired and record.fingerprint != request_fingerprint:
+            return None, Response(
+                {'detail': f'This {HEADER} was already used for a different request.'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if not expired and record.status == 'completed':
+            return None, Response(record.response_body, status=record.response_status, headers={'Idempotent-Replayed': 'true'})
+        if expired or record.locked_until <= now:
+            # The answer expired, or the request holding the lock died: take the key over. The
+            # conditional UPDATE lets only one of several concurrent retries win.
+            locked_until = now + LOCK_TIMEOUT
+            taken = IdempotencyKey.objects.filter(
+                pk=record.pk, status=record.status, locked_until=record.locked_until, expires_at=record.expires_at,
+            ).update(
+                fingerprint=request_fingerprint, status='in_progress', response_status=None, response_body=None,
+                locked_until=locked_until, expires_at=now + get_ttl(),
+            )
+            if taken:
+                record.locked_until = locked_until
+                return record, None
+        break
+    return None, Response(
+        {'detail': f'A request with this {HEADER} is still in progress.'},
+        status=status.HTTP_409_CONFLICT, headers={'Retry-After': str(RETRY_AFTER)},
+    )
+
+
+def _owned(record):
+    # Filters to the key while it still belongs to this request (it was not taken over).
+    return IdempotencyKey.objects.filter(pk=record.pk, status='in_progress', locked_until=record.locked_until)
+
+
+def finish(record, response):
+    """Stores the view's answer for replays, or releases the key after a 5xx."""
+    if record is None:
+        return
+    if response.status_code >= 500:
+        release(record)
+        return
+    _owned(record).update(
+        status='completed', response_status=response.status_code, response_body=response.data, locked_until=None,
+    )
+
+
+def release(record):
+    if record is not None:
+        _owned(record).delete()
+
+
+def idempotent(handler):
+    """Makes a view handler (sync or async) honour the Idempotency-Key header."""
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(view, request, *args, **kwargs):
+            record, response = await sync_to_async(begin)(request)
+            if response is not None:
+                return response
+            try:
+                response = await handler(view, request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(finish)(record, response)
+            return response
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        record, response = begin(request)
+        if response is not None:
+            return response
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except BaseException:
+            release(record)
+            raise
+        finish(record, response)
+        return response
+    return wrapper
+
+
+def purge_expired(now=None, batch_size=1000):
+    """Deletes expired keys in batches. Returns the number deleted."""
+    now = now or timezone.now()
+    purged = 0
+    while True:
+        batch = list(
+            IdempotencyKey.objects.filter(expires_at__lte=now).exclude(locked_until__gt=now)
+            .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return purged
+        deleted, _ = IdempotencyKey.objects.filter(pk__in=batch).delete()
+        purged += deleted
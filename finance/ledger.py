@@ -0,0 +1,126 @@
+"""
+Refund ledger: each transaction keeps running totals of the refunds against it, so what is
+left to refund is read from its own row instead of summing its child refunds.
+
+- refunded_amount: the successful refunds;
+- refund_pending_amount: refunds awaiting the gateway. They are reserved up front, so
+  concurrent partial refunds cannot add up to more than the transaction's amount.
+
+Saving or deleting a refund moves its amount between the totals of its parent with one F()
+UPDATE (finance/signals.py), in the same database transaction as the refund row. The refund
+view locks the parent row first and checks its refundable_amount under that lock; whatever
+settles a pending refund (the refund view, the gateway callbacks) locks the refund row with
+lock_pending() first, so it is moved out of pending once.
+reconcile() recomputes the totals from the refund rows in bulk.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction as django_db_transaction
+from django.db.models import F, Sum
+
+from .models import Transaction
+
+
+PENDING_STATUSES = ('pending', 'requires_action')
+
+CENT = Decimal('0.01')
+
+# The fields of a transaction that decide what it adds to its parent's totals.
+SNAPSHOT_FIELDS = ('transaction_type', 'parent_transaction_id', 'status', 'amount')
+
+
+def bucket(status):
+    """The parent's total a refund in this status counts towards, if any."""
+    if status == 'successful':
+        return 'refunded_amount'
+    if status in PENDING_STATUSES:
+        return 'refund_pending_amount'
+    return None
+
+
+def snapshot(transaction):
+    """(parent id, total, amount) a transaction adds to its parent, or None."""
+    if transaction is None or transaction.transaction_type != 'refund' or not transaction.parent_transaction_id:
+        return None
+    field = bucket(transaction.status)
+    return (transaction.parent_transaction_id, field, transaction.amount) if field else None
+
+
+def apply(previous, current):
+    """Moves a refund's amount from its `previous` snapshot to its `current` one."""
+    deltas = defaultdict(Decimal)
+    if previous:
+        parent_id, field, amount = previous
+        deltas[parent_id, field] -= amount
+    if current:
+        parent_id, field, amount = current
+        deltas[parent_id, field] += amount
+    updates = defaultdict(dict)
+    for (parent_id, field), delta in deltas.items():
+        if delta:
+            updates[parent_id][field] = F(field) + delta
+    for parent_id, fields in updates.items():
+        Transaction.objects.filter(pk=parent_id).update(**fields)
+
+
+def lock_pending(transaction):
+    """
+    Locks the transaction's row until the end of the database transaction and re-reads its
+    status. Returns False when it is no longer pending: a gateway callback or another request
+    settled it first, and settling it again would apply a refund to the ledger twice.
+    """
+    transaction.status = Transaction.objects.select_for_update().filter(pk=transaction.pk).values_list('status', flat=True).first()
+    return transaction.status in PENDING_STATUSES
+
+
+def expected_totals(parent_ids):
+    """{parent id: {'refunded_amount': ..., 'refund_pending_amount': ...}} recomputed from the refund rows."""
+    totals = {pk: {'refunded_amount': Decimal('0.00'), 'refund_pending_amount': Decimal('0.00')} for pk in parent_ids}
+    rows = (
+        Transaction.objects.filter(parent_transaction_id__in=parent_ids, transaction_type='refund').order_by()
+        .values_list('parent_transaction_id', 'status').annotate(total=Sum('amount'))
+    )
+    for parent_id, status, total in rows:
+        field = bucket(status)
+        if field:
+            totals[parent_id][field] += Decimal(total).quantize(CENT)
+    return totals
+
+
+def reconcile(batch_size=1000, fix=False):
+    """
+    Checks every transaction's refund totals against its refund rows, batch_size transactions
+    at a time (two queries per batch). Returns (transactions checked, mismatches), each mismatch
+    as (pk, stored (refunded, pending), expected (refunded, pending)); with fix=True, also
+    corrects them.
+    """
+    checked = 0
+    mismatches = []
+    last_pk = 0
+    while True:
+        batch = list(
+            Transaction.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'refunded_amount', 'refund_pending_amount')[:batch_size]
+        )
+        if not batch:
+            return checked, mismatches
+        last_pk = batch[-1][0]
+        checked += len(batch)
+        expected = expected_totals([pk for pk, _, _ in batch])
+        wrong = [
+            (pk, (refunded, pending), (expected[pk]['refunded_amount'], expected[pk]['refund_pending_amount']))
+            for pk, refunded, pending in batch
+            if (refunded, pending) != (expected[pk]['refunded_amount'], expected[pk]['refund_pending_amount'])
+        ]
+        mismatches.extend(wrong)
+        if fix and wrong:
+            _fix([pk for pk, _, _ in wrong])
+
+
+@django_db_transaction.atomic
+def _fix(pks):
+    # Recomputed under the row locks, so refunds saved since the check are counted too.
+    list(Transaction.objects.select_for_update().filter(pk__in=pks).values_list('pk'))
+    for pk, totals in expected_totals(pks).items():
+        Transaction.objects.filter(pk=pk).update(**totals)
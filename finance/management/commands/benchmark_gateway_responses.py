@@ -0,0 +1,37 @@
+import statistics
+
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from core.benchmarks import BenchmarkCommand, create_transactions, timed
+from finance.models import Transaction
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Times the transaction list, a search that matches nothing (a full scan) and a count of "
+        "failed transactions over --transactions transactions whose gateway responses are about "
+        "--payload-bytes each. Medians of --repeat runs."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--transactions', type=int, default=50000)
+        parser.add_argument('--payload-bytes', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=30)
+
+    def run(self, **options):
+        self.step(f"Creating {options['transactions']} transactions...")
+        create_transactions(self.rng, options['transactions'], payload_bytes=options['payload_bytes'])
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('bench-transactions', 'bench@example.com', 'bench'))
+
+        for label, params in (
+            ("list (100/page)", {'page_size': 100}),
+            ("search (full scan)", {'page_size': 100, 'search': 'no-such-transaction'}),
+        ):
+            response, durations = timed(lambda: client.get('/api/finance/transactions/', params), options['repeat'])
+            self.report(label, f"{statistics.median(durations):.1f} ms, body {len(response.content) / 1024:.1f} KB")
+
+        _, durations = timed(lambda: Transaction.objects.filter(status='failed').count(), options['repeat'])
+        self.report("count(status=failed)", f"{statistics.median(durations):.1f} ms")
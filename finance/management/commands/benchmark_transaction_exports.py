@@ -0,0 +1,97 @@
+import csv
+import os
+import tempfile
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from rest_framework.test import APIClient
+
+from core.benchmarks import BenchmarkCommand, create_transactions, in_child, peak_rss_mb
+from finance.models import Transaction
+
+
+# Mismatches planted in the settlement file.
+AMOUNT_MISMATCHES = 10
+MISSING_FROM_FILE = 4
+UNKNOWN_IDS = 1
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Times export_transactions (CSV and JSONL), the export endpoint and reconcile_settlement "
+        "over --transactions transactions, each in a child process so its peak RSS is its own."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--transactions', type=int, default=10000000)
+        parser.add_argument('--sort-buffer', type=int, default=200000, help="Passed to reconcile_settlement.")
+
+    def run(self, **options):
+        self.step(f"Creating {options['transactions']} transactions...")
+        # Generated in a child too: the parent's resident memory is where each child starts.
+        count, _, _ = in_child(lambda: create_transactions(self.rng, options['transactions']))
+        self.report("parent RSS (each child starts there)", f"{peak_rss_mb():.0f} MB")
+
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'export')
+            for file_format in ('csv', 'jsonl'):
+                def export(file_format=file_format):
+                    with open(os.devnull, 'w') as quiet:
+                        call_command('export_transactions', format=file_format, output=output, stderr=quiet)
+                    return os.path.getsize(output)
+
+                size, seconds, rss = in_child(export)
+                self.report(f"export_transactions {file_format}", self.describe(count, seconds, rss, size))
+
+            size, seconds, rss = in_child(self.export_endpoint)
+            self.report("export endpoint (csv)", self.describe(count, seconds, rss, size))
+
+            self.step("Writing the settlement file...")
+            settlement_file = os.path.join(directory, 'settlement.csv')
+            self.write_settlement(settlement_file)
+            report = os.path.join(directory, 'report.csv')
+
+            def reconcile():
+                with open(os.devnull, 'w') as quiet:
+                    call_command('reconcile_settlement', settlement_file, output=report, sort_buffer=options['sort_buffer'], stderr=quiet)
+                with open(report, newline='', encoding='utf-8') as report_file:
+                    return dict(Counter(row['kind'] for row in csv.DictReader(report_file)))
+
+            kinds, seconds, rss = in_child(reconcile)
+            self.report("reconcile_settlement", self.describe(count, seconds, rss))
+            self.report(
+                "mismatches found",
+                f"{kinds} (planted: {AMOUNT_MISMATCHES} amount_mismatch, {MISSING_FROM_FILE} missing_in_settlement, "
+                f"{UNKNOWN_IDS} missing_in_ours)",
+            )
+
+    @staticmethod
+    def describe(count, seconds, rss, size=None):
+        written = f", {size / 2 ** 20:.0f} MB out" if size is not None else ''
+        return f"{seconds:.1f} s, {count / seconds / 1000:.1f}k rows/s, peak RSS {rss:.0f} MB{written}"
+
+    @staticmethod
+    def export_endpoint():
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('bench-export', 'bench@example.com', 'bench'))
+        response = client.get('/api/finance/transactions/export/', {'export_format': 'csv'})
+        return sum(len(block) for block in response.streaming_content)
+
+    def write_settlement(self, path):
+        """The successful transactions in pk order, which is not id order, with the planted mismatches."""
+        successful = Transaction.objects.filter(status='successful').order_by('pk')
+        total = successful.count()
+        picked = self.rng.sample(range(total), AMOUNT_MISMATCHES + MISSING_FROM_FILE)
+        wrong_amount, missing = set(picked[:AMOUNT_MISMATCHES]), set(picked[AMOUNT_MISMATCHES:])
+        rows = successful.values_list('transaction_id_external', 'amount', 'currency__code').iterator(chunk_size=5000)
+        with open(path, 'w', newline='', encoding='utf-8') as settlement_file:
+            writer = csv.writer(settlement_file)
+            writer.writerow(['transaction_id', 'amount', 'currency'])
+            for index, (transaction_id, amount, currency) in enumerate(rows):
+                if index in missing:
+                    continue
+                writer.writerow([transaction_id, amount + 1 if index in wrong_amount else amount, currency])
+            for i in range(UNKNOWN_IDS):
+                writer.writerow([f'txn_unknown_{i}', '1.00', 'USD'])
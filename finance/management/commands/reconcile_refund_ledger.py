@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from finance import ledger
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every transaction's refunded and pending-refund totals from its refund rows in "
+        "batches and reports the ones out of balance. Use --fix to write the recomputed values back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Transactions checked per batch.")
+        parser.add_argument('--fix', action='store_true', help="Rewrite the totals that are out of balance.")
+        parser.add_argument('--show', type=int, default=20, help="How many mismatched transactions to list.")
+
+    def handle(self, *args, **options):
+        checked, mismatches = ledger.reconcile(batch_size=options['batch_size'], fix=options['fix'])
+        for pk, (refunded, pending), (expected_refunded, expected_pending) in mismatches[:options['show']]:
+            self.stdout.write(
+                f"Transaction #{pk}: refunded {refunded} -> {expected_refunded}, pending {pending} -> {expected_pending}"
+            )
+
+        summary = f"Checked {checked} transactions, {len(mismatches)} out of balance."
+        if options['fix'] and mismatches:
+            summary += " Fixed."
+        self.stdout.write(self.style.WARNING(summary) if mismatches and not options['fix'] else self.style.SUCCESS(summary))
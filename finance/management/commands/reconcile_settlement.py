@@ -0,0 +1,62 @@
+import csv
+import sys
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from finance import settlement
+from finance.management.commands.export_transactions import parse_moment
+
+
+REPORT_FIELDS = [
+    'kind', 'transaction_id', 'our_amount', 'our_currency', 'our_status', 'our_processed_at',
+    'settled_amount', 'settled_currency',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Matches a gateway settlement CSV (transaction_id, amount, currency) against our transactions "
+        "with a sort-merge join in bounded memory, and writes each mismatch to a CSV report."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('settlement_file')
+        parser.add_argument('--output', '-o', help="Mismatch report file. Defaults to stdout.")
+        parser.add_argument('--since', type=parse_moment, help="Start of the period the file settles (processed_at).")
+        parser.add_argument('--until', type=parse_moment, help="End of the period the file settles (processed_at, exclusive).")
+        parser.add_argument('--presorted', action='store_true', help="The file is already in transaction_id order; skip the sort.")
+        parser.add_argument('--sort-buffer', type=int, default=settlement.DEFAULT_SORT_BUFFER, help="Settlement rows sorted in memory per run.")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Transactions fetched per round-trip.")
+
+    def handle(self, *args, **options):
+        rows = settlement.read_settlement(options['settlement_file'])
+        if not options['presorted']:
+            rows = settlement.sort_settlement(rows, options['sort_buffer'])
+
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        started = time.monotonic()
+        kinds = Counter()
+        try:
+            writer = csv.writer(out)
+            writer.writerow(REPORT_FIELDS)
+            for kind, transaction_id, ours, theirs in settlement.match(
+                rows, settlement.our_rows(options['chunk_size']), since=options['since'], until=options['until'],
+            ):
+                kinds[kind] += 1
+                ours = ours or (None,) * 5
+                theirs = theirs or (None,) * 3
+                writer.writerow([
+                    kind, transaction_id, ours[1], ours[2], ours[3], ours[4] and ours[4].isoformat(), theirs[1], theirs[2],
+                ])
+        except (OSError, settlement.SettlementError) as e:
+            raise CommandError(str(e))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+        elapsed = time.monotonic() - started
+        found = ', '.join(f"{kinds[kind]} {kind}" for kind in settlement.KINDS if kinds[kind])
+        summary = f"Reconciled in {elapsed:.1f}s: {found or 'no mismatches'}."
+        self.stderr.write(self.style.WARNING(summary) if kinds else self.style.SUCCESS(summary))
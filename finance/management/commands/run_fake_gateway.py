@@ -0,0 +1,31 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from finance.fake_gateway import FakeGatewayServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves a fake payment gateway for latency and throughput tests. Point "
+        "FINANCE_PAYMENT_GATEWAY at it with finance.gateway.HttpGatewayClient and base_url http://HOST:PORT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=100.0, help="Time taken by every answer.")
+        parser.add_argument('--jitter-ms', type=float, default=0.0, help="Extra random time, up to this much.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests answered with a 503 (0-1).")
+
+    def handle(self, *args, **options):
+        server = FakeGatewayServer(
+            host=options['host'], port=options['port'], latency=options['latency_ms'] / 1000,
+            jitter=options['jitter_ms'] / 1000, error_rate=options['error_rate'],
+        )
+        self.stdout.write(f"Fake payment gateway on http://{options['host']}:{options['port']} (Ctrl-C to stop).")
+        try:
+            asyncio.run(server.serve_forever())
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Served: {server.stats}")
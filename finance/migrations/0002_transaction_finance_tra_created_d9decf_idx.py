@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0001_initial'),
+        ('shop', '0006_order_shop_order_created_8cea34_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['created_at', 'id'], name='finance_tra_created_d9decf_idx'),
+        ),
+    ]
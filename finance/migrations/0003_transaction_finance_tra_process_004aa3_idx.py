@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_transaction_finance_tra_created_d9decf_idx'),
+        ('shop', '0008_shipment_shop_shipme_status_657621_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['processed_at'], name='finance_tra_process_004aa3_idx'),
+        ),
+    ]
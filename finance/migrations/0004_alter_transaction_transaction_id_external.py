@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:40
+
+from django.db import migrations, models
+
+
+def blank_ids_to_null(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+    Transaction.objects.filter(transaction_id_external='').update(transaction_id_external=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0003_transaction_finance_tra_process_004aa3_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='transaction_id_external',
+            field=models.CharField(blank=True, help_text='ID from the payment gateway, e.g., Stripe charge ID.', max_length=100, null=True, unique=True),
+        ),
+        migrations.RunPython(blank_ids_to_null, migrations.RunPython.noop),
+    ]
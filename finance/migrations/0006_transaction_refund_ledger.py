@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:48
+
+from django.db import migrations, models
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_refund_totals(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+
+    def refunds(statuses):
+        total = (
+            Transaction.objects.filter(parent_transaction=OuterRef('pk'), transaction_type='refund', status__in=statuses)
+            .order_by().values('parent_transaction').annotate(total=Sum('amount')).values('total')
+        )
+        return Coalesce(Subquery(total), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2))
+
+    parents = Transaction.objects.filter(child_transactions__transaction_type='refund').values('pk')
+    Transaction.objects.filter(pk__in=parents).update(
+        refunded_amount=refunds(['successful']),
+        refund_pending_amount=refunds(['pending', 'requires_action']),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0005_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='refund_pending_amount',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Sum of the refunds awaiting the gateway.', max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='refunded_amount',
+            field=models.DecimalField(decimal_places=2, default=0, help_text='Sum of the successful refunds.', max_digits=10),
+        ),
+        migrations.RunPython(fill_refund_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def prepare_currencies(apps, schema_editor):
+    Currency = apps.get_model('finance', 'Currency')
+    ExchangeRate = apps.get_model('finance', 'ExchangeRate')
+    # Keep the most recently updated default before the constraint allows only one.
+    defaults = list(Currency.objects.filter(is_default=True).order_by('-updated_at', '-pk').values_list('pk', flat=True))
+    Currency.objects.filter(pk__in=defaults[1:]).update(is_default=False)
+    # Current rates are the oldest known; they apply from the currency's creation.
+    ExchangeRate.objects.bulk_create([
+        ExchangeRate(currency_id=pk, rate=rate, valid_from=created_at)
+        for pk, rate, created_at in Currency.objects.values_list('pk', 'exchange_rate', 'created_at')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0006_transaction_refund_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rate', models.DecimalField(decimal_places=4, max_digits=10)),
+                ('valid_from', models.DateTimeField()),
+            ],
+            options={
+                'ordering': ['currency', 'valid_from'],
+            },
+        ),
+        migrations.AddField(
+            model_name='exchangerate',
+            name='currency',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rate_history', to='finance.currency'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangerate',
+            index=models.Index(fields=['currency', 'valid_from'], name='finance_exc_currenc_ed9c21_idx'),
+        ),
+        migrations.RunPython(prepare_currencies, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='currency',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_default', True)), fields=('is_default',), name='unique_default_currency'),
+        ),
+    ]
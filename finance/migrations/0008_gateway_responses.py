@@ -0,0 +1,83 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:43
+
+import ast
+import json
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def parse_raw(raw):
+    # Stored as str(gateway_response), a Python repr; anything else is kept as text.
+    for parse in (ast.literal_eval, json.loads):
+        try:
+            payload = parse(raw)
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            continue
+        try:
+            json.dumps(payload, cls=django.core.serializers.json.DjangoJSONEncoder)
+        except (TypeError, ValueError):
+            continue
+        return payload
+    return {'raw': raw}
+
+
+def move_gateway_responses(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+    GatewayResponse = apps.get_model('finance', 'GatewayResponse')
+    rows = (
+        Transaction.objects.exclude(gateway_response_raw__isnull=True).exclude(gateway_response_raw='')
+        .order_by('pk').values_list('pk', 'gateway_response_raw', 'processed_at', 'created_at')
+    )
+    last_pk = 0
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        GatewayResponse.objects.bulk_create([
+            GatewayResponse(transaction_id=pk, payload=parse_raw(raw), received_at=processed_at or created_at)
+            for pk, raw, processed_at, created_at in batch
+        ])
+
+
+def restore_gateway_responses(apps, schema_editor):
+    Transaction = apps.get_model('finance', 'Transaction')
+    GatewayResponse = apps.get_model('finance', 'GatewayResponse')
+    last_pk = 0
+    while True:
+        batch = list(GatewayResponse.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'payload')[:BATCH_SIZE])
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        for pk, payload in batch:
+            Transaction.objects.filter(pk=pk).update(
+                gateway_response_raw=json.dumps(payload, cls=django.core.serializers.json.DjangoJSONEncoder),
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0007_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GatewayResponse',
+            fields=[
+                ('transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='gateway_response', serialize=False, to='finance.transaction')),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('received_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(move_gateway_responses, restore_gateway_responses),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='gateway_response_raw',
+        ),
+    ]
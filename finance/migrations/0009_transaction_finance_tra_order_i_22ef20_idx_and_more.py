@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0008_gateway_responses'),
+        ('shop', '0010_order_shop_order_status_03f99d_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['order', 'status'], name='finance_tra_order_i_22ef20_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['parent_transaction', 'transaction_type', 'status'], name='finance_tra_parent__784911_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction as django_db_transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import User
 # To link Transactions to Orders in the 'shop' app
 # from shop.models import Order 
@@ -17,16 +18,39 @@ class Currency(models.Model):
     class Meta:
         verbose_name_plural = "Currencies"
         ordering = ['name']
+        constraints = [
+            # At most one default; also indexes the lookup of the current default below.
+            models.UniqueConstraint(fields=['is_default'], condition=models.Q(is_default=True), name='unique_default_currency'),
+        ]
 
     def save(self, *args, **kwargs):
-        if self.is_default:
-            # Ensure only one currency is default
+        update_fields = kwargs.get('update_fields')
+        if not self.is_default or (update_fields is not None and 'is_default' not in update_fields):
+            super().save(*args, **kwargs)
+            return
+        with django_db_transaction.atomic():
+            # Ensure only one currency is default: touches the previous default's row, if any
             Currency.objects.filter(is_default=True).exclude(pk=self.pk).update(is_default=False)
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} ({self.code})"
 
+class ExchangeRate(models.Model):
+    """A currency's exchange rate from `valid_from` on, recorded whenever it changes (finance/rates.py)."""
+    currency = models.ForeignKey(Currency, related_name='rate_history', on_delete=models.CASCADE)
+    rate = models.DecimalField(max_digits=10, decimal_places=4)
+    valid_from = models.DateTimeField()
+
+    class Meta:
+        ordering = ['currency', 'valid_from']
+        indexes = [
+            models.Index(fields=['currency', 'valid_from']),
+        ]
+
+    def __str__(self):
+        return f"{self.rate} for currency #{self.currency_id} from {self.valid_from}"
+
 class Transaction(models.Model):
     TRANSACTION_TYPE_CHOICES = [
         ('payment', 'Payment'),
@@ -46,7 +70,8 @@ class Transaction(models.Model):
     order = models.ForeignKey('shop.Order', related_name='transactions', on_delete=models.SET_NULL, null=True, blank=True)
     user = models.ForeignKey(User, related_name='transactions', on_delete=models.SET_NULL, null=True, blank=True) # User who initiated or is associated with transaction
     
-    transaction_id_external = models.CharField(max_length=100, unique=True, help_text="ID from the payment gateway, e.g., Stripe charge ID.")
+    # NULL until the gateway answers: unique would otherwise allow only one pending transaction at a time.
+    transaction_id_external = models.CharField(max_length=100, unique=True, null=True, blank=True, help_text="ID from the payment gateway, e.g., Stripe charge ID.")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.ForeignKey(Currency, related_name='transactions', on_delete=models.PROTECT) # Protect currency from deletion if used in transactions
     
@@ -54,7 +79,7 @@ class Transaction(models.Model):
     status = models.CharField(max_length=20, choices=TRANSACTION_STATUS_CHOICES, default='pending')
     
     payment_method_details = models.CharField(max_length=255, blank=True, null=True, help_text="e.g., 'Visa ending in 1234'")
-    gateway_response_raw = models.TextField(blank=True, null=True, help_text="Raw response from the payment gateway for debugging.")
+    # The gateway's raw answer lives in GatewayResponse, off the rows that get listed and filtered.
     notes = models.TextField(blank=True, null=True, help_text="Internal notes about the transaction.")
 
     created_at = models.DateTimeField(auto_now_add=True) # When the transaction record was created in our system
@@ -62,14 +87,92 @@ class Transaction(models.Model):
 
     parent_transaction = models.ForeignKey('self', null=True, blank=True, related_name='child_transactions', on_delete=models.SET_NULL, help_text="For linking refunds/captures to original payments/authorizations.")
 
+    # Running totals of the refunds against this transaction, kept by finance/ledger.py.
+    refunded_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Sum of the successful refunds.")
+    refund_pending_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Sum of the refunds awaiting the gateway.")
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']), # keyset pagination (core.pagination)
+            models.Index(fields=['processed_at']), # daily sales rollup rebuilds (dashboard.rollups)
+            models.Index(fields=['order', 'status']), # an order's payments by status
+            models.Index(fields=['parent_transaction', 'transaction_type', 'status']), # refunds of a transaction (finance.ledger)
+        ]
 
     def __str__(self):
         return f"Transaction {self.transaction_id_external} for Order {self.order.order_number if self.order else 'N/A'} - {self.amount} {self.currency.code} ({self.status})"
 
+    @property
+    def refundable_amount(self):
+        return self.amount - self.refunded_amount - self.refund_pending_amount
+
+    # What the pre_save receivers compare against: the refund ledger (finance/signals.py) and
+    # the sales rollups (dashboard/signals.py).
+    STORED_ROW_FIELDS = ('transaction_type', 'parent_transaction', 'status', 'amount', 'currency', 'processed_at', 'created_at', 'order')
+
     def save(self, *args, **kwargs):
+        self.__dict__.pop('_stored_row', None) # loaded again, once, by stored_row() for this save
         if self.status in ['successful', 'failed', 'cancelled'] and not self.processed_at:
             from django.utils import timezone
             self.processed_at = timezone.now()
         super().save(*args, **kwargs)
+
+    def stored_row(self):
+        """The row as stored before the save in progress (None for a new one), read once per save."""
+        if '_stored_row' not in self.__dict__:
+            self._stored_row = None if self._state.adding else (
+                Transaction.objects.filter(pk=self.pk).only(*self.STORED_ROW_FIELDS).first()
+            )
+        return self._stored_row
+
+    def record_gateway_response(self, payload):
+        """Stores (or replaces) the gateway's raw answer for this transaction."""
+        from django.utils import timezone
+        GatewayResponse.objects.update_or_create(transaction=self, defaults={'payload': payload, 'received_at': timezone.now()})
+
+
+class GatewayResponse(models.Model):
+    """
+    Raw answer of the payment gateway for a transaction, kept for debugging and disputes.
+    A table of its own, so listing and filtering transactions never reads these payloads;
+    they are fetched one at a time (transactions/<pk>/gateway-response/) or joined in exports.
+    """
+    transaction = models.OneToOneField(Transaction, primary_key=True, related_name='gateway_response', on_delete=models.CASCADE)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    received_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Gateway response for transaction #{self.transaction_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client's Idempotency-Key and the answer it got (finance/idempotency.py). A retry with
+    the same key and request replays the stored answer; one arriving while the first is
+    still running finds the row locked.
+    """
+    KEY_STATUS_CHOICES = [
+        ('in_progress', 'In Progress'), # Request running, locked until locked_until
+        ('completed', 'Completed'), # Answer stored, replayed until expires_at
+    ]
+    user = models.ForeignKey(User, related_name='idempotency_keys', on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64, help_text="SHA-256 of the method, path and body of the first request.")
+    status = models.CharField(max_length=20, choices=KEY_STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']), # purge_expired() sweep
+        ]
+
+    def __str__(self):
+        return f"Idempotency key {self.key} of user #{self.user_id} ({self.status})"
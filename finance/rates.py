@@ -0,0 +1,175 @@
+"""
+Currency conversion from in-process rate tables.
+
+Currency.exchange_rate is units of the currency per unit of the base currency, so an amount
+converts from A to B as amount * rate_B / rate_A. The division runs with PRECISION significant
+digits and the result is rounded once, to the cent (ROUND_HALF_EVEN, like Decimal.quantize
+elsewhere), so converting one amount or a whole batch gives the same figures.
+
+get_rates() returns the current rates as an immutable RateTable: one query, then kept by the
+process until a Currency is saved (finance/signals.py) or FINANCE_RATE_TABLE_TTL seconds pass,
+which bounds how long a write in another process goes unseen. Each rate change is also recorded as an
+ExchangeRate; get_history() loads them into a RateHistory that gives the table in effect at
+any moment, so reports convert each day's sums at that day's rates in one pass.
+"""
+import bisect
+import decimal
+import threading
+import time
+from datetime import datetime, time as datetime_time
+from decimal import Decimal
+from types import MappingProxyType
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Currency, ExchangeRate
+
+
+CENT = Decimal('0.01')
+PRECISION = 34
+DEFAULT_RATE_TABLE_TTL = 60 # seconds
+
+
+class UnknownCurrency(Exception):
+    """Raised for a currency (id or code) the rate table doesn't know."""
+
+
+def _context():
+    return decimal.Context(prec=PRECISION, rounding=decimal.ROUND_HALF_EVEN)
+
+
+class RateTable:
+    """Exchange rates at one moment, by currency id. Immutable, so it can be shared freely."""
+    __slots__ = ('rates', 'ids', 'default_id')
+
+    def __init__(self, rates, codes, default_id=None):
+        # rates {currency id: rate}, codes {currency id: code}
+        object.__setattr__(self, 'rates', MappingProxyType(dict(rates)))
+        object.__setattr__(self, 'ids', MappingProxyType({code: pk for pk, code in codes.items()}))
+        object.__setattr__(self, 'default_id', default_id)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RateTable is immutable.")
+
+    def currency_id(self, currency):
+        """Id of a currency given as id, code or Currency; None means the default currency."""
+        pk = currency
+        if currency is None:
+            pk = self.default_id
+        elif isinstance(currency, Currency):
+            pk = currency.pk
+        elif isinstance(currency, str):
+            pk = self.ids.get(currency.upper())
+        if pk not in self.rates:
+            raise UnknownCurrency(f"No exchange rate for currency {currency if currency is not None else 'default'!r}.")
+        return pk
+
+    def rate(self, currency):
+        return self.rates[self.currency_id(currency)]
+
+    def convert(self, amount, from_currency, to_currency=None):
+        return self.convert_many([amount], [from_currency], to_currency)[0]
+
+    def convert_many(self, amounts, currencies, to_currency=None):
+        """
+        Converts amounts[i] from currencies[i] (or from `currencies` itself, if it is a single
+        currency) into `to_currency`, default currency if None. Each currency is looked up once
+        per call, however many amounts are in it.
+        """
+        to_rate = self.rate(to_currency)
+        if currencies is None or isinstance(currencies, (int, str, Currency)):
+            currencies = [currencies] * len(amounts)
+        from_rates = {}
+        context = _context()
+        converted = []
+        for amount, currency in zip(amounts, currencies):
+            from_rate = from_rates.get(currency)
+            if from_rate is None:
+                from_rate = from_rates[currency] = self.rate(currency)
+            value = context.divide(context.multiply(Decimal(amount), to_rate), from_rate)
+            converted.append(value.quantize(CENT, context=context))
+        return converted
+
+    def convert_totals(self, totals, to_currency=None):
+        """Sum of {currency: amount} in `to_currency`: one conversion per currency, rounded before adding."""
+        currencies = list(totals)
+        return sum(self.convert_many([totals[c] for c in currencies], currencies, to_currency), Decimal('0.00'))
+
+
+class RateHistory:
+    """Every recorded rate of each currency; tables for any moment are built from it on demand."""
+
+    def __init__(self, history, codes, default_id=None):
+        # history {currency id: [(valid_from, rate), ...] in valid_from order}
+        self.history = {pk: ([since for since, _ in rates], [rate for _, rate in rates]) for pk, rates in history.items()}
+        self.codes = codes
+        self.default_id = default_id
+        self._tables = {}
+
+    def table_at(self, moment):
+        """The rates in effect at `moment`. Before a currency's first recorded rate, that rate is used."""
+        table = self._tables.get(moment)
+        if table is None:
+            rates = {}
+            for pk, (since, values) in self.history.items():
+                rates[pk] = values[max(bisect.bisect_right(since, moment) - 1, 0)]
+            table = self._tables[moment] = RateTable(rates, self.codes, self.default_id)
+        return table
+
+    def table_for_day(self, day):
+        """The rates at the close of `day` (local time)."""
+        return self.table_at(timezone.make_aware(datetime.combine(day, datetime_time.max)))
+
+
+_rates = None
+_rates_loaded_at = 0.0
+_rates_lock = threading.Lock()
+
+
+def get_rate_table_ttl():
+    return getattr(settings, 'FINANCE_RATE_TABLE_TTL', DEFAULT_RATE_TABLE_TTL)
+
+
+def _load_currencies():
+    codes, default_id, rates = {}, None, {}
+    for pk, code, rate, is_default in Currency.objects.values_list('pk', 'code', 'exchange_rate', 'is_default'):
+        codes[pk] = code
+        rates[pk] = rate
+        if is_default:
+            default_id = pk
+    return codes, default_id, rates
+
+
+def get_rates():
+    """The current RateTable, reloaded (one query) when invalidated or older than the TTL."""
+    global _rates, _rates_loaded_at
+    with _rates_lock:
+        if _rates is None or time.monotonic() - _rates_loaded_at >= get_rate_table_ttl():
+            codes, default_id, rates = _load_currencies()
+            _rates = RateTable(rates, codes, default_id)
+            _rates_loaded_at = time.monotonic()
+        return _rates
+
+
+def invalidate():
+    """Drops this process's rate table; the next get_rates() reloads it."""
+    global _rates
+    with _rates_lock:
+        _rates = None
+
+
+def get_history():
+    """All recorded rates as a RateHistory (two queries). Currencies with no record use their current rate."""
+    codes, default_id, current = _load_currencies()
+    history = {}
+    for currency_id, valid_from, rate in ExchangeRate.objects.order_by('currency_id', 'valid_from', 'pk').values_list('currency_id', 'valid_from', 'rate'):
+        history.setdefault(currency_id, []).append((valid_from, rate))
+    for pk, rate in current.items():
+        history.setdefault(pk, [(timezone.now(), rate)])
+    return RateHistory(history, codes, default_id)
+
+
+def record_rate(currency, valid_from=None):
+    """Records the currency's current rate as in effect from `valid_from` (now)."""
+    return ExchangeRate.objects.create(currency=currency, rate=currency.exchange_rate, valid_from=valid_from or timezone.now())
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Currency, Transaction
+from .models import Currency, GatewayResponse, Transaction
 # To link to Order from shop app
 from shop.models import Order 
 from shop.serializers import OrderSerializer # Potentially for read-only representation
@@ -20,16 +20,18 @@ class TransactionSerializer(serializers.ModelSerializer):
     
     # For creating transactions, allow specifying currency by its code
     currency_id = serializers.PrimaryKeyRelatedField(queryset=Currency.objects.filter(is_active=True), source='currency', write_only=True)
+    refundable_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
 
     class Meta:
         model = Transaction
         fields = [
             'id', 'order_id', 'order_number', 'user', 'transaction_id_external', 'amount', 
             'currency_id', 'currency_code', 'transaction_type', 'status', 
-            'payment_method_details', 'gateway_response_raw', 'notes', 
-            'parent_transaction', 'created_at', 'processed_at'
+            'payment_method_details', 'notes', 
+            'parent_transaction', 'refunded_amount', 'refund_pending_amount', 'refundable_amount',
+            'created_at', 'processed_at'
         ]
-        read_only_fields = ('transaction_id_external', 'gateway_response_raw', 'created_at', 'processed_at', 'order_number', 'currency_code')
+        read_only_fields = ('transaction_id_external', 'created_at', 'processed_at', 'order_number', 'currency_code', 'refunded_amount', 'refund_pending_amount')
         # transaction_id_external is usually provided by the payment gateway after processing.
         # status is also often updated based on gateway response.
 
@@ -63,11 +65,26 @@ class TransactionCreateSerializer(serializers.ModelSerializer):
 
 class TransactionUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating transaction status, e.g., after gateway callback."""
+    gateway_response = serializers.JSONField(write_only=True, required=False) # Stored in GatewayResponse, not on the row
+
     class Meta:
         model = Transaction
         fields = [
             'status', 'transaction_id_external', # Gateway might provide this after initial attempt
-            'gateway_response_raw', 'notes', 'processed_at'
+            'gateway_response', 'notes', 'processed_at'
         ]
         # Most fields are updated by the system/gateway callback, not directly by admin unless for manual correction.
         read_only_fields = ['processed_at'] # processed_at is set automatically based on status in model's save method
+
+    def update(self, instance, validated_data):
+        gateway_response = validated_data.pop('gateway_response', None)
+        instance = super().update(instance, validated_data)
+        if gateway_response is not None:
+            instance.record_gateway_response(gateway_response)
+        return instance
+
+
+class GatewayResponseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GatewayResponse
+        fields = ['transaction', 'payload', 'received_at']
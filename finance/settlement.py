@@ -0,0 +1,153 @@
+"""
+Matching a gateway settlement file against our transactions in bounded memory.
+
+The settlement file is a CSV with transaction_id, amount and currency columns (one row per
+settled payment or refund). Both sides are put in transaction id order, then walked once
+side by side (a sort-merge join):
+
+- the file is sorted externally: runs of `sort_buffer` rows are sorted in memory and spilled to
+  temporary files, then heapq.merge reads them back together (skipped with presorted=True);
+- our rows come from one query ordered by transaction_id_external under a binary collation,
+  so the database orders ids exactly as Python compares them, read with .iterator(chunk_size).
+
+Memory is bounded by sort_buffer plus one row per run, whatever the size of either side.
+match() yields each discrepancy as (kind, transaction id, ours, theirs); see KINDS.
+"""
+import csv
+import heapq
+import itertools
+import tempfile
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models.functions import Collate
+
+from .models import Transaction
+
+
+KINDS = {
+    'missing_in_ours': "Settled by the gateway, no transaction with that id here.",
+    'missing_in_settlement': "Successful here, in the settlement window, but not in the file.",
+    'duplicate_in_settlement': "The id appears more than once in the file.",
+    'amount_mismatch': "Amounts differ.",
+    'currency_mismatch': "Currencies differ.",
+    'status_mismatch': "Settled by the gateway, but not successful here.",
+}
+
+# Collations that order strings by code point, like Python's str comparison.
+BINARY_COLLATIONS = {'sqlite': 'BINARY', 'postgresql': 'C', 'mysql': 'utf8mb4_bin', 'oracle': 'BINARY'}
+
+DEFAULT_SORT_BUFFER = 200000
+
+
+class SettlementError(Exception):
+    """Raised for an unreadable settlement file or rows that are not in transaction id order."""
+
+
+def read_settlement(path):
+    """(transaction id, amount, currency) for each row of a settlement CSV, in file order."""
+    with open(path, newline='', encoding='utf-8') as settlement_file:
+        reader = csv.DictReader(settlement_file)
+        missing = {'transaction_id', 'amount', 'currency'} - set(reader.fieldnames or ())
+        if missing:
+            raise SettlementError(f"Settlement file lacks columns: {', '.join(sorted(missing))}.")
+        for row in reader:
+            try:
+                amount = Decimal(row['amount'])
+            except InvalidOperation:
+                raise SettlementError(f"Line {reader.line_num}: not an amount: {row['amount']!r}.")
+            yield row['transaction_id'].strip(), amount, row['currency'].strip().upper()
+
+
+def _spill(run):
+    run.sort(key=lambda row: row[0])
+    spill = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+    csv.writer(spill).writerows(run)
+    spill.seek(0)
+    return spill
+
+
+def _read_run(spill):
+    for transaction_id, amount, currency in csv.reader(spill):
+        yield transaction_id, Decimal(amount), currency
+
+
+def sort_settlement(rows, sort_buffer=DEFAULT_SORT_BUFFER):
+    """The rows in transaction id order, holding at most `sort_buffer` of them in memory."""
+    spills = []
+    try:
+        rows = iter(rows)
+        while True:
+            run = list(itertools.islice(rows, sort_buffer))
+            if not run:
+                break
+            spills.append(_spill(run))
+        yield from heapq.merge(*(_read_run(spill) for spill in spills), key=lambda row: row[0])
+    finally:
+        for spill in spills:
+            spill.close()
+
+
+def in_order(rows, side):
+    """Passes rows through, raising SettlementError as soon as one is out of id order."""
+    previous = None
+    for row in rows:
+        if previous is not None and row[0] < previous:
+            raise SettlementError(f"{side} rows are not in transaction id order: {row[0]!r} after {previous!r}.")
+        previous = row[0]
+        yield row
+
+
+def our_rows(chunk_size=2000):
+    """(transaction id, amount, currency, status, processed_at) of our transactions with a gateway id, in id order."""
+    transaction_id = 'transaction_id_external'
+    collation = BINARY_COLLATIONS.get(connection.vendor)
+    if collation:
+        transaction_id = Collate('transaction_id_external', collation)
+    return (
+        Transaction.objects.filter(transaction_id_external__isnull=False)
+        .annotate(sort_key=transaction_id).order_by('sort_key')
+        .values_list('transaction_id_external', 'amount', 'currency__code', 'status', 'processed_at')
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def match(settlement, ours, since=None, until=None):
+    """
+    Merge-joins settlement rows (transaction id, amount, currency) with our rows (transaction id,
+    amount, currency, status, processed_at), both in transaction id order, and yields each
+    discrepancy as (kind, transaction id, our row or None, settlement row or None).
+    Our successful transactions missing from the file are only reported when processed in
+    [since, until), the period the file covers.
+    """
+    settlement = in_order(settlement, 'Settlement')
+    ours = in_order(ours, 'Our')
+    theirs = next(settlement, None)
+    mine = next(ours, None)
+    last_settled = None
+    while theirs is not None or mine is not None:
+        if theirs is not None and theirs[0] == last_settled:
+            yield 'duplicate_in_settlement', theirs[0], None, theirs
+            theirs = next(settlement, None)
+        elif mine is None or (theirs is not None and theirs[0] < mine[0]):
+            yield 'missing_in_ours', theirs[0], None, theirs
+            last_settled = theirs[0]
+            theirs = next(settlement, None)
+        elif theirs is None or mine[0] < theirs[0]:
+            processed_at = mine[4]
+            if (
+                mine[3] == 'successful' and processed_at is not None
+                and (since is None or processed_at >= since) and (until is None or processed_at < until)
+            ):
+                yield 'missing_in_settlement', mine[0], mine, None
+            mine = next(ours, None)
+        else:
+            if mine[3] != 'successful':
+                yield 'status_mismatch', mine[0], mine, theirs
+            if mine[1] != theirs[1]:
+                yield 'amount_mismatch', mine[0], mine, theirs
+            if mine[2] != theirs[2]:
+                yield 'currency_mismatch', mine[0], mine, theirs
+            last_settled = theirs[0]
+            theirs = next(settlement, None)
+            mine = next(ours, None)
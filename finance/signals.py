@@ -0,0 +1,51 @@
+from django.db import transaction as django_db_transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import ledger, rates
+from .models import Currency, Transaction
+
+
+# Rate tables (see finance/rates.py). Dropped now and again on commit, so a table reloaded by
+# another thread before the commit isn't kept; rate changes are recorded for the history.
+# Writes through queryset.update() skip these.
+@receiver(pre_save, sender=Currency)
+def remember_exchange_rate(sender, instance, raw=False, **kwargs):
+    instance._previous_rate = None
+    if not raw and not instance._state.adding:
+        instance._previous_rate = Currency.objects.filter(pk=instance.pk).values_list('exchange_rate', flat=True).first()
+
+@receiver(post_save, sender=Currency)
+def record_exchange_rate(sender, instance, created, raw=False, **kwargs):
+    rates.invalidate()
+    django_db_transaction.on_commit(rates.invalidate)
+    if not raw and (created or instance.exchange_rate != getattr(instance, '_previous_rate', None)):
+        rates.record_rate(instance, valid_from=instance.updated_at)
+
+@receiver(post_delete, sender=Currency)
+def invalidate_rates(sender, instance, **kwargs):
+    rates.invalidate()
+    django_db_transaction.on_commit(rates.invalidate)
+
+
+# Refund ledger (see finance/ledger.py). pre_save remembers what the refund added to its
+# parent's totals, so post_save can move the difference; saves that can't change it are skipped.
+LEDGER_FIELDS = {'transaction_type', 'parent_transaction', 'parent_transaction_id', 'status', 'amount'}
+
+@receiver(pre_save, sender=Transaction)
+def remember_refund_ledger(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._ledger_skip = raw or (update_fields is not None and not LEDGER_FIELDS & set(update_fields))
+    instance._ledger_previous = None
+    if not instance._ledger_skip and not instance._state.adding:
+        instance._ledger_previous = ledger.snapshot(instance.stored_row())
+
+@receiver(post_save, sender=Transaction)
+def update_refund_ledger(sender, instance, **kwargs):
+    if not getattr(instance, '_ledger_skip', True):
+        ledger.apply(instance._ledger_previous, ledger.snapshot(instance))
+
+@receiver(pre_delete, sender=Transaction)
+def update_ledger_for_deleted_refund(sender, instance, **kwargs):
+    # From the stored row, which a stale instance may not match; runs in the delete's transaction.
+    stored = Transaction.objects.filter(pk=instance.pk).only(*ledger.SNAPSHOT_FIELDS).first()
+    ledger.apply(ledger.snapshot(stored), None)
@@ -1,3 +1,724 @@
-from django.test import TestCase
+import asyncio
+import contextlib
+import csv
+import json
+import os
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.query_count import QueryBudgetMixin
+from core.query_plans import HotPath, QueryPlanMixin
+from core.sample_data import create_sample_rows
+
+from . import exports, idempotency, rates, settlement
+from .fake_gateway import FakeGatewayServer
+from .gateway import CircuitBreaker, GatewayError, GatewayUnavailable, HttpGatewayClient, reset_gateway
+from .ledger import expected_totals
+from .models import Currency, ExchangeRate, GatewayResponse, IdempotencyKey, Transaction
+from .views import RefundTransactionView
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    router_module = 'finance.urls'
+    budgets = {
+        'transaction-list': 3,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    def test_order_payments_by_status(self):
+        self.assertIndexSeeks(HotPath(
+            "An order's payments by status", ['finance_transaction'], view='finance.views.TransactionViewSet',
+            params={'order__order_number': 'ORD-0', 'status': 'successful'},
+        ))
+
+    def test_refund_totals(self):
+        self.assertIndexSeeks(HotPath('Refund totals of transactions', ['finance_transaction'], call=lambda: expected_totals([1, 2, 3])))
+
+
+class SettlementTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+        cls.payment = Transaction.objects.filter(transaction_type='payment').first()
+
+    def pending_refund(self):
+        return Transaction.objects.create(
+            order=self.payment.order, user=self.user, amount=Decimal('5.00'), currency=self.payment.currency,
+            transaction_type='refund', status='pending', parent_transaction=self.payment,
+        )
+
+    def finish_refund(self, refund_tx, gateway_response):
+        view = RefundTransactionView()
+        view.request = SimpleNamespace(user=self.user)
+        return view.finish_refund(self.payment, refund_tx, gateway_response)
+
+    def test_refund_settled_by_callback_is_not_settled_again(self):
+        refund_tx = self.pending_refund()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.post(f'/api/finance/transactions/{refund_tx.pk}/fail-payment/').status_code, 200)
+
+        # The refund view still holds the instance it created, from before the callback.
+        response = self.finish_refund(refund_tx, {'success': True, 'refund_id': 'LATE-REFUND'})
+        self.assertEqual(response.status_code, 409)
+        refund_tx.refresh_from_db()
+        self.assertEqual(refund_tx.status, 'failed')
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.refunded_amount, self.payment.refund_pending_amount), (Decimal('5.00'), Decimal('0.00')))
+        self.assertEqual(client.post(f'/api/finance/transactions/{refund_tx.pk}/complete-payment/').status_code, 400)
+
+    def test_save_reads_stored_row_once(self):
+        refund_tx = self.pending_refund()
+        refund_tx.status = 'successful'
+        with CaptureQueriesContext(connection) as queries:
+            refund_tx.save()
+        reads = [q['sql'] for q in queries if q['sql'].startswith('SELECT') and 'finance_transaction' in q['sql']]
+        self.assertEqual(len(reads), 1, reads)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.refunded_amount, Decimal('10.00'))
+
+
+class CountingGateway(FakeGatewayServer):
+    """The fake gateway, answering the first `fail_first` requests with a 503 and counting overlapping requests."""
+
+    def __init__(self, fail_first=0, **kwargs):
+        super().__init__(host='127.0.0.1', port=0, **kwargs)
+        self.fail_first = fail_first
+        self.in_flight = self.peak_in_flight = 0
+
+    async def answer(self, path, headers, body):
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.fail_first:
+                self.fail_first -= 1
+                self.stats['requests'] += 1
+                return 503, {'error': 'Gateway temporarily unavailable.'}
+            return await super().answer(path, headers, body)
+        finally:
+            self.in_flight -= 1
+
+
+def client_for(server, **options):
+    options = {'timeout': 1.0, 'retries': 0, 'backoff': 0.001, **options}
+    return HttpGatewayClient(f'http://127.0.0.1:{server.port}', **options)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        clock = mock.patch('finance.gateway.time')
+        self.now = clock.start().monotonic
+        self.now.return_value = 1000.0
+        self.addCleanup(clock.stop)
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30.0)
+
+    def trip(self):
+        for _ in range(3):
+            self.breaker.before_call()
+            self.breaker.record_failure()
+
+    def test_opens_after_consecutive_failures_only(self):
+        for _ in range(2):
+            self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual((self.breaker.state, self.breaker.failures), ('closed', 1))
+        self.breaker.record_success()
+        self.trip()
+        self.assertEqual(self.breaker.state, 'open')
+        with self.assertRaises(GatewayUnavailable):
+            self.breaker.before_call()
+
+    def test_half_open_lets_one_trial_through(self):
+        self.trip()
+        self.now.return_value += 30
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.breaker.before_call()
+        with self.assertRaises(GatewayUnavailable):
+            self.breaker.before_call() # while the trial runs
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.before_call()
+
+    def test_failed_trial_opens_again(self):
+        self.trip()
+        self.now.return_value += 30
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, 'open')
+        self.now.return_value += 29
+        with self.assertRaises(GatewayUnavailable):
+            self.breaker.before_call()
+
+    def test_abandoned_trial_stops_blocking(self):
+        self.trip()
+        self.now.return_value += 30
+        self.breaker.before_call() # never reports back
+        self.now.return_value += 30
+        self.breaker.before_call()
+
+
+class HttpGatewayClientTests(SimpleTestCase):
+    """HttpGatewayClient against FakeGatewayServer on a free port."""
+
+    @contextlib.asynccontextmanager
+    async def serve(self, **options):
+        # Started and stopped on the test's own event loop.
+        server = await CountingGateway(**options).start()
+        try:
+            yield server
+        finally:
+            await server.stop()
+
+    async def test_payment_and_refund(self):
+        async with self.serve(latency=0) as server:
+            client = client_for(server)
+            payment = await client.process_payment(Decimal('12.50'), 'USD', 'card-ok')
+            self.assertTrue(payment['success'])
+            self.assertTrue(payment['transaction_id'].startswith('FAKE_GW_'))
+            declined = await client.process_payment(Decimal('12.50'), 'USD', 'card-fail')
+            self.assertEqual(declined, {'success': False, 'transaction_id': None, 'error': 'Payment declined by fake gateway.'})
+            refund = await client.process_refund(payment['transaction_id'], Decimal('2.50'), 'USD')
+            self.assertTrue(refund['success'])
+            self.assertEqual(server.stats['connections'], 1) # kept alive
+
+    async def test_retries_5xx_with_the_same_idempotency_key(self):
+        async with self.serve(latency=0, fail_first=2) as server:
+            answer = await client_for(server, retries=2).process_payment(Decimal('1.00'), 'USD', 'card-ok', idempotency_key='payment-1')
+            self.assertTrue(answer['success'])
+            self.assertEqual(server.stats['requests'], 3)
+            again = await client_for(server).process_payment(Decimal('1.00'), 'USD', 'card-ok', idempotency_key='payment-1')
+            self.assertEqual(again, answer)
+            self.assertEqual(server.stats['replayed'], 1)
+
+    async def test_gives_up_after_the_last_retry(self):
+        async with self.serve(latency=0, error_rate=1.0) as server:
+            client = client_for(server, retries=2)
+            with self.assertRaisesMessage(GatewayError, 'after 3 attempts'):
+                await client.process_payment(Decimal('1.00'), 'USD', 'card-ok')
+            self.assertEqual(server.stats['requests'], 3)
+            self.assertEqual(client.breaker.failures, 1)
+
+    async def test_each_attempt_times_out(self):
+        async with self.serve(latency=0.3) as server:
+            client = client_for(server, timeout=0.05, retries=1)
+            with self.assertRaisesMessage(GatewayError, 'TimeoutError'):
+                await client.process_payment(Decimal('1.00'), 'USD', 'card-ok')
+            await asyncio.sleep(0.01)
+            # The timed-out connection was mid-exchange, so the retry opened a new one.
+            self.assertEqual(server.stats['connections'], 2)
+
+    async def test_breaker_trips_and_recovers(self):
+        async with self.serve(latency=0, error_rate=1.0) as server:
+            client = client_for(server, failure_threshold=2, reset_timeout=0.1)
+            for _ in range(2):
+                with self.assertRaises(GatewayError):
+                    await client.process_payment(Decimal('1.00'), 'USD', 'card-ok')
+            self.assertEqual(client.breaker.state, 'open')
+            with self.assertRaises(GatewayUnavailable):
+                await client.process_payment(Decimal('1.00'), 'USD', 'card-ok')
+            self.assertEqual(server.stats['requests'], 2) # not sent
+
+            await asyncio.sleep(0.1)
+            self.assertEqual(client.breaker.state, 'half-open')
+            server.error_rate = 0.0
+            self.assertTrue((await client.process_payment(Decimal('1.00'), 'USD', 'card-ok'))['success'])
+            self.assertEqual(client.breaker.state, 'closed')
+
+    async def test_pool_limits_concurrent_connections(self):
+        async with self.serve(latency=0.05) as server:
+            client = client_for(server, max_connections=3)
+            answers = await asyncio.gather(*(client.process_payment(Decimal('1.00'), 'USD', 'card-ok') for _ in range(12)))
+            self.assertTrue(all(answer['success'] for answer in answers))
+            self.assertEqual(server.peak_in_flight, 3)
+            self.assertEqual(server.stats['connections'], 3)
+
+
+class GatewayThread:
+    """Runs a CountingGateway on its own event loop in a thread, for views called by the sync test client."""
+
+    def __init__(self, **options):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(CountingGateway(**options).start(), self.loop).result()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class ProcessOrderPaymentTests(TestCase):
+    """The async dispatch of GatewayAPIView, with HttpGatewayClient calling the fake gateway."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+        cls.currency = Currency.objects.get(code='USD')
+        cls.order = Transaction.objects.filter(transaction_type='payment').first().order
+        Transaction.objects.filter(order=cls.order).delete()
+
+    def setUp(self):
+        self.gateway = GatewayThread(latency=0)
+        self.addCleanup(self.gateway.stop)
+        settings = override_settings(FINANCE_PAYMENT_GATEWAY={
+            'BACKEND': 'finance.gateway.HttpGatewayClient',
+            'OPTIONS': {'base_url': f'http://127.0.0.1:{self.gateway.server.port}', 'timeout': 1.0, 'retries': 0, 'failure_threshold': 1},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, details='card-ok'):
+        return self.client.post('/api/finance/transactions/process-order-payment/', {
+            'order_id': self.order.pk, 'amount': '30.00', 'currency_id': self.currency.pk,
+            'transaction_type': 'payment', 'payment_method_details': details,
+        }, format='json')
+
+    def test_paid(self):
+        response = self.pay()
+        self.assertEqual(response.status_code, 200, response.content)
+        transaction = Transaction.objects.get(order=self.order)
+        self.assertEqual(transaction.status, 'successful')
+        self.assertTrue(transaction.transaction_id_external.startswith('FAKE_GW_'))
+        self.assertEqual(self.gateway.server.stats['requests'], 1)
+
+    def test_declined(self):
+        response = self.pay('card-fail')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(Transaction.objects.get(order=self.order).status, 'failed')
+
+    def test_gateway_down_leaves_the_payment_pending_then_fails_fast(self):
+        self.gateway.server.error_rate = 1.0
+        response = self.pay()
+        self.assertEqual(response.status_code, 503, response.content)
+        # Sent but unanswered: the gateway may have charged, so the callbacks decide.
+        self.assertEqual(Transaction.objects.get(order=self.order).status, 'pending')
+
+        Transaction.objects.filter(order=self.order).delete()
+        response = self.pay()
+        self.assertEqual(response.status_code, 503, response.content)
+        # The breaker is open: never sent, so the payment failed.
+        self.assertEqual(Transaction.objects.get(order=self.order).status, 'failed')
+        self.assertEqual(self.gateway.server.stats['requests'], 1)
+
+
+class IdempotencyKeyTests(TestCase):
+    """Idempotency-Key on the payment endpoint (finance/idempotency.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+        cls.currency = Currency.objects.get(code='USD')
+        cls.order = Transaction.objects.filter(transaction_type='payment').first().order
+        Transaction.objects.filter(order=cls.order).delete()
+
+    def setUp(self):
+        self.gateway = mock.Mock()
+        self.gateway.process_payment = mock.AsyncMock(return_value={'success': True, 'transaction_id': 'GW-1', 'error': None})
+        patcher = mock.patch('finance.views.get_gateway', return_value=self.gateway)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, key='key-1', amount='30.00'):
+        return self.client.post('/api/finance/transactions/process-order-payment/', {
+            'order_id': self.order.pk, 'amount': amount, 'currency_id': self.currency.pk, 'transaction_type': 'payment',
+        }, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_stored_answer(self):
+        first = self.pay()
+        self.assertEqual(first.status_code, 200, first.content)
+        retry = self.pay()
+        self.assertEqual((retry.status_code, retry.json()), (200, first.json()))
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first.headers)
+        self.assertEqual(self.gateway.process_payment.await_count, 1)
+        self.assertEqual(Transaction.objects.filter(order=self.order).count(), 1)
+
+    def test_conflict_while_the_first_request_runs(self):
+        self.pay()
+        IdempotencyKey.objects.update(status='in_progress', locked_until=timezone.now() + idempotency.LOCK_TIMEOUT)
+        response = self.pay()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.headers['Retry-After'], str(idempotency.RETRY_AFTER))
+        self.assertEqual(self.gateway.process_payment.await_count, 1)
+
+    def test_stale_lock_is_taken_over(self):
+        self.pay()
+        # The first request died holding the key, before anything was recorded.
+        Transaction.objects.filter(order=self.order).delete()
+        IdempotencyKey.objects.update(status='in_progress', locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.pay().status_code, 200)
+        self.assertEqual(self.gateway.process_payment.await_count, 2)
+        self.assertEqual(IdempotencyKey.objects.get().status, 'completed')
+
+    def test_same_key_for_a_different_request(self):
+        self.pay()
+        response = self.pay(amount='31.00')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.gateway.process_payment.await_count, 1)
+
+    def test_keys_are_per_user(self):
+        self.pay()
+        other = User.objects.create_user('other-payer')
+        self.client.force_authenticate(other)
+        # Not a replay of the first user's answer; the view runs (and finds the order paid for).
+        response = self.pay()
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+    def test_server_error_releases_the_key(self):
+        self.gateway.process_payment.side_effect = GatewayUnavailable("Payment gateway circuit is open.")
+        self.assertEqual(self.pay().status_code, 503)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_purge_deletes_expired_keys_only(self):
+        now = timezone.now()
+        for key, expires_in, locked_for in (
+            ('expired-1', -60, None), ('expired-2', -1, None), ('live', 60, None), ('expired-but-running', -1, 60),
+        ):
+            IdempotencyKey.objects.create(
+                user=self.user, key=key, fingerprint='x', status='completed' if locked_for is None else 'in_progress',
+                expires_at=now + timedelta(seconds=expires_in),
+                locked_until=now + timedelta(seconds=locked_for) if locked_for else None,
+            )
+        out = StringIO()
+        call_command('purge_idempotency_keys', batch_size=1, stdout=out)
+        self.assertIn('Purged 2 expired idempotency keys.', out.getvalue())
+        self.assertEqual(set(IdempotencyKey.objects.values_list('key', flat=True)), {'live', 'expired-but-running'})
+
+
+def our_row(transaction_id, amount, currency='USD', status='successful', processed_at=None):
+    return transaction_id, Decimal(amount), currency, status, processed_at
+
+
+class SettlementMatchTests(SimpleTestCase):
+    """finance.settlement.match() on rows already in id order."""
+
+    def kinds(self, theirs, ours, **window):
+        return [(kind, transaction_id) for kind, transaction_id, _, _ in settlement.match(iter(theirs), iter(ours), **window)]
+
+    def test_matching_rows_report_nothing(self):
+        theirs = [('a', Decimal('1.00'), 'USD'), ('b', Decimal('2.00'), 'EUR')]
+        self.assertEqual(self.kinds(theirs, [our_row('a', '1.00'), our_row('b', '2.00', 'EUR')]), [])
+
+    def test_each_kind(self):
+        now = timezone.now()
+        theirs = [
+            ('a', Decimal('1.00'), 'USD'),
+            ('b', Decimal('2.50'), 'USD'), # we have 2.00
+            ('c', Decimal('3.00'), 'EUR'), # we have USD
+            ('c', Decimal('3.00'), 'EUR'),
+            ('d', Decimal('4.00'), 'USD'), # failed here
+            ('f', Decimal('6.00'), 'USD'), # unknown here
+        ]
+        ours = [
+            our_row('a', '1.00'), our_row('b', '2.00'), our_row('c', '3.00'), our_row('d', '4.00', status='failed'),
+            our_row('e', '5.00', processed_at=now), # not settled
+            our_row('g', '7.00', processed_at=None), # never processed: not expected in the file
+        ]
+        self.assertEqual(self.kinds(theirs, ours), [
+            ('amount_mismatch', 'b'), ('currency_mismatch', 'c'), ('duplicate_in_settlement', 'c'),
+            ('status_mismatch', 'd'), ('missing_in_settlement', 'e'), ('missing_in_ours', 'f'),
+        ])
+
+    def test_missing_in_settlement_only_within_the_window(self):
+        now = timezone.now()
+        ours = [our_row('a', '1.00', processed_at=now - timedelta(days=2)), our_row('b', '1.00', processed_at=now)]
+        self.assertEqual(self.kinds([], ours, since=now - timedelta(days=1), until=now + timedelta(seconds=1)), [('missing_in_settlement', 'b')])
+        self.assertEqual(self.kinds([], ours, since=now - timedelta(days=3), until=now), [('missing_in_settlement', 'a')])
+
+    def test_rows_out_of_order(self):
+        with self.assertRaisesMessage(settlement.SettlementError, "'a' after 'b'"):
+            self.kinds([('b', Decimal('1.00'), 'USD'), ('a', Decimal('1.00'), 'USD')], [])
+
+    def test_external_sort_in_small_runs(self):
+        rows = [(f'txn-{n:03d}', Decimal(n), 'USD') for n in (7, 3, 9, 1, 5, 3, 8)]
+        self.assertEqual(list(settlement.sort_settlement(iter(rows), sort_buffer=2)), sorted(rows))
+
+
+class SettlementFileTests(TestCase):
+    """reconcile_settlement and export_transactions on a few transactions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        usd = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        eur = Currency.objects.create(code='EUR', name='Euro', symbol='€')
+        now = timezone.now()
+        for external_id, amount, currency, status, processed_at in (
+            ('txn-a', '10.00', usd, 'successful', now),
+            ('txn-b', '20.00', usd, 'successful', now),
+            ('txn-c', '5.00', usd, 'successful', now),
+            ('txn-d', '7.00', eur, 'failed', now),
+            ('txn-e', '9.00', usd, 'successful', now),
+            ('txn-f', '3.00', usd, 'successful', now - timedelta(days=10)),
+        ):
+            transaction = Transaction.objects.create(
+                transaction_id_external=external_id, amount=Decimal(amount), currency=currency,
+                transaction_type='payment', status=status, processed_at=processed_at, payment_method_details='Visa, "gold"',
+            )
+            transaction.record_gateway_response({'id': external_id, 'status': status, 'note': 'naïve, "quoted"'})
+
+    def write(self, name, text):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def reconcile(self, settlement_file, **options):
+        report = os.path.join(os.path.dirname(settlement_file), 'report.csv')
+        call_command('reconcile_settlement', settlement_file, output=report, stderr=StringIO(), **options)
+        with open(report, newline='', encoding='utf-8') as f:
+            return list(csv.DictReader(f))
+
+    def test_reconcile_settlement(self):
+        settlement_file = self.write('settlement.csv', (
+            'transaction_id,amount,currency\n'
+            'txn-z,1.00,usd\n'
+            'txn-c,5.00,EUR\n'
+            'txn-a,10.00,USD\n'
+            'txn-d,7.00,EUR\n'
+            'txn-b,21.00,USD\n'
+            'txn-a,10.00,USD\n'
+        ))
+        report = self.reconcile(settlement_file, sort_buffer=2, since=timezone.now() - timedelta(days=1))
+        self.assertEqual([(row['kind'], row['transaction_id']) for row in report], [
+            ('duplicate_in_settlement', 'txn-a'), ('amount_mismatch', 'txn-b'), ('currency_mismatch', 'txn-c'),
+            ('status_mismatch', 'txn-d'), ('missing_in_settlement', 'txn-e'), ('missing_in_ours', 'txn-z'),
+        ])
+        amount = report[1]
+        self.assertEqual((amount['our_amount'], amount['settled_amount'], amount['our_status']), ('20.00', '21.00', 'successful'))
+        self.assertEqual(report[-1]['settled_currency'], 'USD')
+
+    def test_presorted_file_out_of_order(self):
+        settlement_file = self.write('settlement.csv', 'transaction_id,amount,currency\ntxn-b,20.00,USD\ntxn-a,10.00,USD\n')
+        with self.assertRaisesMessage(CommandError, 'not in transaction id order'):
+            self.reconcile(settlement_file, presorted=True)
+
+    def test_settlement_file_without_columns(self):
+        with self.assertRaisesMessage(CommandError, 'lacks columns: currency'):
+            self.reconcile(self.write('settlement.csv', 'transaction_id,amount\ntxn-a,10.00\n'))
+
+    def test_export_csv(self):
+        path = self.write('export.csv', '')
+        call_command('export_transactions', format='csv', output=path, chunk_size=2, stderr=StringIO())
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(list(rows[0]), exports.FIELDS)
+        self.assertEqual([row['transaction_id_external'] for row in rows], ['txn-a', 'txn-b', 'txn-c', 'txn-d', 'txn-e', 'txn-f'])
+        self.assertEqual((rows[3]['amount'], rows[3]['currency'], rows[3]['status']), ('7.00', 'EUR', 'failed'))
+        self.assertEqual(rows[0]['payment_method_details'], 'Visa, "gold"')
+        self.assertEqual(json.loads(rows[0]['gateway_response']), {'id': 'txn-a', 'status': 'successful', 'note': 'naïve, "quoted"'})
+
+    def test_export_jsonl(self):
+        path = self.write('export.jsonl', '')
+        call_command('export_transactions', format='jsonl', output=path, stderr=StringIO())
+        with open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(set(rows[0]), set(exports.FIELDS))
+        self.assertEqual(rows[1]['amount'], '20.00')
+        self.assertEqual(rows[1]['gateway_response'], {'id': 'txn-b', 'status': 'successful', 'note': 'naïve, "quoted"'})
+        self.assertIsNone(rows[1]['order_number'])
+
+    def test_export_endpoint_follows_the_list_filters(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('exporter'))
+        response = client.get('/api/finance/transactions/export/', {'export_format': 'jsonl', 'status': 'failed'})
+        self.assertEqual(response['Content-Type'], exports.CONTENT_TYPES['jsonl'])
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['transaction_id_external'] for row in rows], ['txn-d'])
+        self.assertEqual(client.get('/api/finance/transactions/export/', {'export_format': 'xml'}).status_code, 400)
+
+
+class RateTableTests(SimpleTestCase):
+    """RateTable conversions: one rounding, the same whether amounts come one at a time or in a batch."""
+
+    def setUp(self):
+        self.table = rates.RateTable(
+            {1: Decimal('1.0000'), 2: Decimal('0.9137'), 3: Decimal('151.2345')}, {1: 'USD', 2: 'EUR', 3: 'JPY'}, default_id=1,
+        )
+
+    def test_convert_many_gives_the_figures_of_convert(self):
+        amounts = [Decimal(n) / 100 for n in range(0, 100000, 997)] + [Decimal('0.005'), Decimal('0.015'), Decimal('1234567.89')]
+        for from_code in ('USD', 'EUR', 'JPY'):
+            for to_code in ('USD', 'EUR', 'JPY'):
+                batch = self.table.convert_many(amounts, [from_code] * len(amounts), to_code)
+                self.assertEqual(batch, [self.table.convert(amount, from_code, to_code) for amount in amounts], (from_code, to_code))
+                self.assertEqual(self.table.convert_many(amounts, from_code, to_code), batch)
+
+    def test_rounds_once_half_even_to_the_cent(self):
+        self.assertEqual(self.table.convert(Decimal('0.125'), 'USD'), Decimal('0.12'))
+        self.assertEqual(self.table.convert(Decimal('0.135'), 'USD'), Decimal('0.14'))
+        # 100 EUR in JPY is 16551.8769...; rounding the USD step first would give 16552.62.
+        self.assertEqual(self.table.convert(Decimal('100'), 'EUR', 'JPY'), Decimal('16551.88'))
+        self.assertEqual(self.table.convert(Decimal('100'), 'EUR', 'JPY'), (Decimal('100') * Decimal('151.2345') / Decimal('0.9137')).quantize(rates.CENT))
+
+    def test_convert_totals_rounds_each_currency_before_adding(self):
+        totals = {'EUR': Decimal('0.01'), 2: Decimal('0.01')}
+        self.assertEqual(self.table.convert_totals(totals), Decimal('0.02'))
+        self.assertEqual(self.table.convert_totals({}), Decimal('0.00'))
+
+    def test_currencies_by_id_code_instance_or_default(self):
+        euro = Currency(pk=2, code='EUR')
+        self.assertEqual({self.table.currency_id(c) for c in (2, 'EUR', 'eur', euro)}, {2})
+        self.assertEqual(self.table.currency_id(None), 1)
+        with self.assertRaises(rates.UnknownCurrency):
+            self.table.convert(Decimal('1'), 'GBP')
+        with self.assertRaises(rates.UnknownCurrency):
+            rates.RateTable({2: Decimal('1')}, {2: 'EUR'}).convert(Decimal('1'), 'EUR')
+        with self.assertRaises(AttributeError):
+            self.table.rates = {}
+
+
+class RateHistoryTests(TestCase):
+    """RateHistory tables: the rates in effect at a moment and at the close of a (local) day."""
+
+    def setUp(self):
+        self.euro = Currency.objects.create(code='EUR', name='Euro', symbol='€', exchange_rate=Decimal('0.9000'))
+        rates.invalidate()
+
+    def at(self, day, hour, minute=0):
+        return datetime(2026, 3, day, hour, minute, tzinfo=timezone.get_fixed_timezone(0))
+
+    def history(self):
+        return rates.RateHistory({
+            2: [(self.at(10, 10), Decimal('0.9000')), (self.at(11, 23, 30), Decimal('0.9500')), (self.at(12, 0), Decimal('1.0000')), (self.at(13, 2), Decimal('1.1000'))],
+        }, {2: 'EUR'})
+
+    def rate_for_day(self, history, day):
+        return history.table_for_day(date(2026, 3, day)).rate('EUR')
+
+    def test_table_for_day_has_the_closing_rates(self):
+        history = self.history()
+        self.assertEqual([self.rate_for_day(history, day) for day in (9, 10, 11, 12, 13)], [
+            Decimal('0.9000'), # before the first record: the first rate
+            Decimal('0.9000'),
+            Decimal('0.9500'), # changed at 23:30
+            Decimal('1.0000'), # changed at midnight: the 12th's, not the 11th's
+            Decimal('1.1000'),
+        ])
+        self.assertEqual(history.table_at(self.at(11, 23, 29)).rate('EUR'), Decimal('0.9000'))
+        self.assertIs(history.table_for_day(date(2026, 3, 11)), history.table_for_day(date(2026, 3, 11)))
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_table_for_day_closes_the_day_in_local_time(self):
+        # 02:00 UTC on the 13th is 22:00 on the 12th in New York.
+        self.assertEqual(self.rate_for_day(self.history(), 12), Decimal('1.1000'))
+
+    def test_get_history_records_rate_changes(self):
+        self.euro.exchange_rate = Decimal('0.9500')
+        self.euro.save()
+        self.euro.name = 'Euro (EUR)'
+        self.euro.save()
+        self.assertEqual(list(ExchangeRate.objects.filter(currency=self.euro).values_list('rate', flat=True)), [Decimal('0.9000'), Decimal('0.9500')])
+        ExchangeRate.objects.filter(currency=self.euro, rate=Decimal('0.9000')).update(valid_from=self.at(1, 0))
+        ExchangeRate.objects.filter(currency=self.euro, rate=Decimal('0.9500')).update(valid_from=self.at(10, 0))
+        unrecorded = Currency.objects.create(code='GBP', name='Pound', symbol='£', exchange_rate=Decimal('0.8000'))
+        ExchangeRate.objects.filter(currency=unrecorded).delete()
+
+        with self.assertNumQueries(2):
+            history = rates.get_history()
+        self.assertEqual(self.rate_for_day(history, 5), Decimal('0.9000'))
+        self.assertEqual(self.rate_for_day(history, 10), Decimal('0.9500'))
+        self.assertEqual(history.table_at(self.at(1, 0)).rate('GBP'), Decimal('0.8000'))
+
+
+class GatewayResponseTests(TestCase):
+    """Raw gateway answers: kept off the transaction payloads and served by their own endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        usd = Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        cls.answered, cls.unanswered = (
+            Transaction.objects.create(transaction_id_external=external_id, amount=Decimal('10.00'), currency=usd, transaction_type='payment', status='successful')
+            for external_id in ('txn-answered', 'txn-unanswered')
+        )
+        cls.answered.record_gateway_response({'success': True, 'transaction_id': 'txn-answered', 'amount': Decimal('10.00')})
+        cls.admin = User.objects.create_superuser('finance-admin')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def url(self, transaction):
+        return f'/api/finance/transactions/{transaction.pk}/gateway-response/'
+
+    def test_endpoint_returns_the_payload(self):
+        response = self.client.get(self.url(self.answered))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['transaction'], self.answered.pk)
+        self.assertEqual(response.json()['payload'], {'success': True, 'transaction_id': 'txn-answered', 'amount': '10.00'})
+        self.assertEqual(self.client.get(self.url(self.unanswered)).status_code, 404)
+        self.assertEqual(self.client.get('/api/finance/transactions/999999/gateway-response/').status_code, 404)
+
+    def test_endpoint_is_for_admins(self):
+        self.client.force_authenticate(User.objects.create_user('customer'))
+        self.assertEqual(self.client.get(self.url(self.answered)).status_code, 403)
+
+    def test_not_in_the_list_or_detail_payloads(self):
+        with CaptureQueriesContext(connection) as queries:
+            listed = self.client.get('/api/finance/transactions/').json()['results']
+        self.assertTrue(listed)
+        self.assertFalse(any('gateway_response' in row for row in listed))
+        self.assertFalse(any('finance_gatewayresponse' in query['sql'] for query in queries))
+        self.assertNotIn('gateway_response', self.client.get(f'/api/finance/transactions/{self.answered.pk}/').json())
+
+    def test_update_replaces_the_stored_answer(self):
+        response = self.client.patch(f'/api/finance/transactions/{self.answered.pk}/', {'gateway_response': {'success': False, 'error': 'declined'}}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(GatewayResponse.objects.filter(transaction=self.answered).count(), 1)
+        self.assertEqual(GatewayResponse.objects.get(transaction=self.answered).payload, {'success': False, 'error': 'declined'})
+        self.client.patch(f'/api/finance/transactions/{self.answered.pk}/', {'notes': 'checked'}, format='json')
+        self.assertEqual(GatewayResponse.objects.get(transaction=self.answered).payload, {'success': False, 'error': 'declined'})
+
+
+class GatewayResponseMigrationTests(SimpleTestCase):
+    """parse_raw() of migration 0008, which turned the old text column into JSON payloads."""
+
+    parse_raw = staticmethod(import_module('finance.migrations.0008_gateway_responses').parse_raw)
+
+    def test_python_reprs_and_json(self):
+        self.assertEqual(self.parse_raw("{'success': True, 'transaction_id': 'txn_1', 'error': None}"), {'success': True, 'transaction_id': 'txn_1', 'error': None})
+        self.assertEqual(self.parse_raw('{"success": true, "error": null}'), {'success': True, 'error': None})
+        self.assertEqual(self.parse_raw("[1, 'two']"), [1, 'two'])
+
+    def test_anything_else_is_kept_as_text(self):
+        for raw in (
+            "{'amount': Decimal('10.00')}", # not a literal
+            "{1, 2}", # a literal JSON can't hold
+            "b'bytes'",
+            "{'success': True", # truncated
+            "Gateway timeout",
+            "",
+        ):
+            with self.subTest(raw=raw):
+                self.assertEqual(self.parse_raw(raw), {'raw': raw})
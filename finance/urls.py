@@ -1,14 +1,16 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CurrencyViewSet, TransactionViewSet
+from .views import CurrencyViewSet, TransactionViewSet, ProcessOrderPaymentView, RefundTransactionView
 
 router = DefaultRouter()
 router.register(r'currencies', CurrencyViewSet, basename='currency')
 router.register(r'transactions', TransactionViewSet, basename='transaction')
 
 urlpatterns = [
+    # Async views that wait on the payment gateway; ahead of the router so its detail route doesn't take them.
+    path('transactions/process-order-payment/', ProcessOrderPaymentView.as_view(), name='transaction-process-order-payment'),
+    path('transactions/<int:pk>/refund/', RefundTransactionView.as_view(), name='transaction-refund-transaction'),
     path('', include(router.urls)),
     # Example: if you had a specific, non-Viewset view for initiating payment for an order.
     # path('orders/<int:order_id>/initiate-payment/', InitiatePaymentView.as_view(), name='initiate-order-payment'),
-    # However, the current design uses an action `process-order-payment` on the TransactionViewSet.
 ]
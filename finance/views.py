@@ -1,39 +1,31 @@
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, generics, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.db import transaction as django_db_transaction # For atomic operations
 from decimal import Decimal, InvalidOperation # For refund amount conversion
 
-from .models import Currency, Transaction
+from core.pagination import KeysetPagination
+
+from . import exports, ledger
+from .gateway import GatewayError, GatewayUnavailable, get_gateway
+from .idempotency import idempotent
+from .models import Currency, GatewayResponse, Transaction
 from shop.models import Order # Needed for linking transactions to orders
 from shop.models import OrderTimeline # For logging payment events on order timeline
 
 from .serializers import (
     CurrencySerializer, TransactionSerializer, 
-    TransactionCreateSerializer, TransactionUpdateSerializer
+    TransactionCreateSerializer, TransactionUpdateSerializer, GatewayResponseSerializer
 )
 
-# A mock payment gateway client for demonstration
-class MockPaymentGateway:
-    def process_payment(self, amount, currency_code, payment_method_details):
-        # Simulate gateway processing
-        print(f"MockGateway: Processing payment of {amount} {currency_code} with details: {payment_method_details}")
-        if "fail" in payment_method_details.lower(): # Simulate failure
-            return {"success": False, "transaction_id": None, "error": "Payment declined by mock gateway."}
-        import uuid
-        return {"success": True, "transaction_id": f"MOCK_GW_{uuid.uuid4().hex[:10].upper()}", "error": None}
-
-    def process_refund(self, original_transaction_id, amount, currency_code):
-        print(f"MockGateway: Processing refund for {original_transaction_id} of {amount} {currency_code}")
-        import uuid
-        return {"success": True, "refund_id": f"MOCK_REF_{uuid.uuid4().hex[:8].upper()}", "error": None}
-
-
-mock_gateway = MockPaymentGateway()
-
 
 class CurrencyViewSet(viewsets.ModelViewSet):
     queryset = Currency.objects.all()
@@ -60,6 +52,7 @@ class CurrencyViewSet(viewsets.ModelViewSet):
 class TransactionViewSet(viewsets.ModelViewSet):
     queryset = Transaction.objects.all().select_related('order', 'user', 'currency', 'parent_transaction')
     permission_classes = [permissions.IsAdminUser] # Generally, direct transaction manipulation is for admins. Users interact via order payment flow.
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = {
         'status': ['exact'],
@@ -75,12 +68,16 @@ class TransactionViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'processed_at', 'amount', 'status']
 
     def get_serializer_class(self):
-        if self.action == 'create' or self.action == 'process_order_payment': # Using a more specific action name now
+        if self.action == 'create':
             return TransactionCreateSerializer
         elif self.action in ['update', 'partial_update'] or self.action in ['complete_payment_callback', 'fail_payment_callback']: # Specific actions for updates
             return TransactionUpdateSerializer
         return TransactionSerializer
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     # This is a simplified "create" - typically payment initiation is more complex
     # and tied to an order. Direct creation of transactions by API might be rare for users.
     # For admin creation:
@@ -96,18 +93,156 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 user_triggered=user
             )
 
-    @action(detail=False, methods=['post'], url_path='process-order-payment', permission_classes=[permissions.IsAuthenticated])
-    def process_order_payment(self, request):
+    @action(detail=True, methods=['get'], url_path='gateway-response')
+    def gateway_response(self, request, pk=None):
+        """The gateway's raw answer for this transaction; never part of the list or detail payloads."""
+        transaction = self.get_object()
+        response = get_object_or_404(GatewayResponse, transaction=transaction)
+        return Response(GatewayResponseSerializer(response).data)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Streams every transaction matching the list filters as CSV or JSONL
+        (?export_format=csv|jsonl), gateway responses included, without pagination.
+        """
+        file_format = request.query_params.get('export_format', 'csv')
+        if file_format not in exports.FORMATS:
+            return Response({'detail': f"export_format must be one of: {', '.join(exports.FORMATS)}."}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(Transaction.objects.all())
+        # Under ASGI a sync iterator would be read whole before the first byte is sent.
+        if isinstance(request._request, ASGIRequest):
+            lines = exports.astream_lines(queryset, file_format)
+        else:
+            lines = exports.stream_lines(queryset, file_format)
+        response = StreamingHttpResponse(lines, content_type=exports.CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="transactions-{timezone.now():%Y%m%d-%H%M%S}.{file_format}"'
+        return response
+
+    # These would typically be callback URLs hit by the payment gateway, or admin actions
+    @action(detail=True, methods=['post'], url_path='complete-payment') # Example for a successful async payment
+    @idempotent
+    def complete_payment_callback(self, request, pk=None):
+        transaction = self.get_object()
+        with django_db_transaction.atomic():
+            # Under the row lock, so a callback racing the payment or refund view settles it once.
+            if not ledger.lock_pending(transaction):
+                return Response({'detail': f'Transaction is not in a pending state. Current status: {transaction.status}'}, status=status.HTTP_400_BAD_REQUEST)
+
+            transaction.status = 'successful'
+            # transaction.transaction_id_external = request.data.get('gateway_transaction_id', transaction.transaction_id_external) # If gateway provides ID later
+            # transaction.record_gateway_response(request.data) # Store callback data
+            transaction.save() # This will update processed_at via model's save method
+
+            if transaction.order:
+                transaction.order.status = 'processing' # Or 'paid' etc.
+                transaction.order.save(update_fields=['status'])
+                OrderTimeline.objects.create(order=transaction.order, note=f"Payment completed for TxID: {transaction.transaction_id_external}.", status_changed_to=transaction.order.status, user_triggered=None) # System triggered
+        return Response(TransactionSerializer(transaction).data)
+
+    @action(detail=True, methods=['post'], url_path='fail-payment') # Example for a failed async payment
+    @idempotent
+    def fail_payment_callback(self, request, pk=None):
+        transaction = self.get_object()
+        with django_db_transaction.atomic():
+            if not ledger.lock_pending(transaction):
+                return Response({'detail': f'Transaction is not in a pending state. Current status: {transaction.status}'}, status=status.HTTP_400_BAD_REQUEST)
+            transaction.status = 'failed'
+            # transaction.record_gateway_response(request.data)
+            transaction.save()
+
+            if transaction.order:
+                # Order status might remain 'pending' or move to a 'payment_failed' status
+                OrderTimeline.objects.create(order=transaction.order, note=f"Payment failed for TxID: {transaction.transaction_id_external}.", user_triggered=None) # System triggered
+        return Response(TransactionSerializer(transaction).data)
+
+
+# Views that wait on the payment gateway (finance/gateway.py). DRF's APIView is sync-only and
+# would hold a worker thread for the whole gateway round trip, so these dispatch asynchronously:
+# authentication, permissions and the database work run in a worker thread (sync_to_async),
+# the gateway call is awaited on the event loop in between.
+class GatewayAPIView(APIView):
+    http_method_names = ['post']
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() not in self.http_method_names:
+                self.http_method_not_allowed(request, *args, **kwargs)
+            response = await self.post(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    def gateway_unavailable(self, transaction, error, note):
         """
-        Simulates initiating a payment for an order.
-        Expects: order_id, amount, currency_id, payment_method_details (e.g., card nonce from a frontend)
+        Records a gateway call that got no answer. If it was never sent (circuit open) the
+        transaction failed; otherwise the outcome is unknown and it stays pending for the
+        gateway callbacks (complete-payment / fail-payment) to settle.
         """
+        with django_db_transaction.atomic():
+            transaction.notes = (transaction.notes or "") + f"\nGateway unavailable: {error}"
+            if isinstance(error, GatewayUnavailable) and ledger.lock_pending(transaction):
+                transaction.status = 'failed'
+                transaction.save()
+            else:
+                transaction.save(update_fields=['notes'])
+        if transaction.order:
+            OrderTimeline.objects.create(order=transaction.order, note=note, user_triggered=self.request.user)
+        return Response({
+            "detail": "Payment gateway unavailable, please try again later.",
+            "transaction": TransactionSerializer(transaction).data,
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def already_settled(self, transaction):
+        """A gateway callback settled the transaction while the gateway call was in flight; that outcome stands."""
+        transaction.refresh_from_db()
+        return Response({
+            "detail": f"Transaction was already settled meanwhile: {transaction.status}.",
+            "transaction": TransactionSerializer(transaction).data,
+        }, status=status.HTTP_409_CONFLICT)
+
+
+class ProcessOrderPaymentView(GatewayAPIView):
+    """
+    Initiates a payment for an order.
+    Expects: order_id, amount, currency_id, payment_method_details (e.g., card nonce from a frontend)
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @idempotent
+    async def post(self, request):
+        transaction = await sync_to_async(self.start_payment)(request)
+        if isinstance(transaction, Response):
+            return transaction
+        try:
+            gateway_response = await get_gateway().process_payment(
+                transaction.amount, transaction.currency.code, transaction.payment_method_details,
+                idempotency_key=f'payment-{transaction.pk}',
+            )
+        except GatewayError as e:
+            return await sync_to_async(self.gateway_unavailable)(
+                transaction, e, f"Payment could not be confirmed: gateway unavailable ({e}).",
+            )
+        return await sync_to_async(self.finish_payment)(transaction, gateway_response)
+
+    @django_db_transaction.atomic
+    def start_payment(self, request):
+        """Validates the request and records the pending transaction; returns it, or an error Response."""
         serializer = TransactionCreateSerializer(data=request.data, context={'request': request})
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         validated_data = serializer.validated_data
-        order = validated_data['order']
+        # The order row lock serialises payment attempts for the order until the pending
+        # transaction below is committed, so the duplicate check cannot race.
+        order = Order.objects.select_for_update().get(pk=validated_data['order'].pk)
         amount = validated_data['amount']
         currency = validated_data['currency']
         payment_method_details = validated_data.get('payment_method_details', "N/A")
@@ -122,7 +257,6 @@ class TransactionViewSet(viewsets.ModelViewSet):
         if existing_transactions.exists():
             return Response({'detail': 'A payment is already pending or successful for this order.'}, status=status.HTTP_400_BAD_REQUEST)
 
-
         # Create a pending transaction record BEFORE calling the gateway
         transaction = Transaction.objects.create(
             order=order,
@@ -135,17 +269,20 @@ class TransactionViewSet(viewsets.ModelViewSet):
             notes=validated_data.get('notes', "Payment initiated by user.")
         )
         OrderTimeline.objects.create(order=order, note=f"Payment initiated. Amount: {amount} {currency.code}.", user_triggered=user, status_changed_to=order.status)
+        return transaction
 
-        # Simulate calling a payment gateway
-        gateway_response = mock_gateway.process_payment(amount, currency.code, payment_method_details)
-
+    def finish_payment(self, transaction, gateway_response):
+        order = transaction.order
+        user = self.request.user
         with django_db_transaction.atomic():
+            if not ledger.lock_pending(transaction):
+                return self.already_settled(transaction)
             if gateway_response["success"]:
                 transaction.transaction_id_external = gateway_response["transaction_id"]
                 transaction.status = 'successful'
                 transaction.processed_at = timezone.now()
-                transaction.gateway_response_raw = str(gateway_response) # Store raw response
                 transaction.save()
+                transaction.record_gateway_response(gateway_response)
 
                 # Update order status (simplified)
                 order.status = 'processing' # Or 'paid', 'completed' depending on your Order model's status flow
@@ -156,9 +293,9 @@ class TransactionViewSet(viewsets.ModelViewSet):
             else:
                 transaction.status = 'failed'
                 transaction.processed_at = timezone.now()
-                transaction.gateway_response_raw = str(gateway_response)
                 transaction.notes = (transaction.notes or "") + f"\nGateway error: {gateway_response['error']}"
                 transaction.save()
+                transaction.record_gateway_response(gateway_response)
                 OrderTimeline.objects.create(order=order, note=f"Payment failed. Error: {gateway_response['error']}", user_triggered=user)
                 return Response({
                     "detail": "Payment processing failed.", 
@@ -167,58 +304,52 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
 
 
-    # These would typically be callback URLs hit by the payment gateway, or admin actions
-    @action(detail=True, methods=['post'], url_path='complete-payment') # Example for a successful async payment
-    def complete_payment_callback(self, request, pk=None):
-        transaction = self.get_object()
-        if transaction.status != 'pending' and transaction.status != 'requires_action':
-            return Response({'detail': f'Transaction is not in a pending state. Current status: {transaction.status}'}, status=status.HTTP_400_BAD_REQUEST)
-
-        transaction.status = 'successful'
-        # transaction.transaction_id_external = request.data.get('gateway_transaction_id', transaction.transaction_id_external) # If gateway provides ID later
-        # transaction.gateway_response_raw = str(request.data) # Store callback data
-        transaction.save() # This will update processed_at via model's save method
-
-        if transaction.order:
-            transaction.order.status = 'processing' # Or 'paid' etc.
-            transaction.order.save(update_fields=['status'])
-            OrderTimeline.objects.create(order=transaction.order, note=f"Payment completed for TxID: {transaction.transaction_id_external}.", status_changed_to=transaction.order.status, user_triggered=None) # System triggered
-        return Response(TransactionSerializer(transaction).data)
-
-    @action(detail=True, methods=['post'], url_path='fail-payment') # Example for a failed async payment
-    def fail_payment_callback(self, request, pk=None):
-        transaction = self.get_object()
-        transaction.status = 'failed'
-        # transaction.gateway_response_raw = str(request.data)
-        transaction.save()
-
-        if transaction.order:
-            # Order status might remain 'pending' or move to a 'payment_failed' status
-            OrderTimeline.objects.create(order=transaction.order, note=f"Payment failed for TxID: {transaction.transaction_id_external}.", user_triggered=None) # System triggered
-        return Response(TransactionSerializer(transaction).data)
-
-
-    @action(detail=True, methods=['post'], url_path='refund')
-    def refund_transaction(self, request, pk=None):
-        original_transaction = self.get_object()
+class RefundTransactionView(GatewayAPIView):
+    """Refunds a successful payment or capture, in full or by `amount`."""
+    permission_classes = [permissions.IsAdminUser]
+
+    @idempotent
+    async def post(self, request, pk=None):
+        prepared = await sync_to_async(self.start_refund)(request, pk)
+        if isinstance(prepared, Response):
+            return prepared
+        original_transaction, refund_tx = prepared
+        try:
+            gateway_response = await get_gateway().process_refund(
+                original_transaction.transaction_id_external, refund_tx.amount, refund_tx.currency.code,
+                idempotency_key=f'refund-{refund_tx.pk}',
+            )
+        except GatewayError as e:
+            return await sync_to_async(self.gateway_unavailable)(
+                refund_tx, e, f"Refund for original TxID {original_transaction.transaction_id_external} could not be confirmed: gateway unavailable ({e}).",
+            )
+        return await sync_to_async(self.finish_refund)(original_transaction, refund_tx, gateway_response)
+
+    @django_db_transaction.atomic
+    def start_refund(self, request, pk):
+        """Validates the refund and records it as pending; returns (original, refund) or an error Response."""
+        # The row lock makes concurrent refunds of this transaction check its ledger one at a
+        # time; the pending refund below reserves its amount there (finance/ledger.py).
+        original_transaction = get_object_or_404(
+            Transaction.objects.select_for_update(of=('self',)).select_related('order', 'currency'), pk=pk,
+        )
         if original_transaction.status != 'successful' or original_transaction.transaction_type not in ['payment', 'capture']:
             return Response({'detail': 'Only successful payment or capture transactions can be refunded.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Check if already fully refunded
-        existing_refunds = Transaction.objects.filter(parent_transaction=original_transaction, status='successful', transaction_type='refund')
-        total_refunded_amount = sum(ref.amount for ref in existing_refunds)
+        # Successful and in-flight refunds are already taken off
+        refundable_amount = original_transaction.refundable_amount
         
         # Allow partial refunds by specifying an amount, otherwise full refund
         refund_amount_str = request.data.get('amount')
         if refund_amount_str:
             try:
                 refund_amount = Decimal(refund_amount_str)
-                if refund_amount <= 0 or refund_amount > (original_transaction.amount - total_refunded_amount):
+                if refund_amount <= 0 or refund_amount > refundable_amount:
                     raise ValueError("Invalid refund amount.")
             except (ValueError, TypeError, InvalidOperation): # Add InvalidOperation
                 return Response({'detail': 'Invalid refund amount provided.'}, status=status.HTTP_400_BAD_REQUEST)
         else: # Default to full remaining refundable amount
-            refund_amount = original_transaction.amount - total_refunded_amount
+            refund_amount = refundable_amount
 
 
         if refund_amount <= 0: # Check if there's anything to refund
@@ -237,22 +368,26 @@ class TransactionViewSet(viewsets.ModelViewSet):
             notes=f"Refund initiated for transaction {original_transaction.transaction_id_external}. Amount: {refund_amount}",
             parent_transaction=original_transaction
         )
+        return original_transaction, refund_tx
 
-        # Simulate calling gateway for refund
-        gateway_response = mock_gateway.process_refund(original_transaction.transaction_id_external, refund_amount, original_transaction.currency.code)
-        
+    def finish_refund(self, original_transaction, refund_tx, gateway_response):
+        request = self.request
         with django_db_transaction.atomic():
+            # Locked, so a gateway callback for this refund cannot move it out of pending too
+            # and apply it to the ledger a second time.
+            if not ledger.lock_pending(refund_tx):
+                return self.already_settled(refund_tx)
             if gateway_response["success"]:
                 refund_tx.transaction_id_external = gateway_response["refund_id"]
                 refund_tx.status = 'successful'
                 refund_tx.processed_at = timezone.now()
-                refund_tx.gateway_response_raw = str(gateway_response)
                 refund_tx.save()
+                refund_tx.record_gateway_response(gateway_response)
 
                 # Update order status (e.g., to 'refunded' or 'partially_refunded')
                 if original_transaction.order:
                     new_order_status = 'refunded' # Simplified
-                    current_total_refunded = total_refunded_amount + refund_tx.amount
+                    current_total_refunded = Transaction.objects.filter(pk=original_transaction.pk).values_list('refunded_amount', flat=True).get()
                     if current_total_refunded < original_transaction.order.total_amount: # Check against order total
                         new_order_status = 'partially_refunded' # Custom status you might add
                     
@@ -268,9 +403,9 @@ class TransactionViewSet(viewsets.ModelViewSet):
             else:
                 refund_tx.status = 'failed'
                 refund_tx.processed_at = timezone.now()
-                refund_tx.gateway_response_raw = str(gateway_response)
                 refund_tx.notes = (refund_tx.notes or "") + f"\nGateway refund error: {gateway_response['error']}"
                 refund_tx.save()
+                refund_tx.record_gateway_response(gateway_response)
                 if original_transaction.order:
                     OrderTimeline.objects.create(order=original_transaction.order, note=f"Refund failed for original TxID: {original_transaction.transaction_id_external}. Error: {gateway_response['error']}", user_triggered=request.user)
                 return Response({
@@ -1,8 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    CategoryViewSet, ProductViewSet, ProductSearchView,
-    AddressViewSet, OrderViewSet, CarrierViewSet, ShipmentViewSet
+    CategoryViewSet, ProductViewSet, ProductSearchView, ProductFacetsView,
+    AddressViewSet, OrderViewSet, CarrierViewSet, ShipmentViewSet,
+    StockReservationViewSet
 )
 
 router = DefaultRouter()
@@ -12,9 +13,11 @@ router.register(r'addresses', AddressViewSet, basename='address')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'carriers', CarrierViewSet, basename='carrier')
 router.register(r'shipments', ShipmentViewSet, basename='shipment')
+router.register(r'stock-holds', StockReservationViewSet, basename='stock-hold')
 
 
 urlpatterns = [
     path('', include(router.urls)),
     path('search/products/', ProductSearchView.as_view(), name='product_search'),
+    path('search/products/facets/', ProductFacetsView.as_view(), name='product_facets'),
 ]
@@ -0,0 +1,95 @@
+"""
+In-process category tree.
+
+The whole tree is loaded with one query (ordered by materialized path, see Category.path) and
+kept in memory per process. Saves and deletes bump a version number in the shared cache
+(shop/signals.py), so every process reloads its copy on the next access; CATEGORY_TREE_TTL
+bounds staleness when the cache backend is not shared between processes.
+"""
+import time
+
+from django.core.cache import cache
+
+from .models import Category
+
+
+CATEGORY_TREE_TTL = 300
+VERSION_KEY = 'shop:category_tree_version'
+
+_cached = None # (version, loaded_at, CategoryTree)
+
+
+class CategoryTree:
+    """Category instances linked in memory: `child_nodes` (sorted by name) and `parent_node`."""
+
+    def __init__(self, categories):
+        self.nodes = {}
+        self.roots = []
+        for category in categories:
+            category.child_nodes = []
+            category.parent_node = None
+            self.nodes[category.pk] = category
+        for category in self.nodes.values():
+            parent = self.nodes.get(category.parent_id)
+            if parent is None:
+                self.roots.append(category)
+            else:
+                category.parent_node = parent
+                parent.child_nodes.append(category)
+        self.roots.sort(key=lambda c: c.name)
+        for category in self.nodes.values():
+            category.child_nodes.sort(key=lambda c: c.name)
+
+    def get(self, pk):
+        return self.nodes.get(pk)
+
+    def walk(self, roots=None):
+        """Yields categories depth-first in display order."""
+        stack = list(reversed(self.roots if roots is None else roots))
+        while stack:
+            category = stack.pop()
+            yield category
+            stack.extend(reversed(category.child_nodes))
+
+    def descendant_ids(self, pk, include_self=True):
+        category = self.nodes.get(pk)
+        if category is None:
+            return []
+        ids = [c.pk for c in self.walk([category])]
+        return ids if include_self else ids[1:]
+
+    def ancestors(self, pk):
+        """Root first, excluding the category itself."""
+        category = self.nodes.get(pk)
+        ancestors = []
+        while category is not None and category.parent_node is not None:
+            category = category.parent_node
+            ancestors.append(category)
+        return ancestors[::-1]
+
+
+def load_tree(queryset=None):
+    """Builds a fresh tree from one query; pass an annotated queryset to carry extra columns."""
+    if queryset is None:
+        queryset = Category.objects.all()
+    return CategoryTree(queryset.order_by('path'))
+
+
+def get_tree():
+    """Returns this process's cached tree, reloading it when the shared version changed."""
+    global _cached
+    version = cache.get(VERSION_KEY, 0)
+    if _cached is not None:
+        cached_version, loaded_at, tree = _cached
+        if cached_version == version and time.monotonic() - loaded_at < CATEGORY_TREE_TTL:
+            return tree
+    tree = load_tree()
+    _cached = (version, time.monotonic(), tree)
+    return tree
+
+
+def invalidate_tree():
+    global _cached
+    _cached = None
+    # A timestamp rather than incr(): an evicted key can never come back as an old version.
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
@@ -0,0 +1,64 @@
+from decimal import Decimal
+
+from django.db import transaction as django_db_transaction
+from django.utils import timezone
+
+from .models import Product, Order, OrderItem, OrderTimeline
+from . import inventory
+from .inventory import InsufficientStock
+
+
+def merge_order_lines(items_data):
+    """
+    Collapses cart lines into {product_id: quantity}.
+    OrderItem is unique per (order, product), so repeated lines for the same product are summed.
+    """
+    quantities = {}
+    for item_data in items_data:
+        product_id = item_data['product'].pk
+        quantities[product_id] = quantities.get(product_id, 0) + item_data['quantity']
+    return quantities
+
+
+def place_order(items_data, user=None, reservation_ids=None, **order_fields):
+    """
+    Creates an order and its items in one atomic block.
+
+    The round-trips are fixed regardless of cart size: one locking SELECT of the products,
+    one conditional UPDATE taking the stock (see inventory.take_stock), one INSERT for the order
+    (totals are computed in memory beforehand), one bulk INSERT for the items and one INSERT for
+    the timeline event. Stock already held through reservation_ids is consumed instead of taken
+    again. Raises InsufficientStock (and rolls everything back) if any line cannot be served.
+    """
+    quantities = merge_order_lines(items_data)
+
+    with django_db_transaction.atomic():
+        products = Product.objects.select_for_update().only('id', 'name', 'price', 'available').in_bulk(list(quantities))
+        for product_id in quantities:
+            product = products.get(product_id)
+            if product is None or not product.available:
+                raise InsufficientStock(f"Product '{product.name if product else product_id}' is not available.")
+
+        # One clock for reading and consuming the holds: one expiring in between is either
+        # counted and committed, or neither.
+        now = timezone.now()
+        held = inventory.held_quantities(reservation_ids, user=user, now=now) if reservation_ids else {}
+        inventory.take_stock({product_id: quantity - held.get(product_id, 0) for product_id, quantity in quantities.items()})
+        # Held units the cart no longer needs go back on the shelf.
+        inventory.return_stock({product_id: quantity - quantities.get(product_id, 0) for product_id, quantity in held.items()})
+
+        subtotal = sum((products[product_id].price * quantity for product_id, quantity in quantities.items()), Decimal('0.00'))
+        order = Order.objects.create(
+            user=user,
+            subtotal_amount=subtotal,
+            total_amount=subtotal, # Assuming no discount initially
+            **order_fields
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=products[product_id], quantity=quantity, price_at_purchase=products[product_id].price)
+            for product_id, quantity in quantities.items()
+        ])
+        if held:
+            inventory.commit(reservation_ids, user, order=order, now=now)
+        OrderTimeline.objects.create(order=order, note="Order created.", user_triggered=user, status_changed_to=order.status)
+    return order
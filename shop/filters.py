@@ -0,0 +1,68 @@
+import django_filters
+from django.db.models import Count, Exists, F, OuterRef
+
+from .models import Product, ProductAttribute
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+class ProductSearchFilterSet(django_filters.FilterSet):
+    """
+    Product search filters. Attribute filters use EXISTS subqueries instead of JOINs,
+    so a product matching several attributes is returned once.
+
+    ?attr=Color:Red,Color:Blue,Size:XL matches products that are (Red or Blue) and XL.
+    """
+    attributes__name = django_filters.CharFilter(method='filter_attribute_name')
+    attributes__value = django_filters.CharFilter(method='filter_attribute_value')
+    attr = CharInFilter(method='filter_attr', label="Comma separated Name:Value pairs")
+
+    class Meta:
+        model = Product
+        fields = {
+            'category__slug': ['exact'],
+            'price': ['gte', 'lte'],
+            'available': ['exact'],
+        }
+
+    @staticmethod
+    def _has_attribute(**lookups):
+        return Exists(ProductAttribute.objects.filter(product=OuterRef('pk'), **lookups))
+
+    def filter_attribute_name(self, queryset, name, value):
+        return queryset.filter(self._has_attribute(name=value))
+
+    def filter_attribute_value(self, queryset, name, value):
+        return queryset.filter(self._has_attribute(value=value))
+
+    def filter_attr(self, queryset, name, value):
+        wanted = {}
+        for pair in value:
+            attr_name, sep, attr_value = pair.partition(':')
+            if sep:
+                wanted.setdefault(attr_name.strip(), []).append(attr_value.strip())
+        for attr_name, values in wanted.items():
+            queryset = queryset.filter(self._has_attribute(name=attr_name, value__in=values))
+        return queryset
+
+
+def attribute_facets(queryset):
+    """
+    Returns {attribute name: [{'value': ..., 'count': ...}, ...]} for the products in queryset,
+    most common values first, computed with one grouped COUNT over the products' attributes.
+    """
+    # Grouped from the product side rather than as a product__in subquery: the full-text
+    # search filter adds raw SQL naming shop_product, which would not resolve inside a subquery.
+    rows = (
+        queryset.order_by()
+        .filter(attributes__isnull=False)
+        .values(attr_name=F('attributes__name'), attr_value=F('attributes__value'))
+        .annotate(count=Count('pk'))
+        .order_by('attr_name', '-count', 'attr_value')
+    )
+    facets = {}
+    for row in rows:
+        facets.setdefault(row['attr_name'], []).append({'value': row['attr_value'], 'count': row['count']})
+    return facets
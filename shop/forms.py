@@ -25,23 +25,11 @@ class CategoryForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         # To prevent a category from being its own parent or a child of its descendants
         if self.instance and self.instance.pk:
-            # Get all descendants of the current category instance
-            descendants = self._get_all_descendants(self.instance)
-            # Exclude the instance itself and its descendants from the parent choices
-            self.fields['parent'].queryset = Category.objects.exclude(
-                pk__in=[self.instance.pk] + [desc.pk for desc in descendants]
-            )
+            # Exclude the instance itself and its descendants (one path range) from the parent choices
+            self.fields['parent'].queryset = Category.objects.exclude(self.instance.subtree_q())
         else:
             # For new categories, no instance yet, so all categories are valid parents
             self.fields['parent'].queryset = Category.objects.all()
-            
-    def _get_all_descendants(self, category):
-        descendants = []
-        children = category.children.all()
-        for child in children:
-            descendants.append(child)
-            descendants.extend(self._get_all_descendants(child))
-        return descendants
 
 
 class ProductForm(forms.ModelForm):
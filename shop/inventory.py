@@ -0,0 +1,140 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as django_db_transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+
+from . import product_cache
+from .models import Product, StockReservation
+
+
+# How long an unconfirmed hold keeps stock out of circulation before expire_holds() returns it.
+DEFAULT_HOLD_TTL = timedelta(minutes=15)
+
+
+class InsufficientStock(Exception):
+    """Raised when a stock change cannot be served from current stock."""
+
+
+def get_hold_ttl():
+    return getattr(settings, 'SHOP_STOCK_HOLD_TTL', DEFAULT_HOLD_TTL)
+
+
+def _stock_case(quantities, sign):
+    return Case(*[
+        When(pk=product_id, then=F('stock') + sign * quantity)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def take_stock(quantities):
+    """
+    Decrements stock for {product_id: quantity} with a single conditional UPDATE.
+
+    A row only matches while it still has enough stock, so two concurrent callers can never
+    both take the last unit. If any product is short, nothing is taken and InsufficientStock
+    is raised.
+    """
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    in_stock = Q()
+    for product_id, quantity in quantities.items():
+        in_stock |= Q(pk=product_id, stock__gte=quantity)
+    try:
+        with django_db_transaction.atomic():
+            updated = Product.objects.filter(in_stock).update(stock=_stock_case(quantities, -1), updated_at=timezone.now())
+            if updated != len(quantities):
+                raise InsufficientStock("Not enough stock.")
+            product_cache.invalidate(quantities) # stock is part of the cached product detail
+    except InsufficientStock:
+        # Slow path only: the partial update is rolled back, report the first short product.
+        for product_id, name, stock in Product.objects.filter(pk__in=list(quantities)).values_list('pk', 'name', 'stock'):
+            if stock < quantities[product_id]:
+                raise InsufficientStock(f"Not enough stock for product '{name}'. Available: {stock}, Requested: {quantities[product_id]}.")
+        raise
+
+
+def return_stock(quantities):
+    """Increments stock for {product_id: quantity} with a single UPDATE."""
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return 0
+    product_cache.invalidate(quantities)
+    return Product.objects.filter(pk__in=list(quantities)).update(stock=_stock_case(quantities, 1), updated_at=timezone.now())
+
+
+def hold(quantities, user=None, ttl=None):
+    """
+    Takes stock for {product_id: quantity} and records one held reservation per product.
+    Holds that are neither committed nor released are returned to stock by expire_holds().
+    """
+    expires_at = timezone.now() + (ttl if ttl is not None else get_hold_ttl())
+    with django_db_transaction.atomic():
+        take_stock(quantities)
+        return StockReservation.objects.bulk_create([
+            StockReservation(product_id=product_id, user=user, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items() if quantity > 0
+        ])
+
+
+def _live_holds(reservation_ids, user, now=None):
+    return StockReservation.objects.filter(
+        pk__in=reservation_ids, user=user, status='held', expires_at__gt=now or timezone.now()
+    )
+
+
+def held_quantities(reservation_ids, user, now=None):
+    """
+    Returns {product_id: quantity} for the user's live holds among reservation_ids, locking them.
+    Pass the same `now` to commit() so it consumes exactly the holds counted here.
+    """
+    reservations = _live_holds(reservation_ids, user, now).select_for_update()
+    quantities = {}
+    for product_id, quantity in reservations.values_list('product_id', 'quantity'):
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def commit(reservation_ids, user, order=None, now=None):
+    """Marks the user's live holds as consumed (optionally by an order). Stock stays taken."""
+    now = now or timezone.now()
+    return _live_holds(reservation_ids, user, now).update(status='committed', order=order, updated_at=now)
+
+
+def _return_holds(reservations, new_status):
+    with django_db_transaction.atomic():
+        rows = list(reservations.select_for_update().filter(status='held').values_list('pk', 'product_id', 'quantity'))
+        if not rows:
+            return 0
+        quantities = {}
+        for _, product_id, quantity in rows:
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows], status='held').update(
+            status=new_status, updated_at=timezone.now()
+        )
+        return_stock(quantities)
+        return len(rows)
+
+
+def release(reservation_ids, user=None):
+    """Returns held stock to the shelf. Committed or already released holds are left alone."""
+    reservations = StockReservation.objects.filter(pk__in=reservation_ids)
+    if user is not None:
+        reservations = reservations.filter(user=user)
+    return _return_holds(reservations, 'released')
+
+
+def expire_holds(now=None, batch_size=1000):
+    """Returns the stock of abandoned holds in batches. Returns the number of holds expired."""
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(status='held', expires_at__lte=now)
+            .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return expired
+        expired += _return_holds(StockReservation.objects.filter(pk__in=batch), 'expired')
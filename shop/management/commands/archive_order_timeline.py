@@ -0,0 +1,29 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from shop import timeline
+
+
+class Command(BaseCommand):
+    help = (
+        "Compacts order timeline events older than --days into one compressed archive blob per "
+        "order, --batch-size orders per transaction. Archived events still show in order timelines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=180, help="Archive events older than this many days.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders archived per transaction.")
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError("--days must be at least 1.")
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        started = time.monotonic()
+        orders, events = timeline.archive_events(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {events} timeline events of {orders} orders older than {before:%Y-%m-%d %H:%M} "
+            f"in {time.monotonic() - started:.1f}s."
+        ))
@@ -0,0 +1,52 @@
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.test.utils import CaptureQueriesContext
+
+from core.benchmarks import BenchmarkCommand, bulk_create, create_catalog, timed, words
+from shop.filters import attribute_facets
+from shop.models import Product, ProductAttribute
+
+
+ATTRIBUTES = ('Color', 'Size', 'Material', 'Brand')
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Times the attribute facets of the whole catalog (--products products with one value of "
+        "each of 4 attributes) as one grouped COUNT, and as one COUNT per attribute value."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--products', type=int, default=20000)
+        parser.add_argument('--values', type=int, default=300, help="Distinct values per attribute.")
+
+    def run(self, **options):
+        self.step(f"Creating {options['products']} products...")
+        product_ids = create_catalog(self.rng, options['products'])
+        values = {name: words(self.rng, options['values']) for name in ATTRIBUTES}
+        bulk_create(ProductAttribute, (
+            ProductAttribute(product_id=product_id, name=name, value=self.rng.choice(values[name]))
+            for product_id in product_ids for name in ATTRIBUTES
+        ))
+        queryset = Product.objects.filter(available=True)
+
+        with CaptureQueriesContext(connection) as grouped:
+            facets, (grouped_ms,) = timed(lambda: attribute_facets(queryset))
+
+        def count_each_value():
+            counts = {}
+            pairs = ProductAttribute.objects.order_by('name', 'value').values_list('name', 'value').distinct()
+            for name, value in pairs:
+                has_value = ProductAttribute.objects.filter(product=OuterRef('pk'), name=name, value=value)
+                counts[(name, value)] = queryset.filter(Exists(has_value)).count()
+            return counts
+
+        with CaptureQueriesContext(connection) as separate:
+            counts, (separate_ms,) = timed(count_each_value)
+
+        matches = counts == {(name, row['value']): row['count'] for name, rows in facets.items() for row in rows}
+        self.report("attribute values", len(counts))
+        self.report("grouped COUNT (attribute_facets)", f"{grouped_ms:.0f} ms / {len(grouped)} queries")
+        self.report("one COUNT per value", f"{separate_ms:.0f} ms / {len(separate)} queries")
+        self.report("same counts", matches)
@@ -0,0 +1,94 @@
+import statistics
+from decimal import Decimal
+
+from django.db.models import Count
+
+from core.benchmarks import BenchmarkCommand, bulk_create, timed
+from shop import categories
+from shop.models import Category, Product
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Builds a tree of --categories categories (--roots roots, at most --max-depth levels) "
+        "holding --products products, then times the products of the largest subtree and the "
+        "tree with product counts, recursively and through Category.path, the cached tree's "
+        "descendant ids and moving a large subtree."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--categories', type=int, default=10000)
+        parser.add_argument('--roots', type=int, default=10)
+        parser.add_argument('--max-depth', type=int, default=20)
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--repeat', type=int, default=5, help="Runs of the fast figures; the median is shown.")
+
+    def run(self, **options):
+        self.step(f"Creating {options['categories']} categories and {options['products']} products...")
+        self.create_tree(options['categories'], options['roots'], options['max_depth'])
+        category_ids = list(Category.objects.values_list('pk', flat=True))
+        bulk_create(Product, (
+            Product(
+                category_id=self.rng.choice(category_ids), slug=f'bench-product-{i}', name=f'Bench product {i}',
+                price=Decimal(self.rng.randint(100, 20000)) / 100, stock=1000, available=True,
+            )
+            for i in range(options['products'])
+        ))
+
+        roots = Category.objects.filter(parent=None)
+        sizes = {root.pk: Category.objects.filter(root.subtree_q()).count() for root in roots}
+        largest = Category.objects.get(pk=max(sizes, key=sizes.get))
+        self.report("tree", f"{len(category_ids)} categories, depth {Category.objects.order_by('-depth').values_list('depth', flat=True)[0] + 1}, largest root subtree {sizes[largest.pk]}")
+
+        recursive, (recursive_ms,) = timed(lambda: self.recursive_subtree_products(largest))
+        by_path, path_ms = timed(lambda: list(Product.objects.filter(largest.subtree_q('category__')).values_list('pk', flat=True)), options['repeat'])
+        self.report(f"products of the largest subtree ({len(by_path)})", f"recursive {recursive_ms / 1000:.1f} s, path range {statistics.median(path_ms):.0f} ms")
+        if sorted(recursive) != sorted(by_path):
+            self.report("subtree products MISMATCH", f"{len(recursive)} recursive vs {len(by_path)} by path")
+
+        counted, (per_row_ms,) = timed(self.counts_per_row)
+        tree, one_query_ms = timed(lambda: categories.load_tree(Category.objects.annotate(product_count=Count('products'))), options['repeat'])
+        same = counted == {category.pk: category.product_count for category in tree.walk()}
+        self.report("tree with product counts", f"per row {per_row_ms / 1000:.1f} s, one query {statistics.median(one_query_ms):.0f} ms (same counts: {same})")
+
+        categories.get_tree() # loaded once per process
+        _, cached_ms = timed(lambda: categories.get_tree().descendant_ids(largest.pk), options['repeat'])
+        self.report("cached tree descendant ids", f"{statistics.median(cached_ms):.1f} ms")
+
+        # The biggest subtree below the largest root, moved under another root.
+        children = Category.objects.filter(parent=largest)
+        moved = max(children, key=lambda child: Category.objects.filter(child.subtree_q()).count())
+        moved_size = Category.objects.filter(moved.subtree_q()).count()
+        moved.parent = roots.exclude(pk=largest.pk).first()
+        _, (move_ms,) = timed(moved.save)
+        self.report(f"moving a {moved_size}-category subtree", f"{move_ms:.0f} ms")
+
+    def create_tree(self, count, roots, max_depth):
+        """Bulk-inserts the categories with their paths, each under a random earlier one not at max_depth."""
+        step = Category.PATH_STEP
+        rows, paths, open_parents = [], {}, []
+        for pk in range(1, count + 1):
+            parent_id = self.rng.choice(open_parents) if pk > roots else None
+            path = f"{paths.get(parent_id, '')}{pk:0{step}d}/"
+            paths[pk] = path
+            depth = path.count('/') - 1
+            if depth < max_depth - 1:
+                open_parents.append(pk)
+            rows.append(Category(pk=pk, name=f'Bench category {pk}', slug=f'bench-category-{pk}', parent_id=parent_id, path=path, depth=depth))
+        bulk_create(Category, rows)
+
+    @staticmethod
+    def recursive_subtree_products(category):
+        """The way products_in_category worked before Category.path: one query per category."""
+        ids, stack = [], [category]
+        while stack:
+            current = stack.pop()
+            ids.append(current.pk)
+            stack.extend(current.children.all())
+        return list(Product.objects.filter(category_id__in=ids).values_list('pk', flat=True))
+
+    @staticmethod
+    def counts_per_row():
+        """The way the staff category list counted products before: one COUNT per category."""
+        return {category.pk: category.products.count() for category in Category.objects.all()}
@@ -0,0 +1,48 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core.benchmarks import BenchmarkCommand, create_catalog
+from shop import serializers
+from shop.checkout import place_order
+
+
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Counts the SQL statements of one checkout (POST /api/shop/orders/) for a cart of "
+        "--lines products: the whole request, and place_order on its own."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--lines', type=int, default=30, help="Distinct products in the cart.")
+
+    def run(self, **options):
+        product_ids = create_catalog(self.rng, options['lines'], categories=5)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('bench-checkout'))
+        payload = {'email': 'bench@example.com', 'items': [{'product': pk, 'quantity': 1} for pk in product_ids]}
+
+        create_step = CaptureQueriesContext(connection)
+
+        def capture_place_order(*args, **kwargs):
+            with create_step:
+                return place_order(*args, **kwargs)
+
+        with mock.patch.object(serializers, 'place_order', capture_place_order), CaptureQueriesContext(connection) as request:
+            response = client.post('/api/shop/orders/', payload, format='json')
+        if response.status_code != 201:
+            self.stderr.write(f"Checkout failed: {response.status_code} {response.content[:200]!r}")
+            return
+
+        self.report("cart lines", options['lines'])
+        for label, captured in (("whole request", request), ("place_order", create_step)):
+            statements = [query['sql'] for query in captured.captured_queries]
+            data = [sql for sql in statements if not sql.startswith(TRANSACTION_CONTROL)]
+            self.report(f"statements, {label}", f"{len(statements)} ({len(data)} without transaction control)")
@@ -0,0 +1,70 @@
+from django.db import connection
+from django.db import transaction as django_db_transaction
+from django.utils import timezone
+
+from core.benchmarks import BenchmarkCommand, QueryCounter, create_catalog, create_orders, timed
+from dashboard import rollups
+from dashboard.models import DailyCategorySales, DailyProductSales
+from shop import inventory, transitions
+from shop.models import Order, OrderTimeline
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Moves --orders orders of 3 lines to processing and then to cancelled, one order at a time "
+        "(save, timeline row, restock) and with transitions.transition_orders(), and checks the "
+        "sales rollups against a rebuild."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--products', type=int, default=2000)
+
+    def run(self, **options):
+        self.step(f"Creating 2 x {options['orders']} orders...")
+        product_ids = create_catalog(self.rng, options['products'], description_words=4)
+        one_by_one = self.order_numbers(create_orders(self.rng, options['orders'], product_ids, prefix='ONE'))
+        bulk = self.order_numbers(create_orders(self.rng, options['orders'], product_ids, prefix='BULK'))
+
+        for to_status in ('processing', 'cancelled'):
+            self.step(f"-> {to_status}...")
+            single_queries, bulk_queries = QueryCounter(), QueryCounter()
+            with connection.execute_wrapper(single_queries):
+                _, (single_ms,) = timed(lambda: [self.transition_one(number, to_status) for number in one_by_one])
+            with connection.execute_wrapper(bulk_queries):
+                outcomes, (bulk_ms,) = timed(lambda: transitions.transition_orders(bulk, to_status))
+            moved = sum(outcome['result'] == transitions.UPDATED for outcome in outcomes)
+            self.report(
+                f"-> {to_status}",
+                f"one by one {single_ms / 1000:.1f} s ({single_queries.count} queries), "
+                f"bulk {bulk_ms / 1000:.1f} s ({bulk_queries.count} queries, {moved} moved)",
+            )
+            fed = self.rollup_rows()
+            rollups.rebuild_day(timezone.localdate())
+            self.report(f"-> {to_status}: rollups match a rebuild", fed == self.rollup_rows())
+
+    @staticmethod
+    def order_numbers(order_ids):
+        return list(Order.objects.filter(pk__in=order_ids).order_by('pk').values_list('order_number', flat=True))
+
+    @staticmethod
+    @django_db_transaction.atomic
+    def transition_one(order_number, to_status):
+        """The way a single order moves without transitions.py: save, timeline row and restock."""
+        order = Order.objects.select_for_update().get(order_number=order_number)
+        from_status = order.status
+        order.status = to_status
+        order.save()
+        OrderTimeline.objects.create(order=order, status_changed_to=to_status, note=f'Order status changed from {from_status} to {to_status}.')
+        if to_status == 'cancelled':
+            for item in order.items.all():
+                inventory.return_stock({item.product_id: item.quantity})
+
+    @staticmethod
+    def rollup_rows():
+        # The feed leaves rows at zero where a rebuild writes none.
+        return [
+            sorted(row for row in model.objects.values_list('day', key, 'units', 'gross', 'discounts', 'refunds') if any(row[2:]))
+            for model, key in ((DailyProductSales, 'product_id'), (DailyCategorySales, 'category_id'))
+        ]
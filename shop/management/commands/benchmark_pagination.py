@@ -0,0 +1,52 @@
+import statistics
+
+from django.test import RequestFactory
+
+from core.benchmarks import BenchmarkCommand, create_catalog, timed
+from core.pagination import KeysetPagination
+from shop.models import Product
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Times one page of products (newest first) at the start, middle and end of a catalog of "
+        "--products products, with OFFSET and with KeysetPagination. Medians of --repeat runs."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--products', type=int, default=200000)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def run(self, **options):
+        self.step(f"Creating {options['products']} products...")
+        create_catalog(self.rng, options['products'], description_words=4)
+        page_size = options['page_size']
+        ordered = Product.objects.order_by('-created_at', '-id')
+        total = ordered.count()
+        factory = RequestFactory()
+
+        for position in (0, total // 2, total - page_size):
+            def offset_page():
+                return list(ordered[position:position + page_size])
+
+            params = {'page_size': page_size}
+            if position:
+                paginator = KeysetPagination()
+                paginator.keys = paginator.get_keys(Product.objects.all(), factory.get('/'), None)
+                before = ordered.values_list('created_at', 'id')[position - 1]
+                params['cursor'] = paginator.encode_cursor(list(before), False)
+            request = factory.get('/', params)
+
+            def keyset_page():
+                return KeysetPagination().paginate_queryset(Product.objects.all(), request)
+
+            offset_rows, offset_ms = timed(offset_page, options['repeat'])
+            keyset_rows, keyset_ms = timed(keyset_page, options['repeat'])
+            same = [row.pk for row in offset_rows] == [row.pk for row in keyset_rows]
+            self.report(
+                f"row {position}",
+                f"OFFSET {statistics.median(offset_ms):.1f} ms  keyset {statistics.median(keyset_ms):.1f} ms"
+                f"{'' if same else '  (pages differ!)'}",
+            )
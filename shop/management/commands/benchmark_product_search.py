@@ -0,0 +1,41 @@
+from shop import search
+from shop.models import Product
+
+from core.benchmarks import BenchmarkCommand, create_catalog, describe, timed, words
+
+
+class Command(BenchmarkCommand):
+    help = (
+        "Times --queries random two-word product searches (first 20 ids) against the search "
+        "index backend and against the icontains scan it replaced."
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--queries', type=int, default=60)
+
+    def run(self, **options):
+        vocabulary = words(self.rng, 2000)
+        self.step(f"Creating {options['products']} products...")
+        create_catalog(self.rng, options['products'], vocabulary=vocabulary)
+        backend = search.get_backend()
+        indexed, durations = timed(backend.rebuild)
+        self.report("products indexed", f"{indexed} in {durations[0] / 1000:.1f} s")
+
+        queries = [' '.join(self.rng.sample(vocabulary, 2)) for _ in range(options['queries'])]
+        backends = [(type(backend).__name__, backend)]
+        if not isinstance(backend, search.LikeSearchBackend):
+            backends.append(('LikeSearchBackend (icontains)', search.LikeSearchBackend()))
+        for name, candidate in backends:
+            def first_page(query, candidate=candidate):
+                return list(candidate.filter(Product.objects.all(), query).values_list('pk', flat=True)[:20])
+
+            first_page(queries[0]) # warm the page cache
+            durations = []
+            hits = 0
+            for query in queries:
+                ids, (duration,) = timed(lambda: first_page(query))
+                durations.append(duration)
+                hits += bool(ids)
+            self.report(name, f"{describe(durations)} ({hits}/{len(queries)} queries with hits)")
@@ -0,0 +1,78 @@
+import csv
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.models import Product, ProductAttribute
+
+
+FIELDS = ['slug', 'name', 'category', 'description', 'price', 'stock', 'available', 'attributes']
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams the product catalog to CSV or JSONL in the format catalog_import reads. "
+        "Products are read in pk-ordered chunks (plus one attribute query per chunk), "
+        "so memory stays flat for any catalog size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', '-o', help="Output file. Defaults to stdout.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Products fetched per round-trip.")
+
+    def handle(self, *args, **options):
+        out = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        started = time.monotonic()
+        count = 0
+        try:
+            if options['format'] == 'jsonl':
+                for row in self.iter_rows(options['chunk_size']):
+                    out.write(json.dumps(row) + '\n')
+                    count += 1
+            else:
+                writer = csv.DictWriter(out, fieldnames=FIELDS)
+                writer.writeheader()
+                for row in self.iter_rows(options['chunk_size']):
+                    row['attributes'] = '|'.join(f"{attr['name']}:{attr['value']}" for attr in row['attributes'])
+                    writer.writerow(row)
+                    count += 1
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed else count
+        self.stderr.write(self.style.SUCCESS(f"Exported {count} products in {elapsed:.1f}s, {rate:.0f} rows/s."))
+
+    def iter_rows(self, chunk_size):
+        products = Product.objects.order_by('pk').values_list(
+            'pk', 'slug', 'name', 'category__slug', 'description', 'price', 'stock', 'available'
+        )
+        last_pk = 0
+        while True:
+            chunk = list(products.filter(pk__gt=last_pk)[:chunk_size])
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+
+            attributes = {}
+            for product_id, name, value in (
+                ProductAttribute.objects.filter(product_id__in=[row[0] for row in chunk])
+                .order_by('product_id', 'name', 'value').values_list('product_id', 'name', 'value')
+            ):
+                attributes.setdefault(product_id, []).append({'name': name, 'value': value})
+
+            for pk, slug, name, category, description, price, stock, available in chunk:
+                yield {
+                    'slug': slug,
+                    'name': name,
+                    'category': category,
+                    'description': description,
+                    'price': str(price),
+                    'stock': stock,
+                    'available': available,
+                    'attributes': attributes.get(pk, []),
+                }
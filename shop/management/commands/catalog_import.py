@@ -0,0 +1,193 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as django_db_transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from core import conditional
+from core.slugs import SUFFIX_RESERVE, allocate_slugs
+from shop import product_cache, search
+from shop.models import Category, Product, ProductAttribute
+
+
+UPDATE_FIELDS = ['category', 'name', 'description', 'price', 'stock', 'available', 'updated_at']
+
+
+def read_rows(path, fmt):
+    """
+    Yields one dict per product row. CSV attributes use 'Name:Value|Name:Value'; an empty cell
+    gives None (attributes left alone), like a JSONL row without the key.
+    """
+    with open(path, newline='', encoding='utf-8') as fh:
+        if fmt == 'jsonl':
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(fh):
+                attributes = (row.get('attributes') or '').strip()
+                row['attributes'] = [
+                    {'name': pair.split(':', 1)[0].strip(), 'value': pair.split(':', 1)[1].strip()}
+                    for pair in attributes.split('|') if ':' in pair
+                ] if attributes else None
+                yield row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+class Command(BaseCommand):
+    help = (
+        "Streams a CSV or JSONL product feed into the catalog in chunks, upserting by slug with "
+        "bulk_create(update_conflicts=True). A row without a slug updates the oldest product with the same name, "
+        "or is created with a unique slug derived from the name. If a row carries 'attributes', they replace the "
+        "product's existing attributes (an empty CSV cell leaves them alone; [] in JSONL removes them)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Feed file (.csv or .jsonl).")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=1000, help="Rows written per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        created = updated = skipped = 0
+        started = time.monotonic()
+
+        try:
+            for chunk in chunked(read_rows(path, fmt), options['chunk_size']):
+                chunk_created, chunk_updated, chunk_skipped = self.import_chunk(chunk)
+                created += chunk_created
+                updated += chunk_updated
+                skipped += chunk_skipped
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{created + updated + skipped} rows processed...")
+        except OSError as e:
+            raise CommandError(f"Cannot read '{path}': {e}")
+
+        elapsed = time.monotonic() - started
+        total = created + updated + skipped
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {total} rows ({created} created, {updated} updated, {skipped} skipped) "
+            f"in {elapsed:.1f}s, {rate:.0f} rows/s."
+        ))
+
+    def import_chunk(self, rows):
+        skipped = 0
+        by_slug, unslugged_rows = {}, {}
+        for row in rows:
+            product = self.build_product(row)
+            if product is None:
+                skipped += 1
+            elif product.slug:
+                if product.slug in by_slug:
+                    skipped += 1 # The last row for a slug wins
+                by_slug[product.slug] = (product, row.get('attributes'))
+            else:
+                if product.name in unslugged_rows:
+                    skipped += 1 # The last row for a name wins
+                unslugged_rows[product.name] = (product, row.get('attributes'))
+
+        with django_db_transaction.atomic():
+            # Rows without a slug update the product a previous import created for the name, so
+            # re-importing the feed does not create 'name-2', 'name-3'... every run.
+            existing = {}
+            for name, slug in self.named_products(unslugged_rows):
+                existing.setdefault(name, slug)
+            unslugged = []
+            for name, (product, attributes) in unslugged_rows.items():
+                if name in existing and existing[name] not in by_slug:
+                    product.slug = existing[name]
+                    by_slug[product.slug] = (product, attributes)
+                elif name in existing:
+                    skipped += 1 # The row naming that slug wins
+                else:
+                    unslugged.append((product, attributes))
+            parsed = list(by_slug.values()) + unslugged
+
+            updated = Product.objects.filter(slug__in=list(by_slug)).count()
+
+            new_slugs = allocate_slugs(Product, [slugify(p.name) for p, _ in unslugged], reserved=by_slug.keys())
+            for (product, _), slug in zip(unslugged, new_slugs):
+                product.slug = slug
+
+            # One INSERT ... ON CONFLICT (slug) DO UPDATE per batch; pks are set on every object,
+            # including the ones that already existed. created_at/created_by are left untouched.
+            Product.objects.bulk_create(
+                [p for p, _ in parsed],
+                update_conflicts=True,
+                unique_fields=['slug'],
+                update_fields=UPDATE_FIELDS,
+            )
+
+            # Attributes: one DELETE and one bulk INSERT for the whole chunk.
+            with_attributes = [(p, attrs) for p, attrs in parsed if attrs is not None]
+            if with_attributes:
+                ProductAttribute.objects.filter(product__in=[p.pk for p, _ in with_attributes]).delete()
+                ProductAttribute.objects.bulk_create([
+                    ProductAttribute(product_id=p.pk, name=attr['name'], value=attr['value'])
+                    for p, attrs in with_attributes for attr in attrs
+                ], ignore_conflicts=True)
+
+            # bulk_create bypasses the post_save signals that maintain the search index, product
+            # cache and the product lists' change marker.
+            search.get_backend().index_products([p.pk for p, _ in parsed])
+            product_cache.invalidate([p.pk for p, _ in parsed])
+            conditional.touch(Product)
+
+        return len(parsed) - updated, updated, skipped
+
+    @staticmethod
+    def named_products(names):
+        """(name, slug) of the products with these names, oldest first, found through the slugs allocated for them."""
+        if not names:
+            return []
+        max_length = Product._meta.get_field('slug').max_length - SUFFIX_RESERVE
+        slugs = Q()
+        for base in {slugify(name)[:max_length].strip('-') for name in names}:
+            slugs |= Q(slug=base) | Q(slug__startswith=f'{base}-')
+        return Product.objects.filter(slugs, name__in=list(names)).order_by('pk').values_list('name', 'slug')
+
+    def build_product(self, row):
+        category_id = self.categories.get((row.get('category') or '').strip())
+        name = (row.get('name') or '').strip()
+        if not category_id or not name:
+            self.stderr.write(f"Skipping row without a known category or name: {row.get('slug') or name!r}")
+            return None
+        try:
+            price = Decimal(str(row.get('price', '0')))
+            stock = int(row.get('stock') or 0)
+        except (InvalidOperation, ValueError):
+            self.stderr.write(f"Skipping row with invalid price/stock: {row.get('slug') or name!r}")
+            return None
+        return Product(
+            category_id=category_id,
+            name=name,
+            slug=(row.get('slug') or '').strip(),
+            description=row.get('description') or '',
+            price=price,
+            stock=max(stock, 0),
+            available=parse_bool(row.get('available', True)),
+            updated_at=timezone.now(),
+        )
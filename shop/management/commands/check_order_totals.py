@@ -0,0 +1,66 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from shop.models import Order, OrderItem, orders_updated
+
+
+CENT = Decimal('0.01')
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes order totals from their items in batches and reports orders whose stored "
+        "subtotal/total drifted from the items. Use --fix to write the recomputed values back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Orders checked per query.")
+        parser.add_argument('--fix', action='store_true', help="Rewrite drifted totals with bulk_update.")
+        parser.add_argument('--show', type=int, default=20, help="How many drifted orders to list.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # One aggregate per batch: each order's item sum as a correlated subquery.
+        item_totals = (
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .order_by().values('order')
+            .annotate(subtotal=OrderItem.line_total_sum())
+            .values('subtotal')
+        )
+        orders = Order.objects.order_by('pk').annotate(computed_subtotal=Subquery(item_totals))
+
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                orders.filter(pk__gt=last_pk)
+                .values_list('pk', 'order_number', 'subtotal_amount', 'total_amount', 'discount_amount', 'created_at', 'computed_subtotal')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            checked += len(batch)
+
+            to_fix = []
+            for pk, order_number, subtotal, total, discount, created_at, computed in batch:
+                computed = Decimal(computed or 0).quantize(CENT)
+                expected_total = computed - discount
+                if subtotal == computed and total == expected_total:
+                    continue
+                drifted += 1
+                if drifted <= options['show']:
+                    self.stdout.write(
+                        f"{order_number}: subtotal {subtotal} -> {computed}, total {total} -> {expected_total}"
+                    )
+                to_fix.append(Order(pk=pk, subtotal_amount=computed, total_amount=expected_total, created_at=created_at))
+
+            if options['fix'] and to_fix:
+                Order.objects.bulk_update(to_fix, ['subtotal_amount', 'total_amount'])
+                orders_updated.send(sender=Order, created_at=[order.created_at for order in to_fix])
+
+        summary = f"Checked {checked} orders, {drifted} with drifted totals."
+        if options['fix'] and drifted:
+            summary += " Fixed."
+        self.stdout.write(self.style.WARNING(summary) if drifted and not options['fix'] else self.style.SUCCESS(summary))
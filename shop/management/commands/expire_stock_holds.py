@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop import inventory
+
+
+class Command(BaseCommand):
+    help = "Returns the stock of abandoned holds whose TTL has elapsed. Meant to run from cron every few minutes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Holds released per transaction.")
+
+    def handle(self, *args, **options):
+        expired = inventory.expire_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Expired {expired} stock holds."))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the product full-text search index from scratch in id-range batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Products indexed per statement.")
+
+    def handle(self, *args, **options):
+        backend = search.get_backend()
+        started = time.monotonic()
+        indexed = backend.rebuild(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} products with {type(backend).__name__} in {elapsed:.1f}s."
+        ))
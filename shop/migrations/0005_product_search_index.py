@@ -0,0 +1,59 @@
+from django.db import DatabaseError, migrations
+
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5("
+    "name, description, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+SQLITE_FILL = (
+    "INSERT INTO shop_product_fts (rowid, name, description, category) "
+    "SELECT p.id, p.name, p.description, c.name FROM shop_product p JOIN shop_category c ON c.id = p.category_id"
+)
+
+POSTGRES_CREATE = [
+    "CREATE TABLE IF NOT EXISTS shop_product_search ("
+    "product_id bigint PRIMARY KEY REFERENCES shop_product (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS shop_product_search_document_gin ON shop_product_search USING GIN (document)",
+]
+POSTGRES_FILL = (
+    "INSERT INTO shop_product_search (product_id, document) "
+    "SELECT p.id, setweight(to_tsvector('simple', p.name), 'A') || setweight(to_tsvector('simple', c.name), 'B') "
+    "|| setweight(to_tsvector('simple', p.description), 'C') "
+    "FROM shop_product p JOIN shop_category c ON c.id = p.category_id"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            try:
+                cursor.execute(SQLITE_CREATE)
+            except DatabaseError:
+                return # No FTS5 in this SQLite build: shop.search falls back to LIKE scans.
+            cursor.execute(SQLITE_FILL)
+        elif vendor == 'postgresql':
+            for statement in POSTGRES_CREATE:
+                cursor.execute(statement)
+            cursor.execute(POSTGRES_FILL)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute("DROP TABLE IF EXISTS shop_product_fts")
+        elif vendor == 'postgresql':
+            cursor.execute("DROP TABLE IF EXISTS shop_product_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_stockreservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
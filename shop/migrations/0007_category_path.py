@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:01
+
+from django.db import migrations, models
+
+
+PATH_STEP = 8
+
+
+def fill_category_paths(apps, schema_editor):
+    Category = apps.get_model('shop', 'Category')
+    children = {}
+    for pk, parent_id in Category.objects.values_list('pk', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+    # Walk down from the roots so every parent's path is known before its children's.
+    updates = []
+    stack = [(pk, '') for pk in children.get(None, [])]
+    while stack:
+        pk, parent_path = stack.pop()
+        path = f"{parent_path}{pk:0{PATH_STEP}d}/"
+        updates.append(Category(pk=pk, path=path, depth=path.count('/') - 1))
+        stack.extend((child, path) for child in children.get(pk, []))
+    Category.objects.bulk_update(updates, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_order_shop_order_created_8cea34_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_category_paths, migrations.RunPython.noop),
+    ]
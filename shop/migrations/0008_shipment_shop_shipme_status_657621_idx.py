@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_category_path'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shipment',
+            index=models.Index(fields=['status', 'created_at'], name='shop_shipme_status_657621_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_shipment_shop_shipme_status_657621_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderTimelineArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_event_at', models.DateTimeField()),
+                ('last_event_at', models.DateTimeField()),
+                ('last_event_id', models.BigIntegerField()),
+                ('event_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['order', 'last_event_at', 'last_event_id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='ordertimeline',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline_events', to='shop.order'),
+        ),
+        migrations.AddIndex(
+            model_name='ordertimeline',
+            index=models.Index(fields=['order', 'timestamp', 'id'], name='shop_ordert_order_i_665d82_idx'),
+        ),
+        migrations.AddField(
+            model_name='ordertimelinearchive',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='timeline_archives', to='shop.order'),
+        ),
+        migrations.AddIndex(
+            model_name='ordertimelinearchive',
+            index=models.Index(fields=['order', 'last_event_at', 'last_event_id'], name='shop_ordert_order_i_d2bac8_idx'),
+        ),
+    ]
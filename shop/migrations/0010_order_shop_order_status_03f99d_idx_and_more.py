@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_ordertimelinearchive_alter_ordertimeline_order_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='shop_order_status_03f99d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_at', 'id'], name='shop_order_user_id_7c9c17_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productattribute',
+            index=models.Index(fields=['name', 'value'], name='shop_produc_name_7820ee_idx'),
+        ),
+    ]
@@ -1,28 +1,88 @@
-from django.db import models
-from django.utils.text import slugify
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Concat, Length, Substr
 from django.contrib.auth.models import User
+from django.dispatch import Signal
+from django.utils import timezone
 
-class Category(models.Model):
+from core.slugs import UniqueSlugMixin
+
+
+# Sent after order totals or item quantities are written with queryset.update() or
+# bulk_update(), which skip the model signals, with created_at=[the orders' created_at].
+# The dashboard drops its cached buckets for those days (dashboard/signals.py).
+orders_updated = Signal()
+
+class Category(UniqueSlugMixin, models.Model):
     name = models.CharField(max_length=255, unique=True)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', null=True, blank=True, related_name='children', on_delete=models.CASCADE)
+    # Materialized path: the zero-padded ids from the root down to this category, e.g. '00000003/00000017/'.
+    # Maintained by save(); a subtree is the range [path, path with its last '/' replaced by '0').
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    PATH_STEP = 8
+
     class Meta:
         verbose_name_plural = 'Categories'
         ordering = ['name']
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self._sync_path()
+
+    def _sync_path(self):
+        paths = dict(Category.objects.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path'))
+        old_path = paths.get(self.pk, '')
+        parent_path = paths.get(self.parent_id, '') if self.parent_id else ''
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError("A category cannot be moved under itself or one of its subcategories.")
+        new_path = f"{parent_path}{self.pk:0{self.PATH_STEP}d}/"
+        new_depth = new_path.count('/') - 1
+        if new_path != old_path:
+            max_length = self._meta.get_field('path').max_length
+            deepest = len(new_path)
+            if old_path:
+                deepest += Category.objects.filter(subtree_q(old_path)).aggregate(n=models.Max(Length('path')))['n'] - len(old_path)
+            if deepest > max_length:
+                raise ValueError(f"Category tree too deep: paths are limited to {max_length // (self.PATH_STEP + 1)} levels.")
+            if old_path:
+                # Moved: rewrite the prefix of the whole subtree in one UPDATE.
+                old_depth = old_path.count('/') - 1
+                Category.objects.filter(subtree_q(old_path)).update(
+                    path=Concat(models.Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=models.F('depth') + (new_depth - old_depth),
+                )
+            else:
+                Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        self.path, self.depth = new_path, new_depth
+
+    def subtree_q(self, prefix=''):
+        """Q matching this category and its descendants; prefix e.g. 'category__' from Product."""
+        return subtree_q(self.path, prefix)
+
+    def get_descendants(self, include_self=False):
+        descendants = Category.objects.filter(self.subtree_q())
+        return descendants if include_self else descendants.exclude(pk=self.pk)
+
+    def get_ancestor_ids(self):
+        return [int(segment) for segment in self.path.split('/')[:-2]]
+
+
+def subtree_q(path, prefix=''):
+    # Every path starting with `path` sorts between it and the same string ending in '0' ('/' + 1),
+    # so the subtree is an indexed range scan rather than a LIKE.
+    return models.Q(**{f'{prefix}path__gte': path, f'{prefix}path__lt': path[:-1] + '0'})
+
+
+class Product(UniqueSlugMixin, models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
@@ -36,18 +96,9 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-created_at'] # Default ordering for products
-
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            # Create a unique slug if multiple products have the same name
-            base_slug = slugify(self.name)
-            slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
+        indexes = [
+            models.Index(fields=['created_at', 'id']), # keyset pagination (core.pagination)
+        ]
 
     def __str__(self):
         return self.name
@@ -69,6 +120,9 @@ class ProductAttribute(models.Model):
     class Meta:
         unique_together = ('product', 'name', 'value') # Ensures no duplicate attributes for the same product
         ordering = ['name', 'value']
+        indexes = [
+            models.Index(fields=['name', 'value']), # attribute filters and facets (shop.filters)
+        ]
 
 
     def __str__(self):
@@ -119,6 +173,11 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id']), # keyset pagination (core.pagination)
+            models.Index(fields=['status', 'created_at', 'id']), # ?status= lists, rollup rebuilds (dashboard.rollups)
+            models.Index(fields=['user', 'created_at', 'id']), # a customer's own orders, newest first
+        ]
 
     def save(self, *args, **kwargs):
         if not self.order_number:
@@ -132,13 +191,19 @@ class Order(models.Model):
     def __str__(self):
         return f"Order {self.order_number} by {self.user.username if self.user else self.email if self.email else 'Guest'}"
 
-    def update_totals(self):
-        """Recalculates subtotal and total amount based on order items."""
-        subtotal = sum(item.get_total_price() for item in self.items.all())
-        self.subtotal_amount = subtotal
-        # Assuming discount_amount is set elsewhere (e.g., when applying a coupon)
-        self.total_amount = self.subtotal_amount - self.discount_amount
-        self.save(update_fields=['subtotal_amount', 'total_amount'])
+    def apply_item_delta(self, amount):
+        """
+        Shifts subtotal and total by the value of an added/removed item line with a single UPDATE,
+        so editing one line of a large order does not rescan every item. Drifted totals are
+        recomputed from the items by the check_order_totals command.
+        """
+        Order.objects.filter(pk=self.pk).update(
+            subtotal_amount=models.F('subtotal_amount') + amount,
+            total_amount=models.F('total_amount') + amount,
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['subtotal_amount', 'total_amount', 'updated_at'])
+        orders_updated.send(sender=Order, created_at=[self.created_at])
 
 
 class OrderItem(models.Model):
@@ -154,19 +219,31 @@ class OrderItem(models.Model):
         if not self.pk: # If new item, set price_at_purchase
             self.price_at_purchase = self.product.price
         super().save(*args, **kwargs)
-        # After saving an item, update order totals and potentially inventory
-        # self.order.update_totals() # This can cause recursion if not handled carefully with signals
+        # Order totals are moved by the caller, with order.apply_item_delta().
 
     def get_total_price(self):
         return self.price_at_purchase * self.quantity
 
+    @staticmethod
+    def line_total_sum():
+        """Aggregate expression for the sum of price_at_purchase * quantity (0 when there are no items)."""
+        return Coalesce(
+            models.Sum(models.F('price_at_purchase') * models.F('quantity'), output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+            models.Value(0, output_field=models.DecimalField(max_digits=10, decimal_places=2)),
+        )
+
     def __str__(self):
         return f"{self.quantity} of {self.product.name} in Order {self.order.order_number}"
 
 
 # Order Timeline/History (Optional, for tracking status changes and notes)
 class OrderTimeline(models.Model):
-    order = models.ForeignKey(Order, related_name='timeline_events', on_delete=models.CASCADE)
+    """
+    Append-only: events are written once and never edited. Rows only leave the table through
+    shop/timeline.py's archival, which moves old events into OrderTimelineArchive blobs, so the
+    live table stays a recent, time-ordered tail that can be pruned or partitioned by id range.
+    """
+    order = models.ForeignKey(Order, related_name='timeline_events', on_delete=models.CASCADE, db_index=False) # led by the (order, timestamp) index
     timestamp = models.DateTimeField(auto_now_add=True)
     status_changed_to = models.CharField(max_length=50, blank=True, null=True) # e.g., 'shipped'
     note = models.TextField(blank=True, null=True) # e.g., "Payment received", "Coupon XYZ applied"
@@ -174,13 +251,41 @@ class OrderTimeline(models.Model):
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['order', 'timestamp', 'id']), # one order's timeline, in order (shop.timeline)
+        ]
 
     def __str__(self):
         return f"Event for Order {self.order.order_number} at {self.timestamp}"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Order timeline events are append-only.")
+        super().save(*args, **kwargs)
+
+
+class OrderTimelineArchive(models.Model):
+    """A run of one order's archived timeline events, as a compressed blob (see shop/timeline.py)."""
+    order = models.ForeignKey(Order, related_name='timeline_archives', on_delete=models.CASCADE, db_index=False) # led by the (order, last_event_at) index
+    first_event_at = models.DateTimeField()
+    last_event_at = models.DateTimeField()
+    last_event_id = models.BigIntegerField() # with last_event_at, the position of the blob's last event
+    event_count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['order', 'last_event_at', 'last_event_id']
+        indexes = [
+            models.Index(fields=['order', 'last_event_at', 'last_event_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.event_count} archived events for order #{self.order_id} up to {self.last_event_at}"
+
 
 # Shipping and Carrier Models
-class Carrier(models.Model):
+class Carrier(UniqueSlugMixin, models.Model):
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=120, unique=True, blank=True)
     website_url = models.URLField(blank=True, null=True)
@@ -192,11 +297,6 @@ class Carrier(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
@@ -227,6 +327,9 @@ class Shipment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']), # pending shipments (dashboard.metrics)
+        ]
 
     def __str__(self):
         return f"Shipment for Order {self.order.order_number} via {self.carrier.name if self.carrier else 'N/A'}"
@@ -234,6 +337,32 @@ class Shipment(models.Model):
     def save(self, *args, **kwargs):
         # If status is 'shipped' and shipped_at is not set, set it.
         if self.status == 'shipped' and not self.shipped_at:
-            from django.utils import timezone
             self.shipped_at = timezone.now()
         super().save(*args, **kwargs)
+
+
+# Inventory reservations (see shop/inventory.py)
+class StockReservation(models.Model):
+    RESERVATION_STATUS_CHOICES = [
+        ('held', 'Held'), # Stock taken off the shelf, waiting for checkout
+        ('committed', 'Committed'), # Consumed by an order
+        ('released', 'Released'), # Returned to stock by the customer/staff
+        ('expired', 'Expired'), # Returned to stock after the hold TTL elapsed
+    ]
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='stock_reservations', on_delete=models.SET_NULL, null=True, blank=True)
+    order = models.ForeignKey(Order, related_name='stock_reservations', on_delete=models.SET_NULL, null=True, blank=True)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=RESERVATION_STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'expires_at']), # expire_holds() sweep
+        ]
+
+    def __str__(self):
+        return f"Hold of {self.quantity} x product #{self.product_id} ({self.status})"
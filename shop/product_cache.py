@@ -0,0 +1,148 @@
+"""
+Read-through cache for product detail representations (GET /api/shop/products/<slug>/).
+
+Entries live in the cache alias named by SHOP_PRODUCT_CACHE (the 'products' locmem cache by
+default, which evicts least recently used entries past MAX_ENTRIES). Keys carry
+REPRESENTATION_VERSION, so changing ProductSerializer only needs a bump here.
+
+The generation keys below live in the same alias, so invalidation is only as shared as the
+cache. With locmem, a write bumps the generation in its own process only; other processes
+keep serving their entry until it expires, up to SOFT_TTL + STALE_TTL. With several worker
+processes, point the alias at a shared cache (Redis, Memcached, a database or file cache).
+
+Invalidation is by generation: each product has a generation key (by pk) that writers bump
+after commit (shop/signals.py, shop/inventory.py, catalog_import). An entry records the
+generation it was built from and is only served while that still matches, so a reader
+racing a writer can never pin stale data.
+
+Stampedes: when an entry is missing or invalidated, one request (holding a short lock in
+the cache) rebuilds it while the others wait for it; once an entry is past its soft TTL,
+the others keep serving it until the refresh lands.
+"""
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Product
+
+
+REPRESENTATION_VERSION = 1
+SOFT_TTL = 60 # seconds an entry is served without a refresh
+STALE_TTL = 300 # extra seconds a soft-expired entry may be served while one request refreshes it
+LOCK_TTL = 5
+LOCK_WAIT = 0.02
+LOCK_POLLS = 50
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, 'SHOP_PRODUCT_CACHE', 'products')]
+
+
+def _entry_key(slug, variant):
+    return f'shop:product:{variant}:{slug}'
+
+
+def _generation_key(pk):
+    return f'shop:product-gen:{pk}'
+
+
+def _count(event):
+    with _stats_lock:
+        _stats[event] += 1
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = sum(stats.get(event, 0) for event in ('hit', 'stale', 'refresh', 'miss'))
+    served = sum(stats.get(event, 0) for event in ('hit', 'stale', 'waited'))
+    stats['hit_ratio'] = round(served / lookups, 4) if lookups else None
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def get_product(slug, load, variant=''):
+    """
+    Returns the cached representation of the product with this slug, calling load(pk) (which
+    must return the serialized data, or None) to build it. `variant` separates representations
+    that differ per request, e.g. the host used in absolute image URLs. Returns None if the
+    product does not exist.
+    """
+    cache = get_cache()
+    key = _entry_key(slug, variant)
+    entry = cache.get(key, version=REPRESENTATION_VERSION)
+    pk = None
+    if entry is not None:
+        pk = entry['pk']
+        if entry['gen'] == cache.get(_generation_key(pk), 0):
+            if time.time() < entry['fresh_until']:
+                _count('hit')
+                return entry['data']
+            # Soft-expired: one request refreshes, the rest keep serving this copy.
+            if not _acquire(cache, key):
+                _count('stale')
+                return entry['data']
+            _count('refresh')
+            return _rebuild(cache, key, slug, pk, load, locked=True)
+
+    _count('miss')
+    locked = _acquire(cache, key)
+    if not locked:
+        # Someone else is rebuilding this entry: wait for it rather than hitting the database too.
+        for _ in range(LOCK_POLLS):
+            time.sleep(LOCK_WAIT)
+            entry = cache.get(key, version=REPRESENTATION_VERSION)
+            if entry is not None and entry['gen'] == cache.get(_generation_key(entry['pk']), 0):
+                _count('waited')
+                return entry['data']
+        _count('wait_timeout')
+    return _rebuild(cache, key, slug, pk, load, locked)
+
+
+def _acquire(cache, key):
+    return cache.add(f'{key}:lock', 1, timeout=LOCK_TTL, version=REPRESENTATION_VERSION)
+
+
+def _rebuild(cache, key, slug, pk, load, locked):
+    try:
+        if pk is None:
+            pk = Product.objects.filter(slug=slug).values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+        # Read the generation before loading, so a write committed meanwhile invalidates this entry.
+        generation = cache.get(_generation_key(pk), 0)
+        data = load(pk)
+        if data is None or data.get('slug') != slug: # gone, or renamed since the stale entry was built
+            cache.delete(key, version=REPRESENTATION_VERSION)
+            return None
+        entry = {'pk': pk, 'gen': generation, 'fresh_until': time.time() + SOFT_TTL, 'data': data}
+        cache.set(key, entry, timeout=SOFT_TTL + STALE_TTL, version=REPRESENTATION_VERSION)
+        return data
+    finally:
+        if locked:
+            cache.delete(f'{key}:lock', version=REPRESENTATION_VERSION)
+
+
+def invalidate(product_ids):
+    """Invalidates the cached representations of these products once the transaction commits."""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+
+    def bump():
+        generation = time.time_ns()
+        get_cache().set_many({_generation_key(pk): generation for pk in product_ids}, timeout=None)
+        _count('invalidations')
+
+    transaction.on_commit(bump)
@@ -0,0 +1,216 @@
+"""
+Full-text product search index.
+
+Products are indexed (name, description and category name) in a side table maintained by
+the signal handlers in shop/signals.py and rebuilt with `manage.py rebuild_search_index`:
+- SQLite: an FTS5 virtual table ranked with bm25().
+- PostgreSQL: a tsvector table with a GIN index ranked with ts_rank().
+Other databases fall back to the previous icontains scan.
+
+The tables are created by migration 0005_product_search_index.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or '')[:16]
+
+
+class BaseSearchBackend:
+    def filter(self, queryset, query):
+        """Restricts queryset to products matching query and orders them by relevance."""
+        raise NotImplementedError
+
+    def index_products(self, product_ids):
+        """(Re)indexes the given products."""
+
+    def index_category(self, category_id):
+        """(Re)indexes every product of a category, e.g. after it was renamed."""
+
+    def remove_products(self, product_ids):
+        """Drops the given products from the index."""
+
+    def rebuild(self, batch_size=5000):
+        """Reindexes the whole catalog. Returns the number of products indexed."""
+        return 0
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """No index: the icontains scan SearchFilter used to do. Used on databases without a full-text engine."""
+
+    def filter(self, queryset, query):
+        for token in tokenize(query):
+            queryset = queryset.filter(
+                Q(name__icontains=token) | Q(description__icontains=token) | Q(category__name__icontains=token)
+            )
+        return queryset
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    table = 'shop_product_fts'
+    # bm25() column weights for (name, description, category)
+    weights = (10.0, 1.0, 3.0)
+    select_documents = (
+        "SELECT p.id, p.name, p.description, c.name FROM shop_product p "
+        "JOIN shop_category c ON c.id = p.category_id"
+    )
+
+    def match_expression(self, query):
+        # Every token must match, as a prefix, so partial words typed in a search box still hit.
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def filter(self, queryset, query):
+        match = self.match_expression(query)
+        if not match:
+            return queryset
+        weights = ', '.join(str(w) for w in self.weights)
+        return queryset.extra(
+            tables=[self.table],
+            where=[f'{self.table}.rowid = shop_product.id', f'{self.table} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'bm25({self.table}, {weights})'},
+        ).order_by('search_rank', '-created_at')
+
+    def _reindex(self, where, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN (SELECT p.id FROM shop_product p WHERE {where})", params)
+            cursor.execute(
+                f"INSERT INTO {self.table} (rowid, name, description, category) {self.select_documents} WHERE {where}",
+                params,
+            )
+            return cursor.rowcount
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            self._reindex(f"p.id IN ({placeholders})", product_ids)
+
+    def index_category(self, category_id):
+        self._reindex("p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            placeholders = ', '.join(['%s'] * len(product_ids))
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({placeholders})", product_ids)
+
+    def rebuild(self, batch_size=5000):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table}")
+            cursor.execute("SELECT MIN(id), MAX(id) FROM shop_product")
+            low, high = cursor.fetchone()
+        indexed = 0
+        if low is None:
+            return indexed
+        for start in range(low, high + 1, batch_size):
+            indexed += self._reindex("p.id >= %s AND p.id < %s", [start, start + batch_size])
+        with connection.cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+        return indexed
+
+
+class PostgresFTSBackend(BaseSearchBackend):
+    table = 'shop_product_search'
+    config = 'simple'
+    document_sql = (
+        "setweight(to_tsvector('{config}', p.name), 'A') || "
+        "setweight(to_tsvector('{config}', c.name), 'B') || "
+        "setweight(to_tsvector('{config}', p.description), 'C')"
+    )
+
+    def tsquery(self, query):
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    def filter(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset
+        return queryset.extra(
+            tables=[self.table],
+            where=[f'{self.table}.product_id = shop_product.id', f"{self.table}.document @@ to_tsquery('{self.config}', %s)"],
+            params=[tsquery],
+            select={'search_rank': f"ts_rank({self.table}.document, to_tsquery('{self.config}', %s))"},
+            select_params=[tsquery],
+        ).order_by('-search_rank', '-created_at')
+
+    def _reindex(self, where, params):
+        document = self.document_sql.format(config=self.config)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} (product_id, document) "
+                f"SELECT p.id, {document} FROM shop_product p JOIN shop_category c ON c.id = p.category_id "
+                f"WHERE {where} "
+                f"ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+                params,
+            )
+            return cursor.rowcount
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if product_ids:
+            self._reindex("p.id = ANY(%s)", [product_ids])
+
+    def index_category(self, category_id):
+        self._reindex("p.category_id = %s", [category_id])
+
+    def remove_products(self, product_ids):
+        # Rows go away with the product through ON DELETE CASCADE.
+        pass
+
+    def rebuild(self, batch_size=5000):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {self.table}")
+            cursor.execute("SELECT MIN(id), MAX(id) FROM shop_product")
+            low, high = cursor.fetchone()
+        indexed = 0
+        if low is None:
+            return indexed
+        for start in range(low, high + 1, batch_size):
+            indexed += self._reindex("p.id >= %s AND p.id < %s", [start, start + batch_size])
+        return indexed
+
+
+_backend = None
+
+
+def get_backend():
+    """Returns the configured backend (SHOP_SEARCH_BACKEND) or the one matching the database vendor."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SHOP_SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'sqlite' and _sqlite_table_exists(SQLiteFTSBackend.table):
+            _backend = SQLiteFTSBackend()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresFTSBackend()
+        else:
+            _backend = LikeSearchBackend()
+    return _backend
+
+
+def _sqlite_table_exists(table):
+    # The FTS table is only created when the SQLite build ships FTS5.
+    return table in connection.introspection.table_names()
+
+
+class ProductFullTextSearchFilter(BaseFilterBackend):
+    """Drop-in replacement for SearchFilter on product listings, backed by the search index."""
+    search_param = SearchFilter.search_param
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return get_backend().filter(queryset, query)
@@ -1,10 +1,16 @@
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
+from django.db import models
 from .models import (
     Category, Product, ProductImage, ProductAttribute, 
     Address, Order, OrderItem, OrderTimeline,
-    Carrier, Shipment # Added Carrier and Shipment
+    Carrier, Shipment, # Added Carrier and Shipment
+    StockReservation
 )
+from . import timeline
+from .checkout import place_order
+from .inventory import InsufficientStock
 
 class ProductAttributeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -43,12 +49,17 @@ class ProductSerializer(serializers.ModelSerializer):
         return product
 
 class CategorySerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True, read_only=True) # Read-only, products are managed via Product endpoints
+    """
+    Category detail. Products are not embedded unless requested: the view passes `expand`
+    (?expand=products) and `fields` (?fields=id,name,...) through the serializer context.
+    Expanded products are the first page only (prefetched into `nested_products`), with
+    `products_url` pointing at the paginated products endpoint for the rest.
+    """
     parent_slug = serializers.SlugRelatedField(slug_field='slug', queryset=Category.objects.all(), source='parent', required=False, allow_null=True)
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'description', 'parent', 'parent_slug', 'products', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'slug', 'description', 'parent', 'parent_slug', 'created_at', 'updated_at']
         read_only_fields = ('slug', 'created_at', 'updated_at')
         # Ensure parent is writeable for associating parent category by ID
         extra_kwargs = {
@@ -61,17 +72,31 @@ class CategorySerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("A category with this name already exists.")
         return value
 
+    def validate(self, data):
+        parent = data.get('parent')
+        if self.instance is not None and parent is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError({'parent': "A category cannot be moved under itself or one of its subcategories."})
+        return data
+
     def get_fields(self, *args, **kwargs):
         fields = super().get_fields(*args, **kwargs)
-        # To avoid recursion issues when listing categories with children that also list parents
-        request = self.context.get('request', None)
-        if request and request.method == 'GET': # Only modify for GET requests if needed for specific views
-             # If 'omit_parent_slug' is passed in context by the view, we can use it here
-            if self.context.get('omit_parent_slug_if_null', False) and not self.instance.parent:
-                 # This logic might be better handled in the view or by using different serializers for different actions
-                 pass # Example of how context could be used
+        if 'products' in self.context.get('expand', ()):
+            fields['products'] = ProductSerializer(many=True, read_only=True, source='nested_products')
+            fields['products_url'] = serializers.SerializerMethodField()
+        requested = self.context.get('fields')
+        if requested:
+            fields = {name: field for name, field in fields.items() if name in requested}
         return fields
 
+    def get_products_url(self, obj):
+        return reverse('category-products-in-category', kwargs={'slug': obj.slug}, request=self.context.get('request'))
+
+
+class CategoryListSerializer(CategorySerializer):
+    """Category listing: no description, no products unless ?expand=products."""
+    class Meta(CategorySerializer.Meta):
+        fields = ['id', 'name', 'slug', 'parent_slug', 'depth']
+
 
 # Serializers for adding images and attributes to products
 class ProductImageCreateSerializer(serializers.ModelSerializer):
@@ -127,11 +152,12 @@ class OrderTimelineSerializer(serializers.ModelSerializer):
 
 # Order Serializers
 class OrderSerializer(serializers.ModelSerializer):
+    """Order detail, with its whole timeline: archived and live events (see shop/timeline.py)."""
     user = serializers.StringRelatedField(read_only=True)
     items = OrderItemSerializer(many=True, read_only=True)
     shipping_address = AddressSerializer(read_only=True)
     billing_address = AddressSerializer(read_only=True)
-    timeline_events = OrderTimelineSerializer(many=True, read_only=True)
+    timeline_events = serializers.SerializerMethodField()
 
     class Meta:
         model = Order
@@ -142,12 +168,42 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ('order_number', 'total_amount', 'subtotal_amount', 'created_at', 'updated_at', 'timeline_events')
 
+    def get_timeline_events(self, obj):
+        # Lists load the events of all their orders at once (OrderTimelineListSerializer).
+        batch = self.context.get('timeline_events')
+        events = batch[obj.pk] if batch is not None else timeline.order_events(obj.pk)
+        return OrderTimelineSerializer(events, many=True).data
+
+
+class OrderTimelineListSerializer(serializers.ListSerializer):
+    """Loads the timelines of every order in the list in two queries, when they are expanded."""
+    def to_representation(self, data):
+        orders = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if 'timeline' in self.context.get('expand', ()):
+            self.context['timeline_events'] = timeline.order_events_for([order.pk for order in orders])
+        return super().to_representation(orders)
+
+
+class OrderListSerializer(OrderSerializer):
+    """Order listing: no timeline unless ?expand=timeline; the paginated timeline endpoint has it all."""
+    class Meta(OrderSerializer.Meta):
+        fields = [name for name in OrderSerializer.Meta.fields if name != 'timeline_events']
+        list_serializer_class = OrderTimelineListSerializer
+
+    def get_fields(self, *args, **kwargs):
+        fields = super().get_fields(*args, **kwargs)
+        if 'timeline' in self.context.get('expand', ()):
+            fields['timeline_events'] = serializers.SerializerMethodField()
+        return fields
+
 
 class OrderCreateUpdateSerializer(serializers.ModelSerializer):
     items = OrderItemCreateSerializer(many=True, required=True)
     # Address details can be provided as IDs of existing addresses or new address data
     shipping_address_id = serializers.PrimaryKeyRelatedField(queryset=Address.objects.all(), source='shipping_address', required=False, allow_null=True)
     billing_address_id = serializers.PrimaryKeyRelatedField(queryset=Address.objects.all(), source='billing_address', required=False, allow_null=True)
+    # Stock holds (see StockReservationViewSet) to consume instead of taking stock again
+    reservation_ids = serializers.ListField(child=serializers.IntegerField(), required=False, write_only=True)
     
     # Allow creating new addresses during order creation
     # shipping_address_data = AddressSerializer(required=False, write_only=True, allow_null=True) 
@@ -159,20 +215,19 @@ class OrderCreateUpdateSerializer(serializers.ModelSerializer):
             'email', # For guest or if different from user's default
             'shipping_address_id', 'billing_address_id', 
             # 'shipping_address_data', 'billing_address_data', 
-            'notes', 'items' 
+            'notes', 'items', 'reservation_ids'
             # status, total_amount, discount_amount are handled by the backend
         ]
 
     def validate_items(self, value):
         if not value:
             raise serializers.ValidationError("At least one order item is required.")
-        # Further validation: check product availability and stock (can be done in create/update)
+        # Stock is not checked here: a pre-read is stale by the time the order is written.
+        # place_order takes the stock with a conditional UPDATE and reports shortages itself.
         for item_data in value:
             product = item_data['product']
             if not product.available:
                 raise serializers.ValidationError(f"Product '{product.name}' is not available.")
-            if product.stock < item_data['quantity']:
-                raise serializers.ValidationError(f"Not enough stock for product '{product.name}'. Available: {product.stock}, Requested: {item_data['quantity']}.")
         return value
         
     def create(self, validated_data):
@@ -182,30 +237,11 @@ class OrderCreateUpdateSerializer(serializers.ModelSerializer):
         # Handle addresses (simplified: assumes IDs are provided for existing addresses)
         # More complex logic would be needed for creating new addresses from shipping_address_data/billing_address_data
 
-        order = Order.objects.create(user=user, **validated_data)
-
-        total_order_subtotal = 0
-        for item_data in items_data:
-            product = item_data['product']
-            quantity = item_data['quantity']
-            order_item = OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price_at_purchase=product.price # Set price at time of purchase
-            )
-            total_order_subtotal += order_item.get_total_price()
-            
-            # Inventory Management: Decrease stock
-            product.stock -= quantity
-            product.save(update_fields=['stock'])
-
-        order.subtotal_amount = total_order_subtotal
-        order.total_amount = total_order_subtotal # Assuming no discount initially
-        order.save()
-        
-        OrderTimeline.objects.create(order=order, note="Order created.", user_triggered=user, status_changed_to=order.status)
-        return order
+        reservation_ids = validated_data.pop('reservation_ids', None)
+        try:
+            return place_order(items_data, user=user, reservation_ids=reservation_ids, **validated_data)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'items': [str(e)]})
 
     def update(self, instance, validated_data):
         # Updating order items is complex: handle additions, removals, quantity changes.
@@ -214,6 +250,7 @@ class OrderCreateUpdateSerializer(serializers.ModelSerializer):
         # This example focuses on updating order-level fields like addresses or notes.
 
         items_data = validated_data.pop('items', None) # Items are not typically updated this way in a single step.
+        validated_data.pop('reservation_ids', None)
 
         # Update order fields
         instance.email = validated_data.get('email', instance.email)
@@ -233,6 +270,33 @@ class OrderCreateUpdateSerializer(serializers.ModelSerializer):
         return instance
 
 
+class OrderBulkTransitionSerializer(serializers.Serializer):
+    """Input for moving a batch of orders to one status (see shop/transitions.py)."""
+    order_numbers = serializers.ListField(child=serializers.CharField(max_length=100), allow_empty=False, max_length=20000)
+    status = serializers.ChoiceField(choices=Order.ORDER_STATUS_CHOICES)
+    note = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+# Stock reservation Serializers
+class StockReservationSerializer(serializers.ModelSerializer):
+    product_slug = serializers.CharField(source='product.slug', read_only=True)
+
+    class Meta:
+        model = StockReservation
+        fields = ['id', 'product', 'product_slug', 'quantity', 'status', 'expires_at', 'order', 'created_at']
+        read_only_fields = fields
+
+
+class StockHoldSerializer(serializers.Serializer):
+    """Input for holding stock for a batch of cart lines."""
+    items = OrderItemCreateSerializer(many=True)
+
+    def validate_items(self, value):
+        if not value:
+            raise serializers.ValidationError("At least one item is required.")
+        return value
+
+
 # Carrier Serializer
 class CarrierSerializer(serializers.ModelSerializer):
     class Meta:
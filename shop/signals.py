@@ -0,0 +1,63 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core import conditional
+
+from .models import Category, Product, ProductAttribute, ProductImage
+from . import categories, product_cache, search
+
+
+# Search index maintenance (see shop/search.py)
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.get_backend().index_products([instance.pk])
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.get_backend().remove_products([instance.pk])
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, raw=False, **kwargs):
+    # A new category has no products yet; a renamed one changes every product document.
+    if not raw and not created:
+        search.get_backend().index_category(instance.pk)
+
+
+# In-process category tree (see shop/categories.py)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    categories.invalidate_tree()
+
+
+# Product detail cache (see shop/product_cache.py)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    product_cache.invalidate([instance.pk])
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductAttribute)
+@receiver(post_delete, sender=ProductAttribute)
+def invalidate_cached_product_children(sender, instance, **kwargs):
+    product_cache.invalidate([instance.product_id])
+    # Images and attributes are part of the product representation: keep its ETag/Last-Modified moving.
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+@receiver(post_save, sender=Category)
+def invalidate_cached_category_products(sender, instance, created, raw=False, **kwargs):
+    # Product representations embed the category name.
+    if not raw and not created:
+        product_cache.invalidate(Product.objects.filter(category=instance).values_list('pk', flat=True))
+
+
+# Change markers of the conditional GET lists (see core/conditional.py)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def touch_conditional_lists(sender, **kwargs):
+    conditional.touch(sender)
@@ -1,3 +1,809 @@
-from django.test import TestCase
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from rest_framework.test import APIClient
+
+from core import conditional
+from core.query_count import QueryBudgetMixin
+from core.query_plans import HotPath, QueryPlanMixin
+from core.sample_data import create_sample_rows
+
+from . import inventory, product_cache, search, timeline
+from .checkout import place_order
+from .models import Category, Order, OrderItem, OrderTimeline, Product, ProductAttribute, ProductImage, StockReservation, orders_updated
+from .serializers import OrderTimelineSerializer, ProductSerializer
+from .views import CategoryViewSet
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    router_module = 'shop.api_urls'
+    budgets = {
+        'category-list': 4,       # + one prefetch for the tree below the listed categories
+        'product-list': 5,        # + images, attributes
+        'product-detail': 5,
+        'order-list': 4,          # + items and their products
+        'order-detail': 6,        # + items, products, timeline
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+
+class QueryPlanTests(QueryPlanMixin, TestCase):
+    def test_orders_by_status(self):
+        self.assertIndexSeeks(HotPath('Orders by status', ['shop_order'], view='shop.views.OrderViewSet', params={'status': 'pending'}))
+
+    def test_customer_orders(self):
+        self.assertIndexSeeks(HotPath("A customer's orders", ['shop_order'], view='shop.views.OrderViewSet', user='customer'))
+
+    def test_shipments_by_status(self):
+        self.assertIndexSeeks(HotPath('Shipments by status', ['shop_shipment'], view='shop.views.ShipmentViewSet', params={'status': 'pending'}))
+
+    def test_products_by_attribute(self):
+        self.assertIndexSeeks(HotPath(
+            'Products by attribute', ['shop_productattribute'], view='shop.views.ProductSearchView',
+            params={'attr': 'Color:Red,Size:XL'}, user='anonymous',
+        ))
+
+
+class CategoryTreeTests(TestCase):
+    """Category.path maintenance (Category._sync_path) and subtree_q ranges."""
+
+    def setUp(self):
+        self.tree = {}
+        for name, parent in [('a', None), ('b', 'a'), ('c', 'b'), ('d', 'c'), ('e', None), ('f', 'e')]:
+            self.tree[name] = Category.objects.create(name=name, parent=self.tree.get(parent))
+
+    def expected_path(self, *names):
+        return ''.join(f'{self.tree[name].pk:08d}/' for name in names)
+
+    def stored(self, name):
+        return Category.objects.values_list('path', 'depth').get(name=name)
+
+    def subtree(self, name):
+        return set(Category.objects.filter(Category.objects.get(name=name).subtree_q()).values_list('name', flat=True))
+
+    def move(self, name, parent):
+        category = Category.objects.get(name=name)
+        category.parent = self.tree[parent] if parent else None
+        category.save()
+
+    def test_paths_of_new_categories(self):
+        self.assertEqual(self.stored('d'), (self.expected_path('a', 'b', 'c', 'd'), 3))
+        self.assertEqual(self.subtree('a'), {'a', 'b', 'c', 'd'})
+        self.assertEqual(self.subtree('c'), {'c', 'd'})
+        self.assertEqual(Category.objects.get(name='d').get_ancestor_ids(), [self.tree[name].pk for name in 'abc'])
+
+    def test_moving_a_subtree_rewrites_deep_descendants(self):
+        self.move('b', 'f')
+        self.assertEqual(self.stored('b'), (self.expected_path('e', 'f', 'b'), 2))
+        self.assertEqual(self.stored('c'), (self.expected_path('e', 'f', 'b', 'c'), 3))
+        self.assertEqual(self.stored('d'), (self.expected_path('e', 'f', 'b', 'c', 'd'), 4))
+        self.assertEqual(self.subtree('a'), {'a'})
+        self.assertEqual(self.subtree('e'), {'e', 'f', 'b', 'c', 'd'})
+
+    def test_moving_to_the_root_and_back(self):
+        self.move('c', None)
+        self.assertEqual(self.stored('c'), (self.expected_path('c'), 0))
+        self.assertEqual(self.stored('d'), (self.expected_path('c', 'd'), 1))
+        self.assertEqual(self.subtree('a'), {'a', 'b'})
+
+        self.move('c', 'a')
+        self.assertEqual(self.stored('d'), (self.expected_path('a', 'c', 'd'), 2))
+        self.assertEqual(self.subtree('a'), {'a', 'b', 'c', 'd'})
+
+    def test_moving_under_itself_or_a_descendant_is_refused(self):
+        before = dict(Category.objects.values_list('name', 'path'))
+        for descendant in ('b', 'd'):
+            with self.assertRaises(ValueError):
+                self.move('b', descendant)
+        self.assertEqual(dict(Category.objects.values_list('name', 'path')), before)
+        self.assertEqual(Category.objects.get(name='b').parent_id, self.tree['a'].pk)
+
+    def test_products_of_a_moved_subtree(self):
+        product = Product.objects.create(category=self.tree['d'], name='Deep product', price=Decimal('1.00'))
+        self.move('c', 'e')
+        for name, expected in (('e', [product]), ('a', [])):
+            self.assertEqual(list(Product.objects.filter(Category.objects.get(name=name).subtree_q('category__'))), expected)
+
+
+class CategoryListTests(TestCase):
+    """Category list/detail payloads stay small unless ?expand=products asks for the products."""
+    CATEGORIES = 12
+    PRODUCTS = 25 # per category, more than CategoryViewSet.NESTED_PRODUCTS_LIMIT
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(cls.CATEGORIES):
+            category = Category.objects.create(name=f'Category {i}', description='A category. ' * 20)
+            for j in range(cls.PRODUCTS):
+                product = Product.objects.create(category=category, name=f'Product {i}-{j}', description='A product. ' * 20, price=Decimal('9.99'))
+                ProductImage.objects.create(product=product, image=f'products/{i}-{j}.jpg')
+                ProductAttribute.objects.create(product=product, name='Color', value='Red')
+
+    def get(self, path, queries, **params):
+        # queries include the conditional GET validators (core/conditional.py)
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'/api/shop/categories/{path}', params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list_embeds_no_products(self):
+        response = self.get('', 2)
+        self.assertEqual(len(response.json()), self.CATEGORIES)
+        self.assertEqual(set(response.json()[0]), {'id', 'name', 'slug', 'parent_slug', 'depth'})
+        self.assertLess(len(response.content), 100 * self.CATEGORIES)
+
+    def test_list_field_selection(self):
+        full = self.get('', 2)
+        response = self.get('', 2, fields='id,slug')
+        self.assertEqual(set(response.json()[0]), {'id', 'slug'})
+        self.assertLess(len(response.content), len(full.content) // 2)
+
+    def test_list_expanded_products(self):
+        # Categories, one windowed query for their first products, then images and attributes.
+        response = self.get('', 5, expand='products')
+        limit = CategoryViewSet.NESTED_PRODUCTS_LIMIT
+        for category in response.json():
+            self.assertEqual(len(category['products']), limit)
+            self.assertTrue(category['products_url'].endswith(f"/categories/{category['slug']}/products/"))
+        self.assertLess(len(response.content), 1000 * limit * self.CATEGORIES)
+
+    def test_detail(self):
+        slug = Category.objects.first().slug
+        plain = self.get(f'{slug}/', 2)
+        self.assertNotIn('products', plain.json())
+        expanded = self.get(f'{slug}/', 5, expand='products')
+        self.assertEqual(len(expanded.json()['products']), CategoryViewSet.NESTED_PRODUCTS_LIMIT)
+
+
+class ConditionalGetTests(TestCase):
+    """Product list validators (core/conditional.py), over pages of two products."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+    def setUp(self):
+        conditional.get_cache().clear() # change markers left by other tests
+
+    def get_products(self, headers=None):
+        return self.client.get('/api/shop/products/', {'page_size': 2, 'available': 'true'}, headers=headers or {})
+
+    def later(self):
+        # HTTP dates have a resolution of a second: the change marker moves a minute ahead.
+        clock = mock.patch('core.conditional.time')
+        clock.start().time.return_value = time.time() + 60
+        self.addCleanup(clock.stop)
+
+    def test_not_modified_skips_serialization(self):
+        etag = self.get_products()['ETag']
+        serialize = mock.patch.object(ProductSerializer, 'to_representation', side_effect=AssertionError('serialized'))
+        with serialize, self.assertNumQueries(2): # the page and its rows' timestamps; no prefetches
+            response = self.get_products({'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_covers_the_page_only(self):
+        first = self.get_products()
+        listed = [row['slug'] for row in first.json()['results']]
+        elsewhere = Product.objects.exclude(slug__in=listed).first()
+        elsewhere.price += 1
+        elsewhere.save()
+        self.assertEqual(self.get_products({'If-None-Match': first['ETag']}).status_code, 304)
+
+        on_page = Product.objects.get(slug=listed[0])
+        on_page.price += 1
+        on_page.save()
+        self.assertEqual(self.get_products({'If-None-Match': first['ETag']}).status_code, 200)
+
+    def test_last_modified_moves_on_when_a_row_leaves(self):
+        first = self.get_products()
+        self.later()
+        product = Product.objects.get(slug=first.json()['results'][0]['slug'])
+        product.available = False
+        product.save()
+
+        response = self.get_products({'If-Modified-Since': first['Last-Modified']})
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(parse_http_date(response['Last-Modified']), parse_http_date(first['Last-Modified']))
+
+    def test_last_modified_moves_on_after_a_delete(self):
+        Product.objects.create(category=Category.objects.first(), name='Short-lived', price=Decimal('1.00'), stock=1, available=True)
+        first = self.get_products()
+        self.assertEqual(first.json()['results'][0]['name'], 'Short-lived')
+        self.later()
+        Product.objects.get(name='Short-lived').delete()
+
+        response = self.get_products({'If-Modified-Since': first['Last-Modified']})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+
+class KeysetCursorTests(TestCase):
+    """Walking the product list by cursor (core/pagination.py) while products are being added."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+        cls.category = Category.objects.first()
+
+    def add_product(self, name, price):
+        return Product.objects.create(category=self.category, name=name, price=Decimal(price), stock=1, available=True)
+
+    def walk(self, params, between_pages):
+        """Slugs of every page in order, calling between_pages(page number, last row) after each page."""
+        seen = []
+        response = self.client.get('/api/shop/products/', {'page_size': 2, **params})
+        while True:
+            results = response.json()['results']
+            seen.extend(row['slug'] for row in results)
+            if not response.json()['next']:
+                return seen
+            between_pages(len(seen) // 2, results[-1])
+            response = self.client.get(response.json()['next'])
+
+    def assertWalkedOnce(self, seen, before):
+        self.assertEqual(len(seen), len(set(seen)), "a row was listed twice")
+        self.assertEqual(set(before) - set(seen), set(), "a row was skipped")
+
+    def test_newest_first_with_inserts_between_pages(self):
+        before = list(Product.objects.values_list('slug', flat=True))
+        seen = self.walk({}, lambda page, last: self.add_product(f'Inserted {page}', '1.00'))
+        self.assertWalkedOnce(seen, before)
+        # Newer than the cursor: they belong to pages already served.
+        self.assertFalse(any(slug.startswith('inserted') for slug in seen))
+
+    def test_ordered_by_price_with_inserts_on_both_sides_of_the_cursor(self):
+        before = list(Product.objects.values_list('slug', flat=True))
+
+        def insert(page, last):
+            self.add_product(f'Cheaper {page}', Decimal(last['price']) - Decimal('0.01'))
+            self.add_product(f'Dearer {page}', Decimal(last['price']) + Decimal('0.01'))
+
+        seen = self.walk({'ordering': 'price'}, insert)
+        self.assertWalkedOnce(seen, before)
+        self.assertFalse(any(slug.startswith('cheaper') for slug in seen))
+        self.assertTrue(any(slug.startswith('dearer') for slug in seen))
+
+
+class ProductCacheTests(TestCase):
+    """The product detail cache (shop/product_cache.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+
+    def setUp(self):
+        product_cache.get_cache().clear()
+        product_cache.reset_stats()
+        self.product = Product.objects.create(category=Category.objects.first(), name='Cached Lamp', price=Decimal('20.00'), stock=5)
+        self.loads = []
+
+    def load(self, pk):
+        self.loads.append(pk)
+        product = Product.objects.filter(pk=pk).first()
+        return None if product is None else {'slug': product.slug, 'price': str(product.price)}
+
+    def get(self):
+        return product_cache.get_product(self.product.slug, self.load)
+
+    def stats(self, *events):
+        stats = product_cache.get_stats()
+        return [stats.get(event, 0) for event in events]
+
+    def test_miss_then_hits(self):
+        self.assertEqual(self.get(), {'slug': 'cached-lamp', 'price': '20.00'})
+        self.get()
+        self.get()
+        self.assertEqual(self.loads, [self.product.pk])
+        self.assertEqual(self.stats('miss', 'hit'), [1, 2])
+        self.assertEqual(product_cache.get_stats()['hit_ratio'], round(2 / 3, 4))
+
+    def test_unknown_slug(self):
+        self.assertIsNone(product_cache.get_product('no-such-product', self.load))
+        self.assertEqual(self.loads, [])
+
+    def test_save_invalidates(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = Decimal('25.00')
+            self.product.save()
+        self.assertEqual(self.get()['price'], '25.00')
+        self.assertEqual(self.stats('miss', 'invalidations'), [2, 1])
+
+    def test_stock_change_invalidates(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.return_stock({self.product.pk: 2})
+        self.get()
+        self.assertEqual(len(self.loads), 2)
+
+    def test_delete_invalidates(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertIsNone(self.get())
+
+    def test_bulk_import_invalidates(self):
+        self.get()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as feed:
+            feed.write(f'slug,name,category,price,stock\n{self.product.slug},Cached Lamp,{self.product.category.slug},30.00,5\n')
+        self.addCleanup(os.remove, feed.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('catalog_import', feed.name, stdout=StringIO())
+        self.assertEqual(self.get()['price'], '30.00')
+
+    def test_write_during_a_rebuild_is_not_pinned(self):
+        def load_then_save(pk):
+            data = self.load(pk)
+            # A writer commits between the rebuild's read and its cache write.
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.filter(pk=pk).update(price=Decimal('21.00'))
+                product_cache.invalidate([pk])
+            return data
+
+        self.assertEqual(product_cache.get_product(self.product.slug, load_then_save)['price'], '20.00')
+        self.assertEqual(self.get()['price'], '21.00')
+
+    def test_waits_for_the_request_holding_the_lock(self):
+        key = product_cache._entry_key(self.product.slug, '')
+        self.assertTrue(product_cache._acquire(product_cache.get_cache(), key))
+
+        def other_request_finishes(seconds):
+            product_cache._rebuild(product_cache.get_cache(), key, self.product.slug, None, self.load, locked=True)
+
+        with mock.patch('shop.product_cache.time.sleep', side_effect=other_request_finishes):
+            self.assertEqual(self.get()['price'], '20.00')
+        self.assertEqual(len(self.loads), 1) # by the lock holder only
+        self.assertEqual(self.stats('miss', 'waited'), [1, 1])
+
+    def test_rebuilds_after_waiting_too_long(self):
+        key = product_cache._entry_key(self.product.slug, '')
+        product_cache._acquire(product_cache.get_cache(), key)
+        with mock.patch('shop.product_cache.time.sleep'):
+            self.assertEqual(self.get()['price'], '20.00')
+        self.assertEqual(self.stats('wait_timeout'), [1])
+
+    def test_soft_expired_entry_is_served_while_one_request_refreshes(self):
+        self.get()
+        key = product_cache._entry_key(self.product.slug, '')
+        later = time.time() + product_cache.SOFT_TTL + 1
+        with mock.patch('shop.product_cache.time.time', return_value=later):
+            product_cache._acquire(product_cache.get_cache(), key) # another request is refreshing
+            self.get()
+            product_cache.get_cache().delete(f'{key}:lock', version=product_cache.REPRESENTATION_VERSION)
+            self.get()
+        self.assertEqual(self.stats('stale', 'refresh'), [1, 1])
+        self.assertEqual(len(self.loads), 2)
+
+
+class CatalogImportTests(TestCase):
+    """catalog_import and catalog_export."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tools = Category.objects.create(name='Tools')
+        cls.drill = Product.objects.create(category=cls.tools, name='Drill', slug='drill', price=Decimal('50.00'), stock=3)
+        ProductAttribute.objects.create(product=cls.drill, name='Power', value='500W')
+        # Takes the slug a 'Hammer' row would get first.
+        Product.objects.create(category=cls.tools, name='Hammer Old', slug='hammer', price=Decimal('1.00'), stock=1)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def feed(self, text, name='feed.csv'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def run_import(self, path):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('catalog_import', path, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def attributes(self, slug):
+        return sorted(ProductAttribute.objects.filter(product__slug=slug).values_list('name', 'value'))
+
+    def test_upsert_by_slug(self):
+        output = self.run_import(self.feed(
+            'slug,name,category,price,stock,attributes\n'
+            'drill,Drill Pro,tools,55.00,4,Power:700W|Chuck:13mm\n'
+            'saw,Saw,tools,20.00,2,\n'
+            'bolt,Bolt,no-such-category,1.00,1,\n'
+        ))
+        self.assertIn('(1 created, 1 updated, 1 skipped)', output)
+        drill = Product.objects.get(pk=self.drill.pk)
+        self.assertEqual((drill.name, drill.price, drill.stock), ('Drill Pro', Decimal('55.00'), 4))
+        self.assertEqual(self.attributes('drill'), [('Chuck', '13mm'), ('Power', '700W')])
+        self.assertEqual(Product.objects.get(slug='saw').price, Decimal('20.00'))
+
+    def test_empty_attributes_cell_keeps_attributes(self):
+        self.run_import(self.feed('slug,name,category,price,stock,attributes\ndrill,Drill,tools,50.00,3,\n'))
+        self.assertEqual(self.attributes('drill'), [('Power', '500W')])
+
+    def test_jsonl_empty_attributes_remove_them(self):
+        self.run_import(self.feed(json.dumps({'slug': 'drill', 'name': 'Drill', 'category': 'tools', 'price': '50.00', 'attributes': []}) + '\n', 'feed.jsonl'))
+        self.assertEqual(self.attributes('drill'), [])
+
+    def test_rows_without_slug(self):
+        feed = self.feed('name,category,price,stock\nHammer,tools,12.00,5\nWrench,tools,8.00,5\nWrench,tools,9.00,5\n')
+        self.assertIn('(2 created, 0 updated, 1 skipped)', self.run_import(feed))
+        self.assertEqual(Product.objects.get(name='Hammer').slug, 'hammer-1')
+        self.assertEqual(Product.objects.get(name='Wrench').price, Decimal('9.00')) # the last row wins
+
+        # Imported again: the same products are updated, not created again as hammer-2, wrench-1.
+        self.assertIn('(0 created, 2 updated, 1 skipped)', self.run_import(feed))
+        self.assertEqual(sorted(Product.objects.filter(category=self.tools).values_list('slug', flat=True)), ['drill', 'hammer', 'hammer-1', 'wrench'])
+
+    def test_export_then_import_round_trip(self):
+        for file_format in ('csv', 'jsonl'):
+            path = os.path.join(self.directory, f'catalog.{file_format}')
+            call_command('catalog_export', format=file_format, output=path, stderr=StringIO())
+            before = list(Product.objects.order_by('pk').values_list('slug', 'name', 'price', 'stock', 'available'))
+            self.assertIn('(0 created, 2 updated, 0 skipped)', self.run_import(path))
+            self.assertEqual(list(Product.objects.order_by('pk').values_list('slug', 'name', 'price', 'stock', 'available')), before)
+            self.assertEqual(self.attributes('drill'), [('Power', '500W')])
+
+
+class ProductSearchTests(TestCase):
+    """Full-text product search (shop/search.py) through /api/shop/search/products/."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kitchen = Category.objects.create(name='Kitchen')
+        cls.garden = Category.objects.create(name='Garden')
+        for category, name, description, price in (
+            (cls.kitchen, 'Copper Kettle', 'Boils water fast.', '40.00'),
+            (cls.kitchen, 'Steel Pan', 'Works on induction, with a copper base.', '30.00'),
+            (cls.garden, 'Garden Hose', 'Twenty metres, green.', '25.00'),
+            (cls.garden, 'Rake', 'For leaves.', '15.00'),
+        ):
+            Product.objects.create(category=category, name=name, description=description, price=Decimal(price), stock=1)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/shop/search/products/', {'search': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [product['slug'] for product in response.json()]
+
+    def test_backend(self):
+        self.assertIsInstance(search.get_backend(), search.SQLiteFTSBackend)
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('copper'), ['copper-kettle', 'steel-pan'])
+        self.assertEqual(self.search('garden'), ['garden-hose', 'rake']) # name over category
+
+    def test_every_token_must_match_as_a_prefix(self):
+        self.assertEqual(self.search('kett'), ['copper-kettle'])
+        self.assertEqual(self.search('copper induct'), ['steel-pan'])
+        self.assertEqual(self.search('copper "rake"'), [])
+
+    def test_ordering_overrides_rank(self):
+        self.assertEqual(self.search('copper', ordering='price'), ['steel-pan', 'copper-kettle'])
+
+    def test_like_backend_finds_the_same_products(self):
+        backend = search.LikeSearchBackend()
+        for query in ('copper', 'garden', 'kett', 'copper induct'):
+            found = backend.filter(Product.objects.all(), query).values_list('slug', flat=True)
+            self.assertEqual(sorted(found), sorted(self.search(query)), query)
+
+    def test_product_writes_are_reindexed(self):
+        rake = Product.objects.get(slug='rake')
+        rake.name = 'Leaf Rake'
+        rake.save()
+        self.assertEqual(self.search('leaf'), ['rake'])
+        rake.delete()
+        self.assertEqual(self.search('leaf'), [])
+
+    def test_category_rename_reindexes_its_products(self):
+        self.garden.name = 'Outdoor'
+        self.garden.save()
+        self.assertEqual(sorted(self.search('outdoor')), ['garden-hose', 'rake'])
+        self.assertEqual(self.search('garden'), ['garden-hose'])
+
+    def test_rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.SQLiteFTSBackend.table}")
+        self.assertEqual(self.search('copper'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=2, stdout=out)
+        self.assertIn('Indexed 4 products with SQLiteFTSBackend', out.getvalue())
+        self.assertEqual(self.search('copper'), ['copper-kettle', 'steel-pan'])
+
+
+class AttributeFacetTests(TestCase):
+    """?attr= filters and attribute facet counts (shop/filters.py)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        shirts = Category.objects.create(name='Shirts')
+        for name, attributes in (
+            ('Red Shirt S', [('Color', 'Red'), ('Size', 'S')]),
+            ('Red Shirt XL', [('Color', 'Red'), ('Size', 'XL')]),
+            ('Blue Shirt XL', [('Color', 'Blue'), ('Size', 'XL')]),
+            ('Two Tone Shirt', [('Color', 'Red'), ('Color', 'Blue'), ('Size', 'M')]),
+            ('Plain Tee', []),
+        ):
+            product = Product.objects.create(category=shirts, name=name, price=Decimal('10.00'), stock=1)
+            for attr_name, value in attributes:
+                ProductAttribute.objects.create(product=product, name=attr_name, value=value)
+
+    def products(self, **params):
+        return sorted(product['slug'] for product in self.client.get('/api/shop/search/products/', params).json())
+
+    def facets(self, **params):
+        response = self.client.get('/api/shop/search/products/facets/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_most_common_first(self):
+        self.assertEqual(self.facets(), {
+            'Color': [{'value': 'Red', 'count': 3}, {'value': 'Blue', 'count': 2}],
+            'Size': [{'value': 'XL', 'count': 2}, {'value': 'M', 'count': 1}, {'value': 'S', 'count': 1}],
+        })
+
+    def test_counts_follow_the_filters_and_search(self):
+        self.assertEqual(self.facets(attr='Size:XL'), {
+            'Color': [{'value': 'Blue', 'count': 1}, {'value': 'Red', 'count': 1}],
+            'Size': [{'value': 'XL', 'count': 2}],
+        })
+        self.assertEqual(self.facets(search='tone')['Color'], [{'value': 'Blue', 'count': 1}, {'value': 'Red', 'count': 1}])
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            self.facets(attr='Color:Red')
+
+    def test_attr_values_or_names_and(self):
+        self.assertEqual(self.products(attr='Color:Red'), ['red-shirt-s', 'red-shirt-xl', 'two-tone-shirt'])
+        self.assertEqual(self.products(attr='Color:Red,Color:Blue'), ['blue-shirt-xl', 'red-shirt-s', 'red-shirt-xl', 'two-tone-shirt'])
+        self.assertEqual(self.products(attr='Color:Red,Color:Blue,Size:XL'), ['blue-shirt-xl', 'red-shirt-xl'])
+        self.assertEqual(self.products(attributes__name='Color', attributes__value='Blue'), ['blue-shirt-xl', 'two-tone-shirt'])
+
+
+class OrderTimelineExpandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
+        for order in Order.objects.all():
+            OrderTimeline.objects.create(order=order, note='Packed.', user_triggered=cls.user)
+        timeline.archive_events(timezone.now() + timedelta(days=1), batch_size=2)
+        for order in Order.objects.all():
+            OrderTimeline.objects.create(order=order, note='Shipped.', user_triggered=cls.user)
+
+    def get_orders(self, page_size):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/api/shop/orders/', {'expand': 'timeline', 'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'], len(queries)
+
+    def test_expanded_timelines_are_batched(self):
+        one, queries_for_one = self.get_orders(1)
+        orders, queries_for_all = self.get_orders(Order.objects.count())
+        self.assertEqual(queries_for_all, queries_for_one)
+        self.assertEqual(len(orders), Order.objects.count())
+        for order in orders:
+            expected = OrderTimelineSerializer(timeline.order_events(order['id']), many=True).data
+            self.assertEqual(order['timeline_events'], expected)
+            self.assertEqual([event['note'] for event in expected], ['Order placed.', 'Packed.', 'Shipped.'])
+
+
+class CheckOrderTotalsTests(TestCase):
+    """check_order_totals: drifted subtotals/totals are reported, and rewritten with fix=True."""
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Totals')
+        products = [Product.objects.create(category=category, name=f'Totals {i}', price=Decimal('2.50') * (i + 1), stock=10) for i in range(2)]
+        cls.orders = []
+        for discount in ('0.00', '1.00', '0.00'):
+            order = Order.objects.create(discount_amount=Decimal(discount), total_amount=-Decimal(discount))
+            cls.orders.append(order)
+        for order in cls.orders[:2]:
+            OrderItem.objects.create(order=order, product=products[0], quantity=2)
+            OrderItem.objects.create(order=order, product=products[1], quantity=1)
+            order.apply_item_delta(Decimal('10.00'))
+        # The third order has no items.
+
+    def totals(self):
+        return [tuple(row) for row in Order.objects.filter(pk__in=[order.pk for order in self.orders]).order_by('pk').values_list('subtotal_amount', 'total_amount')]
+
+    def check_totals(self, **options):
+        out = StringIO()
+        call_command('check_order_totals', stdout=out, **options)
+        return out.getvalue()
+
+    def test_consistent_totals_are_left_alone(self):
+        self.assertEqual(self.totals(), [(Decimal('10.00'), Decimal('10.00')), (Decimal('10.00'), Decimal('9.00')), (Decimal('0.00'), Decimal('0.00'))])
+        self.assertIn("Checked 3 orders, 0 with drifted totals.", self.check_totals())
+
+    def test_reports_drift_without_fix(self):
+        Order.objects.filter(pk=self.orders[1].pk).update(subtotal_amount=Decimal('99.00'), total_amount=Decimal('98.00'))
+        output = self.check_totals()
+        self.assertIn(f"{self.orders[1].order_number}: subtotal 99.00 -> 10.00, total 98.00 -> 9.00", output)
+        self.assertIn("1 with drifted totals.", output)
+        self.assertEqual(self.totals()[1], (Decimal('99.00'), Decimal('98.00')))
+
+    def test_fix_repairs_the_totals(self):
+        Order.objects.filter(pk=self.orders[1].pk).update(subtotal_amount=Decimal('99.00'), total_amount=Decimal('98.00'))
+        Order.objects.filter(pk=self.orders[2].pk).update(total_amount=Decimal('5.00'))
+        receiver = mock.Mock()
+        orders_updated.connect(receiver)
+        self.addCleanup(orders_updated.disconnect, receiver)
+
+        output = self.check_totals(fix=True, batch_size=2)
+        self.assertIn("Checked 3 orders, 2 with drifted totals. Fixed.", output)
+        self.assertEqual(self.totals(), [(Decimal('10.00'), Decimal('10.00')), (Decimal('10.00'), Decimal('9.00')), (Decimal('0.00'), Decimal('0.00'))])
+        self.assertEqual(sum(len(call.kwargs['created_at']) for call in receiver.call_args_list), 2)
+        self.assertIn("0 with drifted totals.", self.check_totals())
+
+
+class CheckoutHoldTests(TestCase):
+    def test_hold_expiring_during_checkout_is_committed(self):
+        user = User.objects.create_user('holder')
+        product = Product.objects.create(category=Category.objects.create(name='Held'), name='Held', price=Decimal('5.00'), stock=10)
+        reservation, = inventory.hold({product.pk: 3}, user=user, ttl=timedelta(minutes=1))
+
+        # The hold is live when checkout reads it, and expired by any later clock reading.
+        start = timezone.now()
+        readings = iter([start])
+        with mock.patch('django.utils.timezone.now', side_effect=lambda: next(readings, start + timedelta(hours=1))):
+            order = place_order([{'product': product, 'quantity': 3}], user=user, reservation_ids=[reservation.pk])
+
+        reservation.refresh_from_db()
+        self.assertEqual((reservation.status, reservation.order_id), ('committed', order.pk))
+        self.assertEqual(inventory.expire_holds(now=start + timedelta(hours=2)), 0)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 7)
+
+
+class StockConcurrencyTests(TransactionTestCase):
+    """
+    Runs the stock paths from THREADS threads at once and checks that stock is taken and
+    returned exactly once.
+    """
+    THREADS = 8
+
+    def setUp(self):
+        self.staff = User.objects.create_superuser('stress-staff', 'stress@example.com', 'stress-password')
+        self.product = Product.objects.create(
+            category=Category.objects.create(name='Stress'), name='Stress product', description='',
+            price=Decimal('2.50'), stock=100,
+        )
+
+    def run_threads(self, work):
+        """Calls work(thread index) in THREADS threads started together; returns their results."""
+        results = [None] * self.THREADS
+        errors = []
+        start = threading.Barrier(self.THREADS)
+
+        def run(index):
+            try:
+                start.wait()
+                results[index] = work(index)
+            except Exception as e: # reported below; a thread's exception would otherwise be lost
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def staff_client(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        return client
+
+    def create_order(self, quantity, status='pending'):
+        total = quantity * self.product.price
+        order = Order.objects.create(user=self.staff, status=status, subtotal_amount=total, total_amount=total)
+        item = OrderItem.objects.create(order=order, product=self.product, quantity=quantity, price_at_purchase=self.product.price)
+        Product.objects.filter(pk=self.product.pk).update(stock=F('stock') - quantity)
+        return order, item
+
+    def test_holds_never_oversell(self):
+        holds_per_thread = 25
+
+        def hold(index):
+            taken = 0
+            for _ in range(holds_per_thread):
+                try:
+                    inventory.hold({self.product.pk: 1}, user=self.staff)
+                    taken += 1
+                except inventory.InsufficientStock:
+                    pass
+            return taken
+
+        started = time.perf_counter()
+        taken = self.run_threads(hold)
+        elapsed = time.perf_counter() - started
+        self.product.refresh_from_db()
+        self.assertEqual(sum(taken), 100)
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(StockReservation.objects.filter(status='held').count(), 100)
+        attempts = self.THREADS * holds_per_thread
+        sys.stderr.write(f"\n{attempts} concurrent holds in {elapsed:.2f} s ({attempts / elapsed:.0f} reservations/s)\n")
+
+    def test_concurrent_cancels_restock_once(self):
+        order, _ = self.create_order(3)
+        url = f'/api/shop/orders/{order.order_number}/cancel-order/'
+        statuses = self.run_threads(lambda index: self.staff_client().post(url).status_code)
+        self.assertEqual(sorted(statuses), [200] + [400] * (self.THREADS - 1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 100)
+
+    def test_cancel_racing_shipment(self):
+        orders = [self.create_order(2, status='processing')[0] for _ in range(self.THREADS)]
+
+        def race(index):
+            # Each order is cancelled by one thread while the others ship it in bulk.
+            client = self.staff_client()
+            cancel = client.post(f'/api/shop/orders/{orders[index].order_number}/cancel-order/').status_code
+            client.post(
+                '/api/shop/orders/bulk-transition/',
+                {'order_numbers': [order.order_number for order in orders], 'status': 'shipped'}, format='json',
+            )
+            return cancel
+
+        cancels = self.run_threads(race)
+        statuses = dict(Order.objects.filter(pk__in=[order.pk for order in orders]).values_list('pk', 'status'))
+        cancelled = [order for order, response in zip(orders, cancels) if response == 200]
+        self.assertEqual(sorted(pk for pk, status in statuses.items() if status == 'cancelled'), sorted(order.pk for order in cancelled))
+        self.assertEqual(set(statuses.values()) - {'cancelled', 'shipped'}, set())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 100 - 2 * (len(orders) - len(cancelled)))
+
+    def test_concurrent_removals_restock_once(self):
+        order, item = self.create_order(3)
+        url = f'/api/shop/orders/{order.order_number}/remove-item/{item.pk}/'
+        statuses = self.run_threads(lambda index: self.staff_client().post(url).status_code)
+        self.assertEqual(sorted(statuses), [200] + [404] * (self.THREADS - 1))
+        self.product.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(self.product.stock, 100)
+        self.assertEqual(order.subtotal_amount, 0)
+
+    def test_adds_racing_removal(self):
+        order, item = self.create_order(1)
+        add_url = f'/api/shop/orders/{order.order_number}/add-item/'
+
+        def edit(index):
+            client = self.staff_client()
+            if index == 0:
+                return client.post(f'/api/shop/orders/{order.order_number}/remove-item/{item.pk}/').status_code
+            return client.post(add_url, {'product': self.product.pk, 'quantity': 1}, format='json').status_code
+
+        self.assertEqual(self.run_threads(edit), [200] * self.THREADS)
+        # Whatever the interleaving, stock plus what the order holds is the starting stock.
+        in_order = sum(OrderItem.objects.filter(order=order).values_list('quantity', flat=True))
+        self.product.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(self.product.stock + in_order, 100)
+        self.assertEqual(order.subtotal_amount, in_order * self.product.price)
@@ -0,0 +1,148 @@
+"""
+Order timelines: live OrderTimeline rows plus archived runs of events in OrderTimelineArchive.
+
+Events are append-only. archive_events() moves every event older than a cutoff into one
+zlib-compressed JSON blob per order and archival run, and deletes the rows in the same
+transaction. An order's archived events are therefore always older than its live ones, and
+its timeline reads as archived blobs, then live rows, both in (timestamp, id) order. Pages are
+cut by that position, so a cursor stays valid across an archival run.
+"""
+import datetime
+import json
+import zlib
+
+from django.db import transaction
+from django.db.models import Q
+
+from core.pagination import KeysetPagination
+
+from .models import OrderTimeline, OrderTimelineArchive
+
+
+ARCHIVE_FORMAT = 1
+EVENT_FIELDS = ('id', 'timestamp', 'status_changed_to', 'note', 'user_triggered')
+
+
+def _event(pk, timestamp, status_changed_to, note, username):
+    """Same shape as OrderTimelineSerializer output."""
+    return dict(zip(EVENT_FIELDS, (pk, timestamp, status_changed_to, note, username)))
+
+
+def _live_rows(queryset, *leading):
+    return queryset.values_list(*leading, 'pk', 'timestamp', 'status_changed_to', 'note', 'user_triggered__username')
+
+
+def encode_events(events):
+    rows = [
+        [event['id'], event['timestamp'].isoformat(), event['status_changed_to'], event['note'], event['user_triggered']]
+        for event in events
+    ]
+    return zlib.compress(json.dumps({'format': ARCHIVE_FORMAT, 'events': rows}, separators=(',', ':')).encode())
+
+
+def decode_events(data):
+    payload = json.loads(zlib.decompress(bytes(data)))
+    return [
+        _event(pk, datetime.datetime.fromisoformat(timestamp), status_changed_to, note, username)
+        for pk, timestamp, status_changed_to, note, username in payload['events']
+    ]
+
+
+def order_events(order_id, after=None, limit=None):
+    """
+    An order's events as dicts, oldest first: archived ones, then live ones. `after` is a
+    (timestamp, id) position to start behind; `limit` caps the number returned.
+    """
+    events = []
+    archives = OrderTimelineArchive.objects.filter(order_id=order_id).order_by('last_event_at', 'last_event_id')
+    live = OrderTimeline.objects.filter(order_id=order_id).order_by('timestamp', 'pk')
+    if after is not None:
+        timestamp, pk = after
+        archives = archives.filter(Q(last_event_at__gt=timestamp) | Q(last_event_at=timestamp, last_event_id__gt=pk))
+        live = live.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, pk__gt=pk), timestamp__gte=timestamp)
+
+    for data in archives.values_list('data', flat=True).iterator():
+        for event in decode_events(data):
+            if after is None or (event['timestamp'], event['id']) > tuple(after):
+                events.append(event)
+        if limit is not None and len(events) >= limit:
+            return events[:limit]
+
+    remaining = None if limit is None else limit - len(events)
+    rows = _live_rows(live)
+    events.extend(_event(*row) for row in (rows[:remaining] if remaining is not None else rows))
+    return events
+
+
+def order_events_for(order_ids):
+    """{order id: its events, as order_events() returns them} for many orders, in two queries."""
+    events = {order_id: [] for order_id in order_ids}
+    archives = OrderTimelineArchive.objects.filter(order_id__in=events).order_by('order_id', 'last_event_at', 'last_event_id')
+    for order_id, data in archives.values_list('order_id', 'data').iterator():
+        events[order_id].extend(decode_events(data))
+    live = OrderTimeline.objects.filter(order_id__in=events).order_by('order_id', 'timestamp', 'pk')
+    for order_id, *row in _live_rows(live, 'order_id'):
+        events[order_id].append(_event(*row))
+    return events
+
+
+class TimelinePagination(KeysetPagination):
+    """
+    Forward-only keyset pages over one order's timeline (archived, then live events), with
+    KeysetPagination's cursor format and response shape.
+    """
+    page_size = 100
+    max_page_size = 1000
+
+    def paginate_order(self, order, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        params = self.get_query_params(request)
+        page_size = self.get_page_size(params)
+        self.keys = [(OrderTimeline._meta.get_field('timestamp'), False), (OrderTimeline._meta.pk, False)]
+        cursor = self.decode_cursor(params.get(self.cursor_query_param))
+        events = order_events(order.pk, after=cursor['v'] if cursor else None, limit=page_size + 1)
+        self.has_next = len(events) > page_size
+        self.has_previous = False
+        events = events[:page_size]
+        self.last_values = [events[-1]['timestamp'], events[-1]['id']] if events else None
+        return events
+
+
+def archive_events(before, batch_size=500):
+    """
+    Moves the events older than `before` into one archive blob per order, batch_size orders per
+    transaction. Returns (orders, events) archived.
+    """
+    old = OrderTimeline.objects.filter(timestamp__lt=before)
+    archived_orders = archived_events = 0
+    last_order_id = 0
+    while True:
+        # Walks the (order, timestamp) index in order id order.
+        order_ids = list(
+            old.filter(order_id__gt=last_order_id).order_by('order_id')
+            .values_list('order_id', flat=True).distinct()[:batch_size]
+        )
+        if not order_ids:
+            return archived_orders, archived_events
+        last_order_id = order_ids[-1]
+        with transaction.atomic():
+            events = {}
+            rows = _live_rows(old.filter(order_id__in=order_ids).order_by('order_id', 'timestamp', 'pk'), 'order_id')
+            for order_id, *row in rows:
+                events.setdefault(order_id, []).append(_event(*row))
+            OrderTimelineArchive.objects.bulk_create([
+                OrderTimelineArchive(
+                    order_id=order_id,
+                    first_event_at=batch[0]['timestamp'],
+                    last_event_at=batch[-1]['timestamp'],
+                    last_event_id=batch[-1]['id'],
+                    event_count=len(batch),
+                    data=encode_events(batch),
+                )
+                for order_id, batch in events.items()
+            ])
+            # Events are append-only and stamped on insert, so none can have joined the batch since.
+            deleted, _ = old.filter(order_id__in=order_ids).delete()
+        archived_orders += len(events)
+        archived_events += deleted
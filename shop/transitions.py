@@ -0,0 +1,141 @@
+"""
+Order status transitions, one order or many at a time.
+
+transition_orders() moves a batch of orders to one status with a handful of set-based
+statements per chunk, whatever the chunk size: lock and read the orders, one UPDATE for the
+orders, one for their shipments, one bulk INSERT of timeline events and, for cancellations,
+one aggregated stock UPDATE per RESTOCK_BATCH products. Each order gets an outcome, so a
+batch with a few orders in the wrong status still moves the rest.
+
+UPDATEs skip the model signals; receivers of `orders_transitioned` (dashboard/signals.py)
+get the changed orders instead.
+"""
+from django.db import transaction as django_db_transaction
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.dispatch import Signal
+from django.utils import timezone
+
+from . import inventory
+from .models import Order, OrderItem, OrderTimeline, Shipment
+
+
+# Statuses an order may move to from each status.
+ALLOWED_TRANSITIONS = {
+    'pending': {'processing', 'cancelled'},
+    'processing': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': {'refunded'},
+    'cancelled': set(),
+    'refunded': set(),
+}
+
+# How each order status carries over to the order's shipment: (shipment statuses moved, new status).
+SHIPMENT_TRANSITIONS = {
+    'shipped': (('pending', 'ready_to_ship'), 'shipped'),
+    'delivered': (('pending', 'ready_to_ship', 'shipped', 'in_transit', 'failed_delivery'), 'delivered'),
+    'cancelled': (('pending', 'ready_to_ship'), 'cancelled'),
+}
+
+CHUNK_SIZE = 1000
+RESTOCK_BATCH = 500
+
+# Outcomes reported per order.
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+NOT_ALLOWED = 'not_allowed'
+NOT_FOUND = 'not_found'
+
+# Sent inside the transaction after each chunk is applied, with
+# changes=[(pk, created_at, discount_amount, old status, new status)].
+orders_transitioned = Signal()
+
+
+def can_transition(from_status, to_status):
+    return to_status in ALLOWED_TRANSITIONS.get(from_status, ())
+
+
+def transition_orders(order_numbers, to_status, user=None, note='', chunk_size=CHUNK_SIZE):
+    """
+    Moves the orders with these numbers to `to_status`. Returns one outcome per distinct
+    order number, in the order given: {'order_number', 'result', 'from_status', 'detail'}.
+    Each chunk is applied in its own transaction.
+    """
+    if to_status not in ALLOWED_TRANSITIONS:
+        raise ValueError(f"Unknown order status '{to_status}'.")
+    order_numbers = list(dict.fromkeys(order_numbers))
+    outcomes = {}
+    for start in range(0, len(order_numbers), chunk_size):
+        chunk = order_numbers[start:start + chunk_size]
+        outcomes.update(_transition_chunk(chunk, to_status, user, note))
+    return [outcomes[number] for number in order_numbers]
+
+
+def _outcome(order_number, result, from_status=None, detail=''):
+    return {'order_number': order_number, 'result': result, 'from_status': from_status, 'detail': detail}
+
+
+@django_db_transaction.atomic
+def _transition_chunk(order_numbers, to_status, user, note):
+    rows = (
+        Order.objects.select_for_update().order_by()
+        .filter(order_number__in=order_numbers)
+        .values_list('pk', 'order_number', 'status', 'created_at', 'discount_amount')
+    )
+    outcomes = {number: _outcome(number, NOT_FOUND, detail='Order not found.') for number in order_numbers}
+    moving = []
+    for pk, number, from_status, created_at, discount in rows:
+        if from_status == to_status:
+            outcomes[number] = _outcome(number, UNCHANGED, from_status, f'Order is already {to_status}.')
+        elif not can_transition(from_status, to_status):
+            outcomes[number] = _outcome(number, NOT_ALLOWED, from_status, f'Order in status "{from_status}" cannot move to "{to_status}".')
+        else:
+            outcomes[number] = _outcome(number, UPDATED, from_status)
+            moving.append((pk, created_at, discount, from_status))
+    if not moving:
+        return outcomes
+
+    now = timezone.now()
+    pks = [pk for pk, _, _, _ in moving]
+    Order.objects.filter(pk__in=pks).update(status=to_status, updated_at=now)
+    _move_shipments(pks, to_status, now)
+    if to_status == 'cancelled':
+        _restock(pks)
+
+    suffix = f' {note}' if note else ''
+    OrderTimeline.objects.bulk_create([
+        OrderTimeline(
+            order_id=pk, user_triggered=user, status_changed_to=to_status,
+            note=f'Order status changed from {from_status} to {to_status}.{suffix}',
+        )
+        for pk, _, _, from_status in moving
+    ])
+    orders_transitioned.send(
+        sender=Order,
+        changes=[(pk, created_at, discount, from_status, to_status) for pk, created_at, discount, from_status in moving],
+    )
+    return outcomes
+
+
+def _move_shipments(order_ids, to_status, now):
+    if to_status not in SHIPMENT_TRANSITIONS:
+        return
+    from_statuses, shipment_status = SHIPMENT_TRANSITIONS[to_status]
+    shipments = Shipment.objects.filter(order_id__in=order_ids, status__in=from_statuses)
+    if shipment_status == 'shipped':
+        shipments.update(status='shipped', shipped_at=Coalesce('shipped_at', now), updated_at=now)
+    elif shipment_status == 'delivered':
+        shipments.update(status='delivered', actual_delivery_date=Coalesce('actual_delivery_date', now.date()), updated_at=now)
+    else:
+        shipments.update(status=shipment_status, updated_at=now)
+
+
+def _restock(order_ids):
+    """Returns the items of cancelled orders to stock, one UPDATE per RESTOCK_BATCH products."""
+    quantities = dict(
+        OrderItem.objects.filter(order_id__in=order_ids).order_by()
+        .values('product_id').annotate(quantity=Sum('quantity')).values_list('product_id', 'quantity')
+    )
+    product_ids = sorted(quantities)
+    for start in range(0, len(product_ids), RESTOCK_BATCH):
+        inventory.return_stock({product_id: quantities[product_id] for product_id in product_ids[start:start + RESTOCK_BATCH]})
@@ -7,35 +7,50 @@ from django.db import transaction as django_db_transaction
 from .forms import CategoryForm, ProductForm, ProductImageForm, ProductAttributeForm
 
 # Existing DRF API View imports
-from rest_framework import generics, permissions, status, viewsets # Ensure status is imported
+from rest_framework import generics, mixins, permissions, status, viewsets # Ensure status is imported
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.utils import timezone 
+from django.db.models import Count, F, Max, Prefetch
 from django.contrib.auth.models import User 
+from django.http import Http404
 from decimal import Decimal
 
+from core.conditional import ConditionalGetMixin
+from core.pagination import KeysetPagination, paginate_for_template
+
 from .models import (
     Category, Product, ProductImage, ProductAttribute,
     Address, Order, OrderItem, OrderTimeline, 
-    Carrier, Shipment 
+    Carrier, Shipment, StockReservation
 )
 from .serializers import (
-    CategorySerializer, ProductSerializer, 
+    CategorySerializer, CategoryListSerializer, ProductSerializer, 
     ProductImageSerializer, ProductAttributeSerializer,
     ProductImageCreateSerializer, ProductAttributeCreateSerializer,
-    AddressSerializer, OrderSerializer, OrderCreateUpdateSerializer,
-    OrderItemCreateSerializer, OrderTimelineSerializer,
-    CarrierSerializer, ShipmentSerializer, ShipmentUpdateSerializer 
+    AddressSerializer, OrderSerializer, OrderListSerializer, OrderCreateUpdateSerializer,
+    OrderItemCreateSerializer, OrderTimelineSerializer, OrderBulkTransitionSerializer,
+    CarrierSerializer, ShipmentSerializer, ShipmentUpdateSerializer,
+    StockReservationSerializer, StockHoldSerializer
 )
+from . import categories, inventory, product_cache, timeline, transitions
+from .checkout import merge_order_lines
+from .inventory import InsufficientStock
+from .search import ProductFullTextSearchFilter
+from .filters import ProductSearchFilterSet, attribute_facets
 
 
 # API ViewSets (Keep all existing API Viewsets as they are)
 # CategoryViewSet, ProductViewSet, AddressViewSet, OrderViewSet, CarrierViewSet, ShipmentViewSet, ProductSearchView
 # ... (all existing API view code remains here) ...
-class CategoryViewSet(viewsets.ModelViewSet):
-    queryset = Category.objects.all().prefetch_related('children', 'products')
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    """
+    ?expand=products embeds the first NESTED_PRODUCTS_LIMIT products of each category;
+    ?fields=id,name,... limits the returned fields. Nothing is prefetched unless expanded.
+    """
+    queryset = Category.objects.all().select_related('parent')
     serializer_class = CategorySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly] 
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
@@ -43,24 +58,80 @@ class CategoryViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'description']
     ordering_fields = ['name', 'created_at']
     lookup_field = 'slug' # Allow lookup by slug
+    expandable = {'products'}
+    NESTED_PRODUCTS_LIMIT = 20
+    conditional_fields = ('updated_at', 'parent__updated_at')
+
+    def get_conditional_aggregates(self):
+        aggregates = super().get_conditional_aggregates()
+        if 'products' in self.get_expand():
+            aggregates['modified_products'] = Max('products__updated_at')
+            aggregates['product_count'] = Count('products', distinct=True)
+        return aggregates
+
+    def get_expand(self):
+        if self.request.method not in permissions.SAFE_METHODS:
+            return set()
+        requested = self.request.query_params.get('expand', '')
+        return {name.strip() for name in requested.split(',')} & self.expandable
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if 'products' in self.get_expand():
+            # One windowed query for the first N products of every category on the page.
+            nested = Product.objects.select_related('category').prefetch_related('images', 'attributes')
+            queryset = queryset.prefetch_related(
+                Prefetch('products', queryset=nested[:self.NESTED_PRODUCTS_LIMIT], to_attr='nested_products')
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'root_categories'):
+            return CategoryListSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        fields = self.request.query_params.get('fields') if self.request.method in permissions.SAFE_METHODS else None
+        if fields:
+            context['fields'] = {name.strip() for name in fields.split(',') if name.strip()}
+        return context
 
     @action(detail=False, methods=['get'], url_path='root-categories')
     def root_categories(self, request):
-        root_cats = Category.objects.filter(parent__isnull=True)
-        serializer = self.get_serializer(root_cats, many=True, context={'omit_parent_slug_if_null': True, 'request': request})
+        root_cats = self.get_queryset().filter(parent__isnull=True)
+        serializer = self.get_serializer(root_cats, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='tree')
+    def tree(self, request):
+        # Served from the in-process tree: no query unless a category changed since the last load.
+        def serialize(nodes):
+            return [
+                {'id': c.pk, 'name': c.name, 'slug': c.slug, 'children': serialize(c.child_nodes)}
+                for c in nodes
+            ]
+        return Response(serialize(categories.get_tree().roots))
+
     @action(detail=True, methods=['get'], url_path='products')
     def products_in_category(self, request, slug=None): # Changed pk to slug
         category = self.get_object()
-        products = Product.objects.filter(category=category)
-        serializer = ProductSerializer(products, many=True, context={'request': request})
-        return Response(serializer.data)
+        # Products of the category and all its subcategories: one range over Category.path.
+        products = (
+            Product.objects.filter(category.subtree_q('category__'))
+            .select_related('category').prefetch_related('images', 'attributes')
+        )
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(products, request)
+        serializer = ProductSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all().prefetch_related('images', 'attributes')
+class ProductViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.all().select_related('category').prefetch_related('images', 'attributes')
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = {
         'category__slug': ['exact'], # Filter by category slug
@@ -72,10 +143,31 @@ class ProductViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'description', 'category__name', 'attributes__name', 'attributes__value']
     ordering_fields = ['name', 'price', 'stock', 'created_at', 'updated_at']
     lookup_field = 'slug' # Allow lookup by slug
+    conditional_fields = ('updated_at', 'category__updated_at') # the category name is embedded
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
+    def retrieve(self, request, *args, **kwargs):
+        # Served from the product detail cache (shop/product_cache.py); the representation
+        # embeds absolute image URLs, so it is cached per host.
+        def load(pk):
+            instance = self.get_queryset().select_related('category').filter(pk=pk).first()
+            return None if instance is None else self.get_serializer(instance).data
+
+        def render():
+            data = product_cache.get_product(kwargs[self.lookup_field], load, variant=request.get_host())
+            if data is None:
+                raise Http404
+            return Response(data)
+
+        return self.conditional_response(self.get_object_queryset(), render, listing=False)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        # Counters are per process.
+        return Response(product_cache.get_stats())
+
     @action(detail=True, methods=['post'], url_path='add-image', serializer_class=ProductImageCreateSerializer)
     def add_image(self, request, slug=None): # Changed pk to slug
         product = self.get_object()
@@ -117,29 +209,33 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response({'detail': 'Attribute not found.'}, status=status.HTTP_404_NOT_FOUND)
 
 class ProductSearchView(generics.ListAPIView):
-    queryset = Product.objects.all().prefetch_related('images', 'attributes')
+    queryset = Product.objects.all().select_related('category').prefetch_related('images', 'attributes')
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = {
-        'category__slug': ['exact'],
-        'price': ['gte', 'lte'],
-        'available': ['exact'],
-        'attributes__name': ['exact'],
-        'attributes__value': ['exact'], 
-    }
-    search_fields = ['name', 'description', 'category__name'] 
+    # ?search= goes through the full-text index (ranked by relevance unless ?ordering= is given)
+    filter_backends = [DjangoFilterBackend, ProductFullTextSearchFilter, OrderingFilter]
+    filterset_class = ProductSearchFilterSet
     ordering_fields = ['name', 'price', 'created_at']
     permission_classes = [permissions.AllowAny]
 
+class ProductFacetsView(ProductSearchView):
+    """
+    Attribute value counts (e.g. Color: Red (123), Blue (45)) for the products matching the same
+    filters and search as ProductSearchView, in a single grouped query.
+    """
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(Product.objects.all())
+        return Response(attribute_facets(queryset))
+
 class AddressViewSet(viewsets.ModelViewSet):
     queryset = Address.objects.all()
     serializer_class = AddressSerializer
     permission_classes = [permissions.IsAuthenticated] 
 
     def get_queryset(self):
+        addresses = Address.objects.select_related('user') # AddressSerializer shows the user
         if self.request.user.is_staff:
-            return Address.objects.all()
-        return Address.objects.filter(user=self.request.user)
+            return addresses.all()
+        return addresses.filter(user=self.request.user)
 
     def perform_create(self, serializer):
         if not serializer.validated_data.get('user_id') or not self.request.user.is_staff:
@@ -148,12 +244,17 @@ class AddressViewSet(viewsets.ModelViewSet):
             serializer.save()
 
 class OrderViewSet(viewsets.ModelViewSet):
+    """
+    Lists leave the timeline out (?expand=timeline adds it); detail embeds it and
+    GET <order_number>/timeline/ pages through it.
+    """
     queryset = Order.objects.all().select_related(
-        'user', 'shipping_address', 'billing_address'
+        'user', 'shipping_address__user', 'billing_address__user' # addresses are serialized with their user
     ).prefetch_related(
-        'items__product', 'timeline_events__user_triggered'
+        'items__product'
     )
     permission_classes = [permissions.IsAuthenticated] 
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = {
         'status': ['exact'],
@@ -165,20 +266,34 @@ class OrderViewSet(viewsets.ModelViewSet):
     search_fields = ['order_number', 'user__username', 'email', 'items__product__name']
     ordering_fields = ['created_at', 'total_amount', 'status']
     lookup_field = 'order_number' # Use order_number for lookup
+    expandable = {'timeline'}
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
             return OrderCreateUpdateSerializer
+        if self.action == 'list':
+            return OrderListSerializer
         return OrderSerializer
 
+    def get_expand(self):
+        if self.request.method not in permissions.SAFE_METHODS:
+            return set()
+        requested = self.request.query_params.get('expand', '')
+        return {name.strip() for name in requested.split(',')} & self.expandable
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all()
+            return self.queryset.all()
         # Allow users to see their own orders, identified by user or by email for guest orders.
         # This requires careful consideration if email is not unique across User accounts and guest orders.
         # For simplicity, if user is authenticated, show their orders.
         # If staff, show all. Access for guest orders via API would need a different mechanism (e.g. signed URL or specific token).
-        return Order.objects.filter(user=self.request.user)
+        return self.queryset.filter(user=self.request.user)
 
 
     def perform_create(self, serializer):
@@ -196,22 +311,35 @@ class OrderViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], url_path='cancel-order')
     def cancel_order(self, request, order_number=None): # Changed pk to order_number
         order = self.get_object()
-        if order.status in ['shipped', 'delivered', 'cancelled', 'refunded']:
-            return Response({'detail': f'Order in status "{order.status}" cannot be cancelled.'}, status=status.HTTP_400_BAD_REQUEST)
-        for item in order.items.all():
-            item.product.stock += item.quantity
-            item.product.save(update_fields=['stock'])
-        order.status = 'cancelled'
-        order.save(update_fields=['status'])
-        OrderTimeline.objects.create(order=order, note="Order cancelled.", user_triggered=request.user, status_changed_to='cancelled')
+        # Same path as bulk-transition: the order row is locked, its status re-checked and its
+        # items restocked in one transaction, so concurrent cancels restock once.
+        outcome, = transitions.transition_orders([order.order_number], 'cancelled', user=request.user)
+        if outcome['result'] != transitions.UPDATED:
+            return Response({'detail': f'Order in status "{outcome["from_status"]}" cannot be cancelled.'}, status=status.HTTP_400_BAD_REQUEST)
+        order.refresh_from_db()
         return Response(OrderSerializer(order, context={'request': request}).data)
     
+    @action(detail=False, methods=['post'], url_path='bulk-transition', permission_classes=[permissions.IsAdminUser])
+    def bulk_transition(self, request):
+        """Moves many orders to one status; reports an outcome per order (see shop/transitions.py)."""
+        serializer = OrderBulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = transitions.transition_orders(
+            serializer.validated_data['order_numbers'], serializer.validated_data['status'],
+            user=request.user, note=serializer.validated_data['note'],
+        )
+        counts = {}
+        for outcome in results:
+            counts[outcome['result']] = counts.get(outcome['result'], 0) + 1
+        return Response({'status': serializer.validated_data['status'], 'counts': counts, 'results': results})
+
     @action(detail=True, methods=['get'], url_path='timeline')
     def view_timeline(self, request, order_number=None): # Changed pk to order_number
+        """Oldest first, ?page_size events per page (archived ones included); follow `next` for more."""
         order = self.get_object()
-        timeline_events = order.timeline_events.all().order_by('timestamp')
-        serializer = OrderTimelineSerializer(timeline_events, many=True)
-        return Response(serializer.data)
+        paginator = timeline.TimelinePagination()
+        events = paginator.paginate_order(order, request)
+        return paginator.get_paginated_response(OrderTimelineSerializer(events, many=True).data)
 
     @action(detail=True, methods=['post'], url_path='add-item', serializer_class=OrderItemCreateSerializer)
     def add_order_item(self, request, order_number=None): # Changed pk to order_number
@@ -222,20 +350,20 @@ class OrderViewSet(viewsets.ModelViewSet):
         if serializer.is_valid():
             product = serializer.validated_data['product']
             quantity = serializer.validated_data['quantity']
-            if product.stock < quantity:
-                return Response({'detail': f'Not enough stock for {product.name}.'}, status=status.HTTP_400_BAD_REQUEST)
-            order_item, created = OrderItem.objects.get_or_create(
-                order=order, product=product,
-                defaults={'quantity': quantity, 'price_at_purchase': product.price}
-            )
-            if not created:
-                if product.stock < (order_item.quantity + quantity) : 
-                     return Response({'detail': f'Not enough stock for additional quantity of {product.name}.'}, status=status.HTTP_400_BAD_REQUEST)
-                order_item.quantity += quantity
-                order_item.save()
-            product.stock -= quantity 
-            product.save(update_fields=['stock'])
-            order.update_totals()
+            try:
+                with django_db_transaction.atomic():
+                    if not self._lock_pending(order):
+                        return Response({'detail': 'Items can only be added to orders with appropriate status (e.g. pending).'}, status=status.HTTP_400_BAD_REQUEST)
+                    inventory.take_stock({product.pk: quantity})
+                    order_item, created = OrderItem.objects.get_or_create(
+                        order=order, product=product,
+                        defaults={'quantity': quantity, 'price_at_purchase': product.price}
+                    )
+                    if not created:
+                        OrderItem.objects.filter(pk=order_item.pk).update(quantity=F('quantity') + quantity)
+                    order.apply_item_delta(order_item.price_at_purchase * quantity)
+            except InsufficientStock as e:
+                return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             OrderTimeline.objects.create(order=order, note=f"Item {product.name} (Qty: {quantity}) added.", user_triggered=request.user)
             return Response(OrderSerializer(order, context={'request': request}).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -245,19 +373,24 @@ class OrderViewSet(viewsets.ModelViewSet):
         order = self.get_object()
         if order.status != 'pending':
              return Response({'detail': 'Items can only be removed from orders with appropriate status.'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            order_item = OrderItem.objects.get(id=item_id, order=order)
-        except OrderItem.DoesNotExist:
-            return Response({'detail': 'Order item not found.'}, status=status.HTTP_404_NOT_FOUND)
-        product = order_item.product
-        quantity_removed = order_item.quantity
-        order_item.delete()
-        product.stock += quantity_removed
-        product.save(update_fields=['stock'])
-        order.update_totals()
-        OrderTimeline.objects.create(order=order, note=f"Item {product.name} (Qty: {quantity_removed}) removed.", user_triggered=request.user)
+        with django_db_transaction.atomic():
+            if not self._lock_pending(order):
+                return Response({'detail': 'Items can only be removed from orders with appropriate status.'}, status=status.HTTP_400_BAD_REQUEST)
+            # Read under the order lock, so a concurrent add-item increment is restocked too.
+            order_item = OrderItem.objects.filter(id=item_id, order=order).select_related('product').first()
+            deleted = order_item and OrderItem.objects.filter(pk=order_item.pk).delete()[0]
+            if not deleted:
+                return Response({'detail': 'Order item not found.'}, status=status.HTTP_404_NOT_FOUND)
+            inventory.return_stock({order_item.product_id: order_item.quantity})
+            order.apply_item_delta(-order_item.get_total_price())
+        OrderTimeline.objects.create(order=order, note=f"Item {order_item.product.name} (Qty: {order_item.quantity}) removed.", user_triggered=request.user)
         return Response(OrderSerializer(order, context={'request': request}).data)
 
+    @staticmethod
+    def _lock_pending(order):
+        """Locks the order row until the end of the transaction; False if it is no longer pending."""
+        return Order.objects.select_for_update().filter(pk=order.pk, status='pending').values_list('pk', flat=True).first() is not None
+
     @action(detail=True, methods=['post'], url_path='apply-coupon')
     def apply_coupon(self, request, order_number=None): # Changed pk to order_number
         order = self.get_object()
@@ -276,6 +409,36 @@ class OrderViewSet(viewsets.ModelViewSet):
         else:
             return Response({'detail': 'Invalid coupon code.'}, status=status.HTTP_400_BAD_REQUEST)
 
+class StockReservationViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Short-lived stock holds for a cart. POST holds a batch of lines, `release` returns them.
+    Live holds can be passed as `reservation_ids` when creating the order; abandoned ones
+    are returned by the `expire_stock_holds` management command.
+    """
+    serializer_class = StockReservationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return StockReservation.objects.filter(user=self.request.user).select_related('product')
+
+    def create(self, request):
+        serializer = StockHoldSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        try:
+            reservations = inventory.hold(merge_order_lines(serializer.validated_data['items']), user=request.user)
+        except InsufficientStock as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(StockReservationSerializer(reservations, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='release')
+    def release(self, request):
+        ids = request.data.get('ids')
+        if not isinstance(ids, list) or not ids:
+            return Response({'detail': 'A list of reservation ids is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        released = inventory.release(ids, user=request.user)
+        return Response({'released': released})
+
 class CarrierViewSet(viewsets.ModelViewSet):
     queryset = Carrier.objects.all()
     serializer_class = CarrierSerializer
@@ -294,6 +457,7 @@ class CarrierViewSet(viewsets.ModelViewSet):
 class ShipmentViewSet(viewsets.ModelViewSet):
     queryset = Shipment.objects.all().select_related('order', 'carrier')
     permission_classes = [permissions.IsAdminUser] 
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = {
         'status': ['exact'],
@@ -400,10 +564,11 @@ class ShipmentViewSet(viewsets.ModelViewSet):
 def category_list_view(request):
     # Fetch all categories to correctly build the parent dropdown in forms later if needed,
     # but the template will display them hierarchically starting from roots.
-    categories = Category.objects.filter(parent__isnull=True).prefetch_related('children__children') # Deeper prefetch for multi-level
+    # The whole tree (any depth) with product counts in one query, linked in memory.
+    tree = categories.load_tree(Category.objects.annotate(product_count=Count('products')))
     all_categories_for_select = Category.objects.all().order_by('name') # For dropdowns
     context = {
-        'categories': categories, # Root categories for display
+        'categories': tree.roots, # Root categories for display
         'all_categories_for_select': all_categories_for_select, # For forms
         'page_title': 'Shop Categories',
         'breadcrumb_active': 'Categories'
@@ -457,9 +622,11 @@ def category_edit_view(request, category_slug):
 
 @staff_member_required
 def product_list_view(request):
-    products = Product.objects.all().select_related('category', 'created_by').prefetch_related('images').order_by('-created_at')
+    products = Product.objects.all().select_related('category', 'created_by').prefetch_related('images')
+    products, pagination = paginate_for_template(request, products)
     context = {
         'products': products,
+        'pagination': pagination,
         'page_title': 'Product List',
         'breadcrumb_active': 'Products'
     }
@@ -2,6 +2,8 @@ from django.db import models
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 
+from core import conditional
+
 class Setting(models.Model):
     SETTING_TYPE_CHOICES = [
         ('string', 'String'),
@@ -67,10 +69,12 @@ class Setting(models.Model):
         super().save(*args, **kwargs)
         # Cache invalidation/update
         cache.set(f"setting_{self.key}", self.get_value(), timeout=None) # Cache indefinitely until changed
+        conditional.touch(Setting) # e.g. no longer public: the public settings' Last-Modified moves on
 
     def delete(self, *args, **kwargs):
         cache.delete(f"setting_{self.key}")
         super().delete(*args, **kwargs)
+        conditional.touch(Setting)
 
     def get_value(self):
         """Returns the value cast to its Python type."""
@@ -1,3 +1,12 @@
 from django.test import TestCase
 
-# Create your tests here.
+from core.query_count import QueryBudgetMixin
+from core.sample_data import create_sample_rows
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    router_module = 'site_settings.urls'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_sample_rows()
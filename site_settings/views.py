@@ -5,10 +5,12 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.core.cache import cache # For cache clearing action, if needed beyond model signals
 
+from core.conditional import ConditionalGetMixin
+
 from .models import Setting
 from .serializers import SettingSerializer
 
-class SettingViewSet(viewsets.ModelViewSet):
+class SettingViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Setting.objects.all()
     serializer_class = SettingSerializer
     permission_classes = [permissions.IsAdminUser] # Only admins can manage settings
@@ -53,8 +55,11 @@ class SettingViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='public', permission_classes=[permissions.AllowAny]) # Publicly accessible
     def public_settings(self, request):
         """Retrieves all settings marked as public."""
-        public_settings_dict = Setting.get_public_settings()
-        return Response(public_settings_dict)
+        # Validated against the public settings' timestamps before reading any values.
+        return self.conditional_response(
+            Setting.objects.filter(is_public=True),
+            lambda: Response(Setting.get_public_settings()),
+        )
 
     @action(detail=False, methods=['post'], url_path='clear-cache', permission_classes=[permissions.IsAdminUser])
     def clear_cache_all(self, request):